@@ -70,7 +70,6 @@ Sobre el precio de compra:
 - ¿Cual es la relación entre el precio del inmueble y el precio del alquiler por distrito?
 - ¿Cual es la relación entre el precio del inmueble y la ocupación por distrito?"""
 
-import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -78,16 +77,33 @@ import seaborn as sns
 # %matplotlib inline # para que los gráficos aparezcan en Jupyter Notebook
 # %config IPCompleter.greedy=True # cuando pulsamos la tecla tabuladora que autocomplete
 
+# Cada paso lógico está marcado con empezar() / terminar() (instrumentacion.py). Con INSTRUMENTACION=1 se guarda en informes/
+# un JSON con el tiempo, la CPU, la memoria y las filas de cada paso. Sin la variable no hacen nada.
+
+from instrumentacion import empezar, terminar
+
 # ENTENDER LOS FICHEROS
 
 # En la web de AirBnB podemos ver la descripción de las tablas:
 
+empezar('carga_listings')
 listings = pd.read_csv('DatosCaso1/listings.csv')
+terminar('carga_listings', salida = listings)
 
 print(listings.head())
 print(listings.info())
 
-listings_det = pd.read_csv('DatosCaso1/listings.csv.gz',compression='gzip') # el archivo de listing con más detalles
+# listings_det = pd.read_csv('DatosCaso1/listings.csv.gz',compression='gzip') # el archivo de listing con más detalles
+
+# El archivo de listing con más detalles tiene unas 75 columnas, algunas de texto libre muy grandes, y solo vamos a usar 11.
+# En vez de leerlo entero lo leemos por bloques y solo con las columnas que necesitamos y sus tipos ya definidos (ver ingesta.py).
+# Para comparar el pico de memoria de ambas formas: python ingesta.py DatosCaso1/listings.csv.gz
+
+from ingesta import leer_listings_det
+
+empezar('carga_listings_det')
+listings_det = leer_listings_det('DatosCaso1/listings.csv.gz')
+terminar('carga_listings_det', salida = listings_det)
 
 print(listings_det.head())
 print(listings_det.info())
@@ -109,6 +125,8 @@ print(reviews_det.info())"""
 
 # - Son los mismos registros pero el fichero de detalle tiene más columnas.
 # - Realmente esta info de las reseñas no nos aporta nada a nuestro objetivo, así que no usaremos estas tablas
+# - Salvo para estimar la ocupación real: resenas.py lee reviews.csv.gz por bloques, cuenta reseñas por inmueble y mes y estima
+#   las noches reservadas, que el script de variables cruza por id: python resenas.py DatosCaso1/reviews.csv.gz DatosCaso1/listings.csv
 
 # Vamos a revisar el archivo calendar (a futuro)
 
@@ -120,6 +138,10 @@ print(calendar.info())"""
 # - Esta tabla se proyecta hacia el futuro, y parece contener la disponibilidad de reservas
 # - No es información que nos sirva a nuestros fines y por tanto no la usaremos. Podríamos utilizar la availability del fichero listing
 
+# - Cargarla entera no es viable (una fila por inmueble y día). calendario.py la lee por bloques y guarda en el datamart la
+#   ocupación por inmueble y mes (calendario_mensual) y un resumen por inmueble (calendario) que usa el script de variables:
+#   python calendario.py DatosCaso1/calendar.csv.gz DatosCaso1/airbnb.db
+
 # Vamos a revisar el archivo neighbourhoods
 
 """neigh = pd.read_csv('DatosCaso1/neighbourhoods.csv')
@@ -139,6 +161,10 @@ print(neigh_geo.info())"""
 
 # - Más pensado para hacer una elaboración de mapas más detallada (geometría)
 
+# Con los polígonos de los barrios podemos comprobar que el barrio y el distrito de cada inmueble cuadran con su
+# posición y tener la superficie de cada barrio. geometria.py los carga una vez y asigna todos los inmuebles de una pasada
+# (punto en polígono vectorizado con un índice de cajas y franjas). Lo usamos en el script de variables (tabla densidad_barrios).
+
 # CREACIÓN DE UNA BASE DE DATOS
 
 # Usaremos una base de datos sqlite, sin servidor y sin configuración, un formato ideal para almacenar proyectos "propios".
@@ -148,10 +174,26 @@ import sqlalchemy as sa
 
 con = sa.create_engine('sqlite:///DatosCaso1/airbnb.db')
 
+# Este script (y los de variables e insights) recorren paso a paso una ciudad y una descarga. Para procesar varias ciudades y
+# descargas mensuales, cada una con su propio datamart y en paralelo, está pipeline.py (python pipeline.py datos --procesos 4),
+# que además junta los KPIs de todas en datos/kpis.db.
+
 # Creamos las tablas y cargamos los datos
 
-listings.to_sql('listings', con = con, if_exists = 'replace')
-listings_det.to_sql('listings_det', con = con, if_exists = 'replace')
+# listings.to_sql('listings', con = con, if_exists = 'replace')
+# listings_det.to_sql('listings_det', con = con, if_exists = 'replace')
+
+# to_sql por defecto inserta fila a fila, guarda el índice de pandas como columna y no crea índices.
+# En persistencia.py tenemos una escritura masiva (por lotes, en una transacción, con tipos explícitos) que además
+# indexa las claves por las que luego cruzamos y agrupamos (id, distrito, neighbourhood...).
+# Para comparar tiempos y tamaño del fichero: python persistencia.py DatosCaso1/listings.csv.gz
+
+from persistencia import guardar_tabla
+
+empezar('guardado_fuentes')
+guardar_tabla(listings, 'listings', con)
+guardar_tabla(listings_det, 'listings_det', con)
+terminar('guardado_fuentes')
 
 # CREACIÓN DEL DATAMART ANALÍTICO
 
@@ -169,8 +211,10 @@ insp = inspect(con)
 tablas = insp.get_table_names()
 print(tablas)
 
+empezar('lectura_fuentes')
 listings = pd.read_sql('listings', con)
 listings_det = pd.read_sql('listings_det', con)
+terminar('lectura_fuentes', salida = listings)
 
 # Si hubieran muchas tablas podrías utilizar
 # for tabla in tablas:
@@ -187,20 +231,21 @@ listings_det = pd.read_sql('listings_det', con)
 # Podemos extraerla de forma sencilla con el plugin instant data scraper de Chrome, y guardarla en nuestra carpeta Datos con el nombre 'precios_idealista.read_csv'
 # Cargamos los datos, quitamos el primer registro y seleccionamos solo las columnas de precio y distrito
 
-precio_m2 = pd.read_csv('DatosCaso1/precios_idealista.csv')
-
-print(precio_m2.head())
-print(precio_m2.info())
+# Los pasos de limpieza de este script están como funciones en limpieza.py (las mismas que usan incremental.py y etapas.py),
+# así que los criterios solo están en un sitio. Aquí las vamos llamando una a una con los análisis entre medias.
 
-precio_m2 = pd.read_csv('DatosCaso1/precios_idealista.csv') \
-	.loc[1:,['table__cell','icon-elbow']] \
-    .rename(columns = {'table__cell':'precio_m2','icon-elbow':'distrito'})
+from limpieza import (construir_df, excluir_tipos, filtrar_precio, imputar_bedrooms, imputar_beds, leer_precio_m2,
+                      preparar_precio_m2, quitar_vacias, quitar_variables, seleccionar_det)
 
-print(precio_m2)
+empezar('precio_m2')
+print(pd.read_csv('DatosCaso1/precios_idealista.csv').head())
+print(pd.read_csv('DatosCaso1/precios_idealista.csv').info())
 
-# Limpiamos el precio quitando la unidad, quitando los puntos de separador de miles y cambiando el tipo a entero
+# leer_precio_m2 quita el primer registro, se queda con precio y distrito, y limpia el precio quitando la unidad, quitando los
+# puntos de separador de miles y cambiando el tipo a entero
 
-precio_m2['precio_m2'] = precio_m2.precio_m2.str.split(expand = True)[0].str.replace('.','',regex=False).astype('int')
+precio_m2 = leer_precio_m2('DatosCaso1/precios_idealista.csv')
+terminar('precio_m2', salida = precio_m2)
 
 print(precio_m2)
 
@@ -213,24 +258,15 @@ print(listings.info())
 
 # Vamos a eliminar aquellas variables que no necesitaremos directamente para nuestros objetivos.
 
-a_eliminar = ['index',
-              'host_name',
-              'number_of_reviews',
-              'last_review',
-              'reviews_per_month',
-              'number_of_reviews_ltm',
-              'license'
-             ]
-
-listings.drop(columns = a_eliminar, inplace=True)
-
-print(listings)
+# (ya no hace falta quitar 'index': guardar_tabla no guarda el índice de pandas como columna)
 
 # Viendo los tipos de datos debemos pasar algunas variasbles a objeto (neighbourhood_group, neighbourhood, room_type) a categóricas.
+# quitar_variables hace las dos cosas (limpieza.A_ELIMINAR y limpieza.CATEGORICAS).
 
-for variable in ['neighbourhood_group','neighbourhood','room_type']:
-    listings[variable] = listings[variable].astype('category')
+empezar('limpieza_listings', entrada = listings)
+listings = quitar_variables(listings)
 
+print(listings)
 print(listings.info())
 
 # ANÁLISIS DE NULOS
@@ -256,7 +292,7 @@ print(listings.room_type.value_counts())
 
 # Vemos que hay hoteles. Nuestra empresa no se plantea comprar hoteles, así que tenemos que eliminar estos registros.
 
-listings = listings.loc[listings.room_type != 'Hotel room']
+listings = excluir_tipos(listings)
 print(listings.room_type.value_counts())
 
 # ANÁLISIS DE VARIABLES NUMÉRICAS
@@ -292,7 +328,8 @@ plt.xticks(size = 10);
 
 # - Hay un pico en 20 euros, y parece que por debajo de esa cantidad sería difícil obtener rentabilidad, así que vamos a descartar los inmuebles que se alquilan por debajo de 20 euros
 
-listings = listings.loc[listings.price > 19]
+listings = filtrar_precio(listings)
+terminar('limpieza_listings', salida = listings)
 print(listings)
 
 # Para minimum_nights y alculated_host_listings_count habría que hacer un ejercicio similar.
@@ -334,28 +371,14 @@ print(listings_det.info())
 # VARIABLES Y TIPOS
 
 # Vamos a seleccionar solo aquellas variables que nos aporten información relevante para nuestros objetivos.
+# Son las mismas que declaramos en ingesta.ESQUEMA_LISTINGS_DET, así que si se añade alguna hay que añadirla también allí.
 
-a_incluir = ['id',
-              'description',
-              'host_is_superhost',
-              'accommodates',
-              'bathrooms',
-              'bedrooms',
-              'beds',
-              'number_of_reviews',
-              'review_scores_rating',
-              'review_scores_communication',
-              'review_scores_location'
-             ]
-
-listings_det = listings_det.loc[:,a_incluir]
-
-print(listings_det)
+# seleccionar_det se queda con las de limpieza.A_INCLUIR y pasa host_is_superhost a categórica (al releer de la base de datos vuelve como texto).
 
-# Pasamos host_is_superhost a categórica.
+empezar('limpieza_listings_det', entrada = listings_det)
+listings_det = seleccionar_det(listings_det)
 
-listings_det['host_is_superhost'] = listings_det['host_is_superhost'].astype('category')
-    
+print(listings_det)
 listings_det.info()
 
 # ANÁLISIS DE NULOS
@@ -385,20 +408,27 @@ print(listings_det['beds'].value_counts(dropna = False))
 
 # Creamos una función para imputar los nulos de beds en base a accommodates
 
-def imputar_nulos(registro):
-
-    #Lista de condiciones
-
-    condiciones = [(registro.accommodates <= 2),
-               (registro.accommodates > 2) & (registro.accommodates <= 4),
-               (registro.accommodates > 4) & (registro.accommodates <= 6),
-               (registro.accommodates > 6)]
-
-    resultados = [1,2,3,4]
-    
-    return(np.select(condiciones,resultados, default = -999))
-
-listings_det.loc[listings_det.beds.isna(),'beds'] = listings_det.loc[listings_det.beds.isna()].apply(imputar_nulos, axis = 1).astype('int64')
+# def imputar_nulos(registro):
+#
+#     #Lista de condiciones
+#
+#     condiciones = [(registro.accommodates <= 2),
+#                (registro.accommodates > 2) & (registro.accommodates <= 4),
+#                (registro.accommodates > 4) & (registro.accommodates <= 6),
+#                (registro.accommodates > 6)]
+#
+#     resultados = [1,2,3,4]
+#
+#     return(np.select(condiciones,resultados, default = -999))
+#
+# listings_det.loc[listings_det.beds.isna(),'beds'] = listings_det.loc[listings_det.beds.isna()].apply(imputar_nulos, axis = 1).astype('int64')
+
+# Con apply la función (y np.select) se ejecuta una vez por fila. En motor_variables.py la imputación está registrada como
+# una expresión sobre la columna entera, con los tramos (2, 4, 6 -> 1, 2, 3, 4) como parámetros.
+
+empezar('imputacion_beds')
+listings_det['beds'] = imputar_beds(listings_det)
+terminar('imputacion_beds')
 print(listings_det.beds.value_counts(dropna = False))
 
 # Ahora vamos a ver si podemos hacer una imputación de bedrooms.
@@ -421,26 +451,33 @@ print(pd.crosstab(listings_det.bedrooms, listings_det.beds, dropna=False))
 
 print(listings_det.bedrooms.value_counts(dropna = False))
 
-def imputar_nulos(registro):
-
-    #Lista de condiciones
-
-    condiciones = [(registro.beds <= 2),
-               (registro.beds > 2) & (registro.beds <= 4),
-               (registro.beds > 4) & (registro.beds <= 6),
-               (registro.beds > 6)]
-
-    resultados = [1,2,3,4]
-    
-    return(np.select(condiciones,resultados, default = -999))
-
-listings_det.loc[listings_det.bedrooms.isna(),'bedrooms'] = listings_det.loc[listings_det.bedrooms.isna()].apply(imputar_nulos, axis = 1).astype('int64')
+# def imputar_nulos(registro):
+#
+#     #Lista de condiciones
+#
+#     condiciones = [(registro.beds <= 2),
+#                (registro.beds > 2) & (registro.beds <= 4),
+#                (registro.beds > 4) & (registro.beds <= 6),
+#                (registro.beds > 6)]
+#
+#     resultados = [1,2,3,4]
+#
+#     return(np.select(condiciones,resultados, default = -999))
+#
+# listings_det.loc[listings_det.bedrooms.isna(),'bedrooms'] = listings_det.loc[listings_det.bedrooms.isna()].apply(imputar_nulos, axis = 1).astype('int64')
+
+# Igual que con beds, con el motor de variables (mismos tramos, ahora a partir de las camas)
+
+empezar('imputacion_bedrooms')
+listings_det['bedrooms'] = imputar_bedrooms(listings_det)
+terminar('imputacion_bedrooms')
 
 print(listings_det.bedrooms.value_counts(dropna = False))
 
 # Y por último borramos bathrooms:
 
-listings_det.drop(columns = 'bathrooms', inplace = True)
+listings_det = quitar_vacias(listings_det)
+terminar('limpieza_listings_det', salida = listings_det)
 print(listings_det)
 
 # ANÁLISIS DE DUPLICADOS
@@ -481,14 +518,12 @@ print(listings_det.shape)
 
 # Es decir, si sale bien la tabla final tendrá 17710 filas y 21 columnas.
 
-df = pd.merge(left = listings, right = listings_det, how = 'left', on = 'id')
-print(df)
-
-# Ahora vamos a ver cómo podemos incorporar la información externa del precio por metro cuadrado.
+# Antes de cruzar vamos a ver cómo podemos incorporar la información externa del precio por metro cuadrado.
 # Para ello lo primero es analizar los valores de la variable distrito en ambas tablas, ya que necesitan coincidir para que podamos cruzarlos.
-# En df la variable es categórica, así que para sacar los niveles tenemos que usar .categories
+# En listings la variable es categórica, así que para sacar los niveles tenemos que usar .categories
 
-distritos1 = pd.Series(df.neighbourhood_group.unique().categories).sort_values()
+empezar('cruce', entrada = listings)
+distritos1 = pd.Series(listings.neighbourhood_group.unique().categories).sort_values()
 print(distritos1)
 
 distritos2 = precio_m2.distrito
@@ -500,18 +535,16 @@ print(distritos2)
 # - Moncloa - Aravaca
 # - San Blas - Canillejas
 
-# Por tanto vamos a reemplazar estos valores en precio_m2 para que sean iguales a los de df y podamos cruzarlos
+# Por tanto vamos a reemplazar estos valores en precio_m2 para que sean iguales a los de listings y podamos cruzarlos (limpieza.MAPA_DISTRITOS)
 
-precio_m2.distrito = precio_m2.distrito.map({'Fuencarral':'Fuencarral - El Pardo',
-                        'Moncloa':'Moncloa - Aravaca',
-                        'San Blas':'San Blas - Canillejas'}) \
-                    .fillna(precio_m2.distrito)
+precio_m2 = preparar_precio_m2(precio_m2)
 
 print(precio_m2)
 
-# Ahora sí que ya podemos cruzarlos. Manda df.
+# Ahora sí que ya podemos cruzar las tres: listings con listings_det por id, y el resultado con precio_m2 por distrito. Manda listings.
 
-df = pd.merge(left = df, right = precio_m2, how = 'left', left_on='neighbourhood_group', right_on='distrito')
+df = construir_df(listings, listings_det, precio_m2)
+terminar('cruce', salida = df)
 print(df)
 
 # Comprobamos que no se hayan generado nulos en la unión.
@@ -521,7 +554,24 @@ print(df.precio_m2.isna().sum())
 
 # Ahora que ya tenemos el tablón de análisis vamos a guardarlo en la base de datos para que cada vez que queramos hacer análisis no tengamos que repetir todo el procesamiento de este notebook
 
-df.to_sql('df', con = con, if_exists = 'replace')
+# Lo publicamos con GRAFO.publicar (etapas.py): estos pasos son los de la etapa cruce y sus anteriores (las funciones de
+# limpieza.py con los mismos parámetros), así que df se guarda en SQLite con la clave de los ficheros, los parámetros y
+# el código con los que se ha hecho. Así el script de insights, incremental.py y python etapas.py --estado saben que
+# está al día. También queda en la caché de la etapa (DatosCaso1/etapas_cache), de la que parten las etapas siguientes.
+# Además de la tabla se deja una copia columnar (Arrow) junto a la base de datos, que mantiene las categóricas y que los
+# siguientes scripts pueden leer con memory map en milisegundos en vez de pasar cada fila por SQLite (ver cache_columnar.py)
+
+from etapas import GRAFO
+
+empezar('guardado_df', entrada = df)
+GRAFO.publicar({'df': df}, 'DatosCaso1', con = con)
+terminar('guardado_df')
 
+# ACTUALIZACIONES DEL DATAMART
 
+# Cuando Inside Airbnb publique una nueva descarga no hace falta repetir todo este proceso: la mayoría de inmuebles no cambian.
+# incremental.py aplica estos mismos pasos (recogidos como funciones en limpieza.py y variables_derivadas.py) solo a los
+# inmuebles insertados o actualizados, detectados comparando un hash de cada fila de origen, y hace upsert por id en df y df_preparado.
 
+# python incremental.py              -> incremental (la primera vez hace la reconstrucción completa)
+# python incremental.py --completo   -> reconstrucción completa
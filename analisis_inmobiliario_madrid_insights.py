@@ -79,13 +79,39 @@ import sqlalchemy as sa
 # %matplotlib inline # para que los gráficos aparezcan en Jupyter Notebook
 # %config IPCompleter.greedy=True # cuando pulsamos la tecla tabuladora que autocomplete
 
+# Pasos marcados con empezar() / terminar() (instrumentacion.py): con INSTRUMENTACION=1 se guarda en informes/ un JSON
+# con el tiempo, la CPU, la memoria y las filas de cada paso.
+
+from instrumentacion import empezar, terminar
+
 # ANALISIS E INSIGHTS
 
 # Esta es la parte más importante, donde vamos a obtener conclusiones relevantes para el objetivo utilizando todo el trabajo de preparación que se ha hecho, las técnicas de Business Analytics y vamos a crear una visualización en mapa.
 # Para ello empezaremos dando respuesta a las preguntas semilla y es probable que en el proceso nos vayan surgiendo hallazgos interesantes que nos lleven a nuevas preguntas o a la aplicación de ciertas técnicas.
 
 con = sa.create_engine('sqlite:///DatosCaso1/airbnb.db')
-df = pd.read_sql('df_preparado', con = con)
+# df = pd.read_sql('df_preparado', con = con)
+
+# Desde la caché columnar (Arrow con memory map), que mantiene las categóricas. Ver cache_columnar.py
+# La tabla ya está compacta (compactacion.py, sin description ni name); compactar solo hace algo si la caché se ha
+# rehecho desde SQLite y ha perdido los tipos.
+
+from cache_columnar import leer_tabla
+from compactacion import compactar, con_textos
+
+empezar('carga_df_preparado')
+df = compactar(leer_tabla('df_preparado', con))
+terminar('carga_df_preparado', salida = df)
+
+# Si desde que se publicaron las tablas (con los scripts, etapas.py o incremental.py) han cambiado los ficheros de la
+# descarga, los parámetros de negocio o el código de alguna etapa, no corresponden a las etapas actuales. Se ponen al
+# día con python etapas.py, que solo repite las etapas afectadas.
+
+from etapas import GRAFO
+
+desactualizadas = GRAFO.desactualizadas('DatosCaso1', con = con)
+if desactualizadas:
+    print(f'Tablas desactualizadas: {desactualizadas}. Para ponerlas al día: python etapas.py')
 
 print(df.head())
 
@@ -100,11 +126,29 @@ print(df.precio_total.describe())
 
 print(df.precio_total.median())
 
-print(df.groupby('distrito').precio_total.median().sort_values(ascending = False))
+print(df.groupby('distrito', observed = True).precio_total.median().sort_values(ascending = False))
+
+# Para una pregunta suelta no hace falta tener df cargado: consultas.py resuelve la agregación dentro de SQLite (mediana
+# con funciones de ventana, filtros y top N) y solo trae el resultado. P.e. la misma mediana solo de pisos enteros:
+
+from consultas import consultar
+
+print(consultar(con, 'precio_total', 'distrito', ['median', 'mean'], filtros = {'room_type': 'Entire home/apt'}, top = 10))
+
+# La misma mediana (y el p90) desde los sketches guardados en el script de variables (sketches.py). Es aproximada (error de rango
+# en la columna error_rango) pero se puede pedir para cualquier rango de descargas, p.e. desde = '2023-01-01', sin cargar los inmuebles.
+
+from sketches import consultar_cuantiles
+
+empezar('cuantiles_sketches')
+print(consultar_cuantiles(con, 'precio_total', 'distrito', cuantiles = (0.5, 0.9)).sort_values('p50', ascending = False))
+terminar('cuantiles_sketches')
 
 # Nos llama la atención el dato de San Blas, vamos a verlo con más detalle a ver qué está pasando.
 
-print(df.loc[df.distrito == 'San Blas - Canillejas'].sort_values('precio_total',ascending = False).head(10))
+# La descripción está en la tabla textos: con_textos la lee solo para estos 10 inmuebles.
+
+print(con_textos(df.loc[df.distrito == 'San Blas - Canillejas'].sort_values('precio_total',ascending = False).head(10), con))
 
 # Vemos que son precios en el entorno de los 3.000 - 5.000 euros!
 # Al leer la descripción nos damos cuenta de todos estos precios están definidos por la final de la Champions League.
@@ -118,7 +162,7 @@ print(df.loc[df.distrito == 'San Blas - Canillejas'].sort_values('precio_total',
 # Pero por ejemplo vemos que la diferencia de precio media entre Retiro y Tetuán es muy baja.
 # Esto nos lleva a comparar el precio medio por distrito con el precio medio de compra también por distrito.
 
-temp = df.groupby('distrito')[['precio_total','precio_compra']].median()
+temp = df.groupby('distrito', observed = True)[['precio_total','precio_compra']].median()
 print(temp)
 
 plt.figure(figsize = (16,8))
@@ -138,7 +182,7 @@ for cada in range(0,temp.shape[0]):
 # Por tanto como era esperable no hay a priori ningún "chollo" claro a este nivel.
 # Vamos a repetir el análisis a nivel de barrio a ver si identificamos algo.
 
-temp = df.groupby('neighbourhood')[['precio_total','precio_compra']].median()
+temp = df.groupby('neighbourhood', observed = True)[['precio_total','precio_compra']].median()
 print(temp)
 
 """plt.figure(figsize = (16,20))
@@ -162,25 +206,48 @@ for cada in range(0,temp.shape[0]):
 
 print(df.loc[df.neighbourhood.isin(['Rosas','Canillejas','Hellin']),'distrito'].unique())
 
+# En vez de buscar los "chollos" a ojo en el scatter, rentabilidad.py junta precio, ocupación y precio de compra en la rentabilidad bruta
+# y la calcula para todas las combinaciones de factor de compra (0.60 a 0.80), tabla de m2 por habitaciones y precio mínimo por noche.
+# Los barrios que salen entre los 10 mejores en casi todos los escenarios no dependen de los supuestos de negocio.
+
+from rentabilidad import barrido, estabilidad
+
+empezar('rentabilidad', entrada = df)
+rankings = barrido(df)
+terminar('rentabilidad')
+print(estabilidad(rankings['barrios']).head(10))
+print(estabilidad(rankings['tipologias']))
+
 # ¿Qué factores (a parte de la localización determinan el precio del alquiler?
 # Para responder a esta pregunta podemos construir un minicubo, ya que hemos discretizado nuestras variables de análisis.
 
 # PASO 1: Seleccionar qué variables serán la métricas y cuales las dimensiones
 
-metricas = ['precio_total','precio_compra']
+metricas = ['precio_total','precio_compra','ocupacion']
 dimensiones = ['bedrooms_disc','accommodates_disc','beds_disc','number_of_reviews_disc']
 
-minicubo_precio = df[dimensiones + metricas]
-print(minicubo_precio)
+# minicubo_precio = df[dimensiones + metricas]
+# print(minicubo_precio)
 
 # PASO 2: Pasar a transaccional las dimensiones
 
-minicubo_precio = minicubo_precio.melt(id_vars=['precio_total','precio_compra'])
-print(minicubo_precio)
+# minicubo_precio = minicubo_precio.melt(id_vars=['precio_total','precio_compra'])
+# print(minicubo_precio)
 
 # PASO 3: Agregar las métricas por "variable" y "valor" con las funciones deseadas
 
-minicubo_precio = minicubo_precio.groupby(['variable','value'])[['precio_total','precio_compra']].agg('median')
+# minicubo_precio = minicubo_precio.groupby(['variable','value'])[['precio_total','precio_compra']].agg('median')
+# print(minicubo_precio)
+
+# Los pasos 2 y 3 los hace construir_cubo (cubo.py) sin el melt, que multiplicaba por cuatro las filas.
+# Calcula a la vez cada dimensión, el rollup distrito > barrio y las tres métricas (también la ocupación), y lo guardamos en el datamart.
+
+from cubo import construir_cubo, guardar_cubo
+
+empezar('minicubo', entrada = df)
+minicubo_precio = construir_cubo(df, dimensiones, metricas, agregaciones = 'median', jerarquias = [['distrito','neighbourhood']])
+guardar_cubo(minicubo_precio, 'minicubo', con)
+terminar('minicubo')
 print(minicubo_precio)
 
 # Sobre el minicubo vamos analizando cada variable.
@@ -239,13 +306,13 @@ ax2.plot(minicubo_precio.loc['accommodates_disc'].precio_compra,color = 'green')
 # En este caso como hemos construído la distancia a la Puerta del Sol vamos a evaluar solo los distritos para lo que esto puede ser relevante, es decir los más céntricos.
 # Para ello primero vamos a calcular la distancia media por distrito y elegir un punto de corte.
 
-print(df.groupby('distrito').pdi_sol.median().sort_values())
+print(df.groupby('distrito', observed = True).pdi_sol.median().sort_values())
 
 # Vamos a cortar en Latina incluído. Y sobre esa selección vamos a visualizar con un scatter.
 
-print(df.groupby('distrito').pdi_sol.median().sort_values()[0:7].index.to_list())
+print(df.groupby('distrito', observed = True).pdi_sol.median().sort_values()[0:7].index.to_list())
 
-seleccion = df.groupby('distrito').pdi_sol.median().sort_values()[0:7].index.to_list()
+seleccion = df.groupby('distrito', observed = True).pdi_sol.median().sort_values()[0:7].index.to_list()
 
 """plt.figure(figsize = (16,12))
 sns.scatterplot(data = df.loc[df.distrito.isin(seleccion)], x = 'pdi_sol', y = 'precio_total');
@@ -278,26 +345,44 @@ sns.scatterplot(data = df.loc[df.distrito.isin(seleccion)], x = 'pdi_sol', y = '
 # Occupancy Analysis
 # What is the average occupancy? And by district? And by neighborhood?
 
+empezar('ocupacion', entrada = df)
 avg_occupancy = df['ocupacion'].mean()
-occupancy_by_district = df.groupby('distrito')['ocupacion'].mean().sort_values(ascending=False)
-occupancy_by_neighbourhood = df.groupby('neighbourhood')['ocupacion'].mean().sort_values(ascending=False)
+occupancy_by_district = df.groupby('distrito', observed = True)['ocupacion'].mean().sort_values(ascending=False)
+occupancy_by_neighbourhood = df.groupby('neighbourhood', observed = True)['ocupacion'].mean().sort_values(ascending=False)
 
 print(f"Average Occupancy: {avg_occupancy}")
 print(f"Occupancy by District: \\n{occupancy_by_district}")
 print(f"Occupancy by Neighbourhood: \\n{occupancy_by_neighbourhood}")
 
 # How likely is each occupancy level in each district?
-occupancy_probability_by_district = df.groupby(['distrito', 'ocupacion']).size().groupby(level=0).apply(
-    lambda x: 100 * x / x.sum()
-).reset_index(drop=True, name='probability')
+# Matriz distrito x nivel de ocupación (0 a 100) con un solo np.bincount, con las etiquetas, y la acumulada (histogramas.py).
+# El script de variables la guarda en el datamart (tabla histogramas_ocupacion) también por barrio: leer_histogramas(con, 'neighbourhood').
+
+from histogramas import matrices_ocupacion
+
+occupancy_count_by_district, occupancy_probability_by_district, occupancy_cumulative_by_district = matrices_ocupacion(df, 'distrito')
+print(occupancy_probability_by_district.loc[:, :10].round(2))
 
 # Occupancy Ranking by District and Neighborhood
-ranking_district_occupancy = df.groupby('distrito')['ocupacion'].mean().sort_values(ascending=False)
-ranking_neighbourhood_occupancy = df.groupby('neighbourhood')['ocupacion'].mean().sort_values(ascending=False)
+ranking_district_occupancy = df.groupby('distrito', observed = True)['ocupacion'].mean().sort_values(ascending=False)
+ranking_neighbourhood_occupancy = df.groupby('neighbourhood', observed = True)['ocupacion'].mean().sort_values(ascending=False)
+terminar('ocupacion')
 
 print(f"Ranking of Districts by Occupancy: \\n{ranking_district_occupancy}")
 print(f"Ranking of Neighbourhoods by Occupancy: \\n{ranking_neighbourhood_occupancy}")
 
+# La probabilidad de cada nivel de ocupación la usamos en simulacion.py: sorteando ocupación y precio por noche de los inmuebles de cada
+# distrito (o del barrio y la tipología de un candidato) sale la rentabilidad bruta esperable con su dispersión (P10 / P50 / P90).
+
+from simulacion import Candidato, simular, simular_distritos
+
+empezar('simulacion', entrada = df)
+simulacion_distritos = simular_distritos(df)
+simulacion_candidato = simular(df, [Candidato('Centro', 'Sol', 'Entire home/apt', '02_Dos')])
+terminar('simulacion')
+print(simulacion_distritos[['distrito', 'precio_compra', 'p10', 'p50', 'p90']].sort_values('p50', ascending = False))
+print(simulacion_candidato)
+
 # Visualization
 plt.figure(figsize=(16, 8))
 sns.barplot(x='distrito', y='ocupacion', data=df, estimator=sum, ci=None)
@@ -350,15 +435,41 @@ datos['precio_total_disc'] = pd.qcut(datos['precio_total'], q=[0, .25, .5, .75,
 mapa = folium.Map(location=[lat_inicio, lon_inicio], zoom_start=12)
 
 # Añadir marcadores circulares para cada piso en el distrito de San Blas
-for _, piso in datos.iterrows():
-    folium.CircleMarker(
-        location=[piso['latitude'], piso['longitude']],
-        popup=str(piso['precio_total']),
-        fill=True,
-        color=piso['precio_total_disc'],
-        fill_opacity=1,
-        radius=5
-    ).add_to(mapa)
+# for _, piso in datos.iterrows():
+#     folium.CircleMarker(
+#         location=[piso['latitude'], piso['longitude']],
+#         popup=str(piso['precio_total']),
+#         fill=True,
+#         color=piso['precio_total_disc'],
+#         fill_opacity=1,
+#         radius=5
+#     ).add_to(mapa)
+
+# Un CircleMarker por piso es un objeto de Python y un bloque de JavaScript por piso: con toda la ciudad la página pesa varios MB.
+# mapa_inmuebles (mapas.py) mete todos los puntos en una sola capa por columnas que se dibuja en canvas (o en clusters con
+# agrupar = True), con los mismos colores por cuartil del precio_total y sin recorrer las filas.
+
+from mapas import mapa_inmuebles
+
+empezar('mapa_distrito', entrada = datos)
+mapa = mapa_inmuebles(datos, 'precio_total', centro = (lat_inicio, lon_inicio))
 
 # Guardar el mapa en un archivo HTML si lo necesitas
 mapa.save('mapa_circular_optimizado.html')
+terminar('mapa_distrito')
+
+# Y ya podemos pintar Madrid entero. Lo dejamos junto a los datos de la descarga, de la que sale
+
+empezar('mapa_madrid', entrada = df)
+mapa_inmuebles(df, 'precio_total', centro = (lat_inicio, lon_inicio)).save('DatosCaso1/mapa_madrid.html')
+terminar('mapa_madrid')
+
+# Para mapas de calor de toda la ciudad no necesitamos los puntos: el script de variables guarda la rejilla hexagonal (rejilla.py)
+# con las medianas por celda en varios tamaños (de 2 km a 125 m de lado). Por ejemplo, las celdas de 500 m con mayor rentabilidad bruta:
+
+from rejilla import leer_rejilla
+
+empezar('rejilla')
+teselas = leer_rejilla(con, lado = 500)
+terminar('rejilla', salida = teselas)
+print(teselas.loc[teselas.inmuebles >= 10].sort_values('rentabilidad_bruta', ascending = False).head(10))
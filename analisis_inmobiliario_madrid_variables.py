@@ -70,8 +70,6 @@ Sobre el precio de compra:
 - ¿Cual es la relación entre el precio del inmueble y el precio del alquiler por distrito?
 - ¿Cual es la relación entre el precio del inmueble y la ocupación por distrito?"""
 
-import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import sqlalchemy as sa
@@ -79,11 +77,24 @@ import sqlalchemy as sa
 # %matplotlib inline # para que los gráficos aparezcan en Jupyter Notebook
 # %config IPCompleter.greedy=True # cuando pulsamos la tecla tabuladora que autocomplete
 
+# Pasos marcados con empezar() / terminar() (instrumentacion.py): con INSTRUMENTACION=1 se guarda en informes/ un JSON
+# con el tiempo, la CPU, la memoria y las filas de cada paso.
+
+from instrumentacion import empezar, terminar
+
 # CARGA DE DATOS
 
-con = sa.create_engine('sqlite:///DatoscASO1/airbnb.db')
+con = sa.create_engine('sqlite:///DatosCaso1/airbnb.db')
+
+# df = pd.read_sql('df', con = con)
+
+# Leemos de la caché columnar si está al día con SQLite (y si no de SQLite, rehaciendo la caché). Ver cache_columnar.py
 
-df = pd.read_sql('df', con = con)
+from cache_columnar import leer_tabla
+
+empezar('carga_df')
+df = leer_tabla('df', con)
+terminar('carga_df', salida = df)
 
 print(df.head())
 
@@ -106,7 +117,7 @@ print(df.head())
 # Es importante filtrar por solo un distrito para no incluir el efecto "zona". Así que primero elegimos un distrito que tenga muchos datos.
 
 print(df.distrito.value_counts())
-print(df.loc[df.distrito == 'Centro',:].groupby('room_type').price.mean())
+print(df.loc[df.distrito == 'Centro',:].groupby('room_type', observed = True).price.mean())
 
 # CONCLUSIÓN:
 
@@ -120,14 +131,24 @@ print(df.loc[df.distrito == 'Centro',:].groupby('room_type').price.mean())
 
 # No tenemos ese dato, pero supongamos que hemos hablado con el responsable de negocio y nos ha dicho que es del 70%. Podemos crear la variable precio total aplicando apply sobre una función personalizada.
 
-def crear_precio_total(registro):
-    if (registro.beds > 1) & ((registro.room_type == 'Private room') | (registro.room_type == 'Shared room')):
-        salida = registro.price * registro.beds * 0.7
-    else:
-        salida = registro.price
-    return(salida)
+# def crear_precio_total(registro):
+#     if (registro.beds > 1) & ((registro.room_type == 'Private room') | (registro.room_type == 'Shared room')):
+#         salida = registro.price * registro.beds * 0.7
+#     else:
+#         salida = registro.price
+#     return(salida)
+#
+# df['precio_total'] = df.apply(crear_precio_total, axis = 1)
+
+# El apply llama a la función una vez por fila. En motor_variables.py tenemos registradas todas las variables derivadas
+# como expresiones sobre columnas enteras, con las reglas de negocio (el 70%, los m2 por habitación, el descuento de compra...)
+# como parámetros en motor_variables.PARAMETROS. El motor resuelve las dependencias y calcula solo lo que le pedimos.
+
+from motor_variables import MOTOR
 
-df['precio_total'] = df.apply(crear_precio_total, axis = 1)
+empezar('precio_total', entrada = df)
+df['precio_total'] = MOTOR.calcular(df, 'precio_total')
+terminar('precio_total')
 
 print(df[['room_type','price','beds','precio_total']].head(30))
 
@@ -137,9 +158,44 @@ print(df[['room_type','price','beds','precio_total']].head(30))
 # Esta variable nos dice el número de días a un año vista que el inmueble NO está ocupado.
 # Por tanto nos interesaría transformarla a una medida más directa de ocupación, por ejemplo el % del año que SI está ocupada. Podemos hacerlo con una tranformación directa.
 
-df['ocupacion'] = ((365 - df.availability_365) / 365 * 100).astype('int')
+# df['ocupacion'] = ((365 - df.availability_365) / 365 * 100).astype('int')
+
+empezar('ocupacion', entrada = df)
+df['ocupacion'] = MOTOR.calcular(df, 'ocupacion')
+terminar('ocupacion')
 print(df.head())
 
+# Si hemos procesado el calendario (python calendario.py, que lo lee por bloques) comparamos la ocupación con la del
+# calendario: % de días no disponibles en total, en laborables y en fines de semana, y el precio medio anunciado.
+# El resumen se queda en su tabla (calendario) y se cruza por id cuando hace falta: cambia con cada descarga para casi
+# todos los inmuebles, y dentro de df_preparado obligaría a reescribirlo entero en cada actualización (incremental.py).
+
+from calendario import leer_resumen
+
+empezar('calendario', entrada = df)
+resumen_calendario = leer_resumen(con)
+
+if resumen_calendario is not None:
+    print(df[['id','ocupacion']].merge(resumen_calendario, on = 'id', how = 'left')
+          [['ocupacion','ocupacion_calendario','ocupacion_laborable','ocupacion_finde']].describe())
+
+terminar('calendario')
+
+# Y lo mismo con la ocupación estimada a partir de las reseñas (python resenas.py): noches reservadas en los últimos 12 meses
+# según el modelo de Inside Airbnb (reseñas / tasa de reseña x max(estancia media, noches mínimas)), que mide demanda y no bloqueos.
+# También se queda en su tabla (resenas), por id.
+
+from resenas import leer_resumen as leer_resumen_resenas
+
+empezar('resenas', entrada = df)
+resumen_resenas = leer_resumen_resenas(con)
+
+if resumen_resenas is not None:
+    print(df[['id','ocupacion']].merge(resumen_resenas, on = 'id', how = 'left')
+          [['ocupacion','ocupacion_resenas','noches_estimadas']].describe())
+
+terminar('resenas')
+
 # TRANSFORMACIÓN DE VARIABLES DE ANÁLISIS
 
 # Algunas de las preguntas semilla están dirigidas a comprobar cómo se comporta el precio o la ocupación según otras variables como el número de habitaciones, la media de valoraciones, etc.
@@ -153,16 +209,10 @@ print(df.head())
 df.bedrooms.value_counts().plot.bar();
 plt.show()
 
-# Vamos a discretizar para 1,2,3 y más de 3. Podemos usar np.select
-
-condiciones = [df.bedrooms == 1,
-               df.bedrooms == 2,
-               df.bedrooms == 3,
-               df.bedrooms > 3]
+# Vamos a discretizar para 1,2,3 y más de 3. Podemos usar np.select (las etiquetas están en PARAMETROS['bedrooms_disc_etiquetas'])
 
-resultados = ['01_Una','02_Dos','03_Tres','04_Cuatro o mas']
-
-df['bedrooms_disc'] = np.select(condiciones, resultados, default = -999)
+empezar('discretizaciones', entrada = df)
+df['bedrooms_disc'] = MOTOR.calcular(df, 'bedrooms_disc')
 
 print(df.bedrooms_disc.value_counts())
 
@@ -171,21 +221,20 @@ plt.show()
 
 # Discretizar accommodates, beds y number_of_reviews
 # Vamos a usar qcut para discritizar con percentiles 0.5, 0.8, 1
+# El motor hace lo mismo que qcut (percentiles y etiquetas en PARAMETROS), y además admite cortes fijos para el modo incremental
 
-df['accommodates_disc'] = pd.qcut(df.accommodates,[0, 0.5, 0.8, 1],
-                                 labels = ['0-3','4','5-16'])
+df['accommodates_disc'] = MOTOR.calcular(df, 'accommodates_disc')
 
 df['accommodates_disc'].value_counts().sort_index(ascending = False).plot.barh();
 plt.show()
 
-df['beds_disc'] = pd.qcut(df.beds,[0, 0.5, 0.8, 1],
-                         labels = ['1','2','3-24'])
+df['beds_disc'] = MOTOR.calcular(df, 'beds_disc')
 
 df['beds_disc'].value_counts().sort_index(ascending = False).plot.barh();
 plt.show()
 
-df['number_of_reviews_disc'] = pd.qcut(df.number_of_reviews,[0, 0.5, 0.8, 1],
-                                      labels = ['1-4','5-48','48-744'])
+df['number_of_reviews_disc'] = MOTOR.calcular(df, 'number_of_reviews_disc')
+terminar('discretizaciones')
 
 df['number_of_reviews_disc'].value_counts().sort_index(ascending = False).plot.barh();
 plt.show()
@@ -207,21 +256,19 @@ plt.show()
 # - cuatro habitaciones: m2 = 120
 # - cinco o más habitaciones: m2 = 150
 
-condiciones = [df.bedrooms == 1,
-               df.bedrooms == 2,
-               df.bedrooms == 3,
-               df.bedrooms == 4,
-               df.bedrooms > 4]
-
-resultados = [50,70,90,120,150]
+# (es el parámetro m2_por_habitaciones del motor)
 
-df['m2'] = np.select(condiciones, resultados, default = -999)
+empezar('precio_compra', entrada = df)
+df['m2'] = MOTOR.calcular(df, 'm2')
 print(df['m2'].value_counts())
 
 # Ahora ya podemos estimar el precio de compra del inmueble.
 # Recordamos que al precio que nos sale le quitábamos un 30% por capacidad de negociación.
 
-df['precio_compra'] = df.m2 * df.precio_m2 * 0.7
+# (es el parámetro factor_compra del motor)
+
+df['precio_compra'] = MOTOR.calcular(df, 'precio_compra')
+terminar('precio_compra')
 print(df[['bedrooms','m2','distrito','precio_m2','precio_compra']].head(20))
 
 # Ahora vamos a poner un ejemplo de qué otro tipo de variables podemos construir.
@@ -258,12 +305,112 @@ def haversine(lat1, lon1, lat2, lon2):
 lat1 = 40.4167278
 lon1 = -3.7033387
 
-df['pdi_sol'] = df.apply(lambda registro: haversine(lat1,lon1,registro.latitude,registro.longitude),axis = 1)
+# df['pdi_sol'] = df.apply(lambda registro: haversine(lat1,lon1,registro.latitude,registro.longitude),axis = 1)
+
+# El apply llama a la función una vez por fila y solo nos da una distancia. En distancias.py tenemos la misma fórmula
+# vectorizada con NumPy y un catálogo de puntos de interés (Sol, Prado, Bernabéu, Atocha, IFEMA, Metropolitano...).
+# De una sola pasada obtenemos una columna por PdI (pdi_sol incluida), el PdI más cercano y su distancia.
+# Para ver la comparación de tiempos con el apply: python distancias.py
+
+from distancias import distancias_pdi
+
+empezar('distancias_pdi', entrada = df)
+df = df.join(distancias_pdi(df))
+terminar('distancias_pdi', salida = df)
+print(df.filter(like = 'pdi_').head())
 
 # Comprobamos revisando la distancia media por distritos.
 
 print(df.groupby('distrito').pdi_sol.mean().sort_values())
 
+# Otra variable de localización interesante es la competencia alrededor de cada inmueble.
+# Contar inmuebles por barrio no distingue un barrio grande de uno pequeño, ni un piso en el borde del barrio.
+# En competencia.py construimos un índice espacial (KD-tree) una sola vez y con él sacamos para todos los inmuebles:
+
+# - competidores_250m, competidores_500m, competidores_1000m: número de inmuebles a menos de esa distancia
+# - precio_mediano_competencia: mediana del precio_total de los 20 competidores más cercanos a menos de 500 m
+# - dist_competidor_cercano: distancia en metros al competidor más cercano
+
+from competencia import crear_variables_competencia
+
+empezar('competencia', entrada = df)
+df = df.join(crear_variables_competencia(df))
+terminar('competencia', salida = df)
+print(df.groupby('distrito')[['competidores_500m','precio_mediano_competencia']].median().sort_values('competidores_500m'))
+
+# Con los polígonos de neighbourhoods.geojson (geometria.py) comprobamos que el barrio de cada inmueble cuadra con su
+# posición y calculamos la densidad de oferta de cada barrio (inmuebles por km2), que sí distingue barrios grandes y
+# pequeños. Se guarda por barrio en la tabla densidad_barrios y se cruza por neighbourhood.
+
+import os
+
+from geometria import densidad, guardar_densidad, leer_barrios, validar_barrios
+
+empezar('geometria_barrios', entrada = df)
+if os.path.exists('DatosCaso1/neighbourhoods.geojson'):
+    barrios = leer_barrios('DatosCaso1/neighbourhoods.geojson')
+
+    print(f'Inmuebles con un barrio que no cuadra con su posición: {len(validar_barrios(df, barrios))}')
+
+    densidad_barrios = densidad(df, barrios)
+    guardar_densidad(densidad_barrios, con)
+    print(densidad_barrios.sort_values('inmuebles_km2', ascending = False).head(10))
+
+terminar('geometria_barrios')
+
 # GUARDAMOS EN EL DATAMART
 
-df.to_sql('df_preparado', con = con, if_exists = 'replace')
+# Antes compactamos la tabla (compactacion.py): description y name se van a la tabla textos (por id, se leen solo cuando
+# hacen falta con leer_textos), los números bajan al tipo más pequeño en que caben y los textos pasan a categóricas con
+# categorías fijas. Ocupa unas 5 veces menos en memoria.
+
+from compactacion import TEXTOS, compactar, memoria_mb
+
+empezar('compactacion', entrada = df)
+memoria_antes = memoria_mb(df)
+textos = df[['id'] + [columna for columna in TEXTOS if columna in df.columns]]
+df = compactar(df)
+print(f'df_preparado: {memoria_antes:.1f} MB -> {memoria_mb(df):.1f} MB ({memoria_antes / memoria_mb(df):.1f}x)')
+terminar('compactacion', salida = df)
+
+# Además de df_preparado y textos (description y name por id) guardamos los KPIs (kpis.py), la rejilla hexagonal de
+# toda la ciudad en varios tamaños de celda (rejilla.py: medianas de precio_total, ocupacion, precio_compra y
+# rentabilidad bruta por celda, para mapas de calor sin cargar los inmuebles) y las matrices de probabilidad (y
+# acumulada) de cada nivel de ocupación por distrito y por barrio (histogramas.py).
+
+from histogramas import construir_histogramas
+from kpis import calcular_kpis
+from rejilla import construir_rejilla
+
+empezar('tablas_derivadas', entrada = df)
+kpis = calcular_kpis(df)
+rejilla = construir_rejilla(df)
+histogramas = construir_histogramas(df)
+terminar('tablas_derivadas')
+
+# Las publicamos con GRAFO.publicar (etapas.py): estos pasos son los de las etapas de variables_derivadas.py,
+# competencia.py y compactacion.py, así que cada tabla se guarda en SQLite (escritura masiva de persistencia.py, con
+# índices) y en la caché columnar con la clave de los ficheros, los parámetros y el código con los que se ha hecho. Así
+# el script de insights, incremental.py y python etapas.py --estado saben que están al día.
+
+from etapas import GRAFO
+
+empezar('guardado_df_preparado', entrada = df)
+GRAFO.publicar({'df_preparado': df, 'textos': textos, 'kpis': kpis, 'rejilla': rejilla, 'histogramas': histogramas},
+               'DatosCaso1', con = con)
+terminar('guardado_df_preparado')
+
+# Guardamos también los sketches de cuantiles de esta descarga (sketches.py): un resumen pequeño por distrito y barrio de
+# precio_total, precio_compra y ocupacion que se puede fusionar con los de otras descargas para sacar medianas y p90
+# de cualquier rango de fechas sin volver a cargar los inmuebles.
+# La fecha de la descarga sale de los propios datos (no del día en que se ejecuta el script): el last_scraped más
+# reciente del listings detallado, que no llega a df, así que leemos solo esa columna del CSV.
+
+from sketches import fecha_descarga, guardar_sketches
+
+FECHA_DESCARGA = fecha_descarga('DatosCaso1/listings.csv.gz')
+
+empezar('sketches', entrada = df)
+guardar_sketches(df, FECHA_DESCARGA, con)
+terminar('sketches')
+
@@ -0,0 +1,246 @@
+"""BENCHMARK DE EXTREMO A EXTREMO POR ETAPAS
+
+Mide el tiempo y la memoria de cada etapa del pipeline sobre una descarga (normalmente sintética, sintetico.py) para
+detectar regresiones y estimar la capacidad necesaria a 1, 10 o 100 veces el tamaño de Madrid:
+
+- carga: listings.csv, listings.csv.gz (por bloques) y precios de idealista
+- limpieza: limpiar_listings y limpiar_listings_det
+- cruce: construir_df (listings con su detalle y el precio del m2)
+- variables: variables derivadas (motor de variables, distancias a PdI) y variables de competencia
+- agregaciones: las de insights (mediana por distrito, minicubo con el rollup distrito > barrio y KPIs)
+- mapa: mapa folium de todos los inmuebles guardado en HTML
+- guardado: textos y df_preparado compacto en SQLite y su caché columnar
+- calendario y resenas: agregación por bloques de calendar.csv.gz y reviews.csv.gz (si están)
+
+Para cada etapa se guarda el tiempo de reloj y de CPU, la RSS al empezar y al acabar y el pico de RSS durante la etapa
+(un hilo muestrea /proc/self/statm cada pocos milisegundos). Cada escala se mide en un proceso nuevo, para que la
+memoria de una no contamine la siguiente.
+
+Uso:
+
+    python benchmark.py --escalas 1 10 --resultados benchmark.csv        # genera los datos si no existen
+    python benchmark.py --escalas 1 --referencia benchmark.csv           # compara con una ejecución anterior
+    python benchmark.py --carpeta DatosCaso1                             # sobre una descarga real
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from instrumentacion import rss_mb
+from sintetico import DESCARGA, generar
+
+ETAPAS = ['carga', 'limpieza', 'cruce', 'variables', 'agregaciones', 'mapa', 'guardado', 'calendario', 'resenas']
+
+# Una etapa es una regresión si tarda más de (1 + TOLERANCIA) veces lo que tardaba en la referencia
+
+TOLERANCIA = 0.2
+
+# ...y además la diferencia supera estos mínimos (en las etapas de centésimas de segundo el ruido es mayor que el 20%)
+
+MINIMO_SEGUNDOS = 0.1
+MINIMO_MB = 10
+
+INTERVALO_MUESTREO = 0.005
+
+
+class Medicion:
+    """Context manager que mide una etapa: tiempos de reloj y CPU y RSS al empezar, al acabar y pico."""
+
+    def __init__(self, etapa, filas = None):
+        self.etapa = etapa
+        self.filas = filas
+        self._parar = threading.Event()
+
+    def _muestrear(self):
+        while not self._parar.wait(INTERVALO_MUESTREO):
+            self.rss_pico = max(self.rss_pico, rss_mb())
+
+    def __enter__(self):
+        self.rss_inicio = self.rss_pico = rss_mb()
+        self._hilo = threading.Thread(target = self._muestrear, daemon = True)
+        self._hilo.start()
+        self._reloj, self._cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *error):
+        self.segundos = time.perf_counter() - self._reloj
+        self.cpu = time.process_time() - self._cpu
+        self._parar.set()
+        self._hilo.join()
+        self.rss_fin = rss_mb()
+        self.rss_pico = max(self.rss_pico, self.rss_fin)
+
+    def resultado(self):
+        return {'etapa': self.etapa, 'segundos': self.segundos, 'cpu': self.cpu, 'filas': self.filas,
+                'rss_inicio_mb': self.rss_inicio, 'rss_pico_mb': self.rss_pico, 'rss_fin_mb': self.rss_fin,
+                'incremento_pico_mb': self.rss_pico - self.rss_inicio}
+
+
+def medir_carpeta(carpeta, etapas = ETAPAS):
+    """Ejecuta las etapas sobre la descarga de carpeta y devuelve una fila por etapa con sus mediciones."""
+
+    # Los imports van aquí para que la importación de pandas, folium, etc. no cuente en la primera etapa pero sí
+    # se haga en el proceso que mide
+
+    from cache_columnar import guardar_cache
+    from calendario import procesar_calendario
+    from compactacion import compactar, guardar_textos
+    from competencia import crear_variables_competencia
+    from cubo import construir_cubo
+    from etapas import PARAMETROS as PARAMETROS_ETAPAS
+    from ingesta import leer_listings_det
+    from kpis import calcular_kpis
+    from limpieza import construir_df, leer_listings, leer_precio_m2, limpiar_listings, limpiar_listings_det, \
+        preparar_precio_m2
+    from mapas import mapa_inmuebles
+    from persistencia import guardar_tabla
+    from resenas import procesar_resenas
+    from variables_derivadas import crear_variables
+
+    mediciones = []
+    temporal = tempfile.mkdtemp(prefix = 'benchmark_')
+    con = os.path.join(temporal, 'airbnb.db')
+
+    def etapa(nombre):
+        medicion = Medicion(nombre)
+        mediciones.append(medicion)
+        return medicion
+
+    with etapa('carga') as medicion:
+        listings = leer_listings(os.path.join(carpeta, 'listings.csv'))
+        listings_det = leer_listings_det(os.path.join(carpeta, 'listings.csv.gz'))
+        precio_m2 = preparar_precio_m2(leer_precio_m2(os.path.join(carpeta, 'precios_idealista.csv')))
+        medicion.filas = len(listings)
+
+    with etapa('limpieza') as medicion:
+        listings = limpiar_listings(listings)
+        listings_det = limpiar_listings_det(listings_det)
+        medicion.filas = len(listings)
+
+    with etapa('cruce') as medicion:
+        df = construir_df(listings, listings_det, precio_m2)
+        medicion.filas = len(df)
+
+    with etapa('variables') as medicion:
+        df, _ = crear_variables(df)
+        df = df.join(crear_variables_competencia(df, radios = tuple(PARAMETROS_ETAPAS['radios_competencia'])))
+        medicion.filas = len(df)
+
+    if 'agregaciones' in etapas:
+        with etapa('agregaciones') as medicion:
+            df.groupby('distrito', observed = True).precio_total.median()
+            construir_cubo(df, ['bedrooms_disc', 'accommodates_disc', 'beds_disc', 'number_of_reviews_disc'],
+                           ['precio_total', 'precio_compra', 'ocupacion'], agregaciones = 'median',
+                           jerarquias = [['distrito', 'neighbourhood']])
+            medicion.filas = len(calcular_kpis(df))
+
+    if 'mapa' in etapas:
+        with etapa('mapa') as medicion:
+            mapa_inmuebles(df, 'precio_total').save(os.path.join(temporal, 'mapa.html'))
+            medicion.filas = len(df)
+
+    if 'guardado' in etapas:
+        with etapa('guardado') as medicion:
+            guardar_textos(df, con)
+            compacto = compactar(df)
+            guardar_tabla(compacto, 'df_preparado', con)
+            guardar_cache(compacto, 'df_preparado', con)
+            medicion.filas = len(df)
+
+    calendario = os.path.join(carpeta, 'calendar.csv.gz')
+    if 'calendario' in etapas and os.path.exists(calendario):
+        with etapa('calendario') as medicion:
+            medicion.filas = len(procesar_calendario(calendario, con))
+
+    resenas = os.path.join(carpeta, 'reviews.csv.gz')
+    if 'resenas' in etapas and os.path.exists(resenas):
+        with etapa('resenas') as medicion:
+            medicion.filas = len(procesar_resenas(resenas, os.path.join(carpeta, 'listings.csv'), con))
+
+    shutil.rmtree(temporal, ignore_errors = True)
+
+    return pd.DataFrame([medicion.resultado() for medicion in mediciones])
+
+
+def medir_en_proceso_nuevo(carpeta, etapas = ETAPAS):
+    # spawn y no fork: el proceso hijo no hereda la memoria del padre
+
+    with ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context('spawn')) as ejecutor:
+        return ejecutor.submit(medir_carpeta, carpeta, etapas).result()
+
+
+def carpeta_escala(escala, raiz = 'datos_sinteticos', descarga = DESCARGA):
+    return os.path.join(raiz, f'madrid_x{escala:g}', descarga)
+
+
+def comparar(resultados, referencia, tolerancia = TOLERANCIA):
+    """Cruza los resultados con los de referencia por escala y etapa y marca las etapas más lentas de la cuenta."""
+
+    comparacion = resultados.merge(referencia[['escala', 'etapa', 'segundos', 'rss_pico_mb']],
+                                   on = ['escala', 'etapa'], how = 'left', suffixes = ('', '_referencia'))
+
+    comparacion['ratio_segundos'] = comparacion.segundos / comparacion.segundos_referencia
+    comparacion['ratio_rss_pico'] = comparacion.rss_pico_mb / comparacion.rss_pico_mb_referencia
+    mas_lenta = (comparacion.ratio_segundos > 1 + tolerancia) & \
+                (comparacion.segundos - comparacion.segundos_referencia > MINIMO_SEGUNDOS)
+    mas_memoria = (comparacion.ratio_rss_pico > 1 + tolerancia) & \
+                  (comparacion.rss_pico_mb - comparacion.rss_pico_mb_referencia > MINIMO_MB)
+    comparacion['regresion'] = mas_lenta | mas_memoria
+
+    return comparacion
+
+
+if __name__ == '__main__':
+    argumentos = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    argumentos.add_argument('--escalas', type = float, nargs = '+', default = [1])
+    argumentos.add_argument('--carpeta', default = None, help = 'descarga ya existente en vez de datos sintéticos')
+    argumentos.add_argument('--etapas', nargs = '+', default = ETAPAS, choices = ETAPAS)
+    argumentos.add_argument('--resultados', default = None, help = 'CSV al que se añaden los resultados')
+    argumentos.add_argument('--referencia', default = None, help = 'CSV de una ejecución anterior para comparar')
+    argumentos.add_argument('--tolerancia', type = float, default = TOLERANCIA)
+    argumentos = argumentos.parse_args()
+
+    if argumentos.carpeta:
+        carpetas = {0: argumentos.carpeta}
+    else:
+        carpetas = {escala: carpeta_escala(escala) for escala in argumentos.escalas}
+
+    resultados = []
+    for escala, carpeta in carpetas.items():
+        if not os.path.exists(os.path.join(carpeta, 'listings.csv')):
+            print(f'Generando datos sintéticos x{escala:g} en {carpeta}...')
+            generar(carpeta, escala)
+
+        resultado = medir_en_proceso_nuevo(carpeta, argumentos.etapas)
+        resultado.insert(0, 'escala', escala)
+        resultado.insert(0, 'fecha', pd.Timestamp.now().strftime('%Y-%m-%d %H:%M'))
+        resultados.append(resultado)
+
+        print(f'\n{carpeta}')
+        print(resultado.drop(columns = ['fecha', 'escala']).round(2).to_string(index = False))
+
+    resultados = pd.concat(resultados, ignore_index = True)
+
+    if argumentos.resultados:
+        resultados.to_csv(argumentos.resultados, mode = 'a', index = False,
+                          header = not os.path.exists(argumentos.resultados))
+
+    if argumentos.referencia:
+        referencia = pd.read_csv(argumentos.referencia).drop_duplicates(['escala', 'etapa'], keep = 'last')
+        comparacion = comparar(resultados, referencia, argumentos.tolerancia)
+
+        print('\nComparación con la referencia')
+        print(comparacion[['escala', 'etapa', 'segundos', 'segundos_referencia', 'ratio_segundos', 'ratio_rss_pico',
+                           'regresion']].round(2).to_string(index = False))
+
+        if comparacion.regresion.any():
+            sys.exit(1)
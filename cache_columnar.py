@@ -0,0 +1,259 @@
+"""CACHÉ COLUMNAR (ARROW) DE LAS TABLAS DEL DATAMART
+
+Los scripts de variables e insights empiezan con pd.read_sql('df') / pd.read_sql('df_preparado'). Eso pasa cada
+fila por el driver de SQLite y además pierde los tipos categóricos, que hay que volver a construir.
+
+SQLite sigue siendo la base de datos de referencia, pero al guardar una tabla dejamos también una copia en formato
+Arrow IPC sin comprimir en una carpeta junto a airbnb.db (DatosCaso1/airbnb_cache/<tabla>.arrow). Ese formato se
+puede abrir con memory map: leer el fichero no copia nada a memoria, y al pasar a pandas solo se tocan las páginas de
+las columnas que pedimos. Las categóricas se guardan como diccionarios y vuelven como categóricas.
+
+Para saber si la caché está al día, guardar_tabla (persistencia.py) apunta una versión por tabla en _versiones y la
+caché lleva esa misma versión en sus metadatos. Si no coinciden (o no hay caché) se lee de SQLite y se rehace.
+
+Cuando en SQLite solo cambian unas filas (reemplazar_filas y actualizar_columnas, en la reconstrucción incremental),
+la caché no se reescribe entera: parchear_cache deja esas filas (enteras, o marcadas como borradas) en un parche junto
+a la caché (<tabla>.parche.arrow) con la nueva versión, y al leer las filas del parche sustituyen a las de la base con
+el mismo id. Cuando el parche pasa de FRACCION_PARCHE de las filas de la base se fusionan en una base nueva.
+
+Uso:
+
+    from cache_columnar import guardar_cache, leer_tabla, parchear_cache
+    guardar_tabla(df, 'df_preparado', con)
+    guardar_cache(df, 'df_preparado', con)
+    ...
+    df = leer_tabla('df_preparado', con, columnas = ['distrito', 'precio_total'])
+    ...
+    version = version_tabla(con, 'df_preparado')
+    reemplazar_filas(cambios, 'df_preparado', con, borrar = borrados)
+    parchear_cache('df_preparado', con, version, filas = cambios, borrar = borrados)
+
+Para comparar tiempos con read_sql: python cache_columnar.py DatosCaso1/airbnb.db df_preparado
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from persistencia import abrir, ruta_db, version_tabla
+
+CLAVE_VERSION = b'version_sqlite'
+
+# Tamaño del parche (en fracción de las filas de la base) a partir del cual se fusiona con la base
+
+FRACCION_PARCHE = 0.1
+
+BORRADA = '_borrada'
+
+
+def ruta_cache(tabla, con):
+    """Ruta del fichero Arrow de una tabla: <carpeta de la db>/<nombre db>_cache/<tabla>.arrow"""
+
+    ruta = ruta_db(con)
+    carpeta = os.path.splitext(ruta)[0] + '_cache'
+    return os.path.join(carpeta, tabla + '.arrow')
+
+
+def ruta_parche(tabla, con):
+    return os.path.splitext(ruta_cache(tabla, con))[0] + '.parche.arrow'
+
+
+def escribir_arrow(df, ruta, metadatos = None, indice = False):
+    """Escribe df como Arrow IPC sin comprimir en ruta, con metadatos (bytes -> bytes) en el esquema."""
+
+    return _escribir(pa.Table.from_pandas(df, preserve_index = indice), ruta, metadatos)
+
+
+def _escribir(datos, ruta, metadatos = None):
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok = True)
+
+    if metadatos:
+        datos = datos.replace_schema_metadata({**(datos.schema.metadata or {}), **metadatos})
+
+    # Un fichero IPC lleva un solo diccionario por columna categórica: los trozos de la base y el parche lo comparten
+
+    datos = datos.unify_dictionaries()
+
+    # Escribimos en un temporal y renombramos, para que un lector nunca vea un fichero a medias
+
+    temporal = ruta + '.tmp'
+    with pa.OSFile(temporal, 'wb') as destino, pa.ipc.new_file(destino, datos.schema) as escritor:
+        escritor.write_table(datos)
+    os.replace(temporal, ruta)
+
+    return ruta
+
+
+def guardar_cache(df, tabla, con):
+    """Escribe df como Arrow IPC sin comprimir, con la versión actual de la tabla en SQLite."""
+
+    version = version_tabla(con, tabla) or ''
+    ruta = escribir_arrow(df, ruta_cache(tabla, con), {CLAVE_VERSION: version.encode()})
+
+    # Hasta que se borra, el parche anterior (con su versión) hace que la caché no esté al día
+
+    if os.path.exists(ruta_parche(tabla, con)):
+        os.remove(ruta_parche(tabla, con))
+
+    return ruta
+
+
+def leer_arrow(ruta, columnas = None):
+    # Con memory map read_all no copia los datos: solo se leen del disco las columnas que pasan a pandas
+
+    with pa.memory_map(ruta, 'r') as fuente:
+        datos = pa.ipc.open_file(fuente).read_all()
+
+    if columnas is not None:
+        datos = datos.select(columnas)
+
+    return datos
+
+
+def _version_cache(tabla, con):
+    # Si hay parche, la versión de la caché es la suya: se escribe después de la base
+
+    if not os.path.exists(ruta_cache(tabla, con)):
+        return None
+
+    ruta = ruta_parche(tabla, con) if os.path.exists(ruta_parche(tabla, con)) else ruta_cache(tabla, con)
+    with pa.memory_map(ruta, 'r') as fuente:
+        metadatos = pa.ipc.open_file(fuente).schema.metadata or {}
+
+    return metadatos.get(CLAVE_VERSION)
+
+
+def cache_vigente(tabla, con):
+    """True si existe la caché de la tabla y su versión coincide con la de SQLite."""
+
+    version = version_tabla(con, tabla)
+    return version is not None and _version_cache(tabla, con) == version.encode()
+
+
+def _filtrar(datos, clave, ids, excluir = False):
+    dentro = pc.is_in(datos[clave], pa.array(np.asarray(ids, dtype = 'int64')))
+    return datos.filter(pc.invert(dentro) if excluir else dentro)
+
+
+def _leer_cache(tabla, con, columnas = None, ids = None, clave = 'id'):
+    # La base con el parche aplicado: las filas de la base cuyo id está en el parche se cambian por las del parche,
+    # salvo las marcadas como borradas
+
+    datos = leer_arrow(ruta_cache(tabla, con))
+    nombres = datos.column_names if columnas is None else list(columnas)
+    parche = ruta_parche(tabla, con)
+
+    if os.path.exists(parche) or ids is not None:
+        datos = datos.select(nombres if clave in nombres else nombres + [clave])
+
+    if os.path.exists(parche):
+        parche = leer_arrow(parche)
+        datos = _filtrar(datos, clave, parche[clave], excluir = True)
+        parche = parche.filter(pc.invert(parche[BORRADA])).select(datos.column_names)
+        datos = pa.concat_tables([datos, parche])
+
+    if ids is not None:
+        datos = _filtrar(datos, clave, ids)
+
+    return datos.select(nombres)
+
+
+def leer_tabla(tabla, con, columnas = None, ids = None):
+    """Lee una tabla del datamart desde la caché Arrow si está al día, y si no desde SQLite (rehaciendo la caché).
+    Con ids, solo las filas con esos id."""
+
+    if not cache_vigente(tabla, con):
+        with abrir(con) as conexion:
+            df = pd.read_sql(f'SELECT * FROM "{tabla}"', conexion)
+        guardar_cache(df, tabla, con)
+
+    return _leer_cache(tabla, con, columnas, ids).to_pandas()
+
+
+def parchear_cache(tabla, con, version_anterior, filas = None, actualizadas = None, borrar = (), clave = 'id'):
+    """Lleva a la caché de una tabla el cambio que se acaba de hacer en SQLite sin reescribirla entera: filas nuevas o
+    reescritas enteras (reemplazar_filas), actualizadas (el id y algunas columnas de filas que ya estaban,
+    actualizar_columnas) y claves borradas.
+
+    version_anterior es la versión de la tabla en SQLite antes del cambio. Si la caché no estaba al día con ella no se
+    puede parchear y se deja como está (leer_tabla la rehará desde SQLite). Devuelve True si se ha parcheado.
+    """
+
+    if version_anterior is None or _version_cache(tabla, con) != version_anterior.encode():
+        return False
+
+    esquema = leer_arrow(ruta_cache(tabla, con)).schema
+    partes = [] if filas is None else [filas]
+
+    if actualizadas is not None and len(actualizadas):
+        columnas = [columna for columna in actualizadas.columns if columna != clave]
+        actuales = _leer_cache(tabla, con, ids = actualizadas[clave]).to_pandas()
+        partes.append(actuales.drop(columns = columnas).merge(actualizadas, on = clave)[esquema.names])
+
+    partes = [pa.Table.from_pandas(parte, preserve_index = False) for parte in partes if len(parte)]
+    escritas = np.concatenate([np.empty(0, dtype = 'int64')] + [parte[clave].to_numpy() for parte in partes])
+    borradas = np.setdiff1d(np.asarray(list(borrar), dtype = 'int64'), escritas)
+    claves = np.concatenate([escritas, borradas])
+
+    version = {CLAVE_VERSION: (version_tabla(con, tabla) or '').encode()}
+
+    # Las filas nuevas tienen que tener el esquema de la base (p.e. un contador que en el cambio cabe en int8 y en la
+    # base es int16). Si no se puede (una columna nueva, un valor que no cabe), se fusiona ya con la base
+
+    try:
+        nuevas = [parte.select(esquema.names).cast(esquema) for parte in partes]
+    except (KeyError, pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        nuevas = None
+
+    anterior = leer_arrow(ruta_parche(tabla, con)) if os.path.exists(ruta_parche(tabla, con)) else None
+
+    if nuevas is not None:
+        esquema_parche = esquema.append(pa.field(BORRADA, pa.bool_()))
+        marcadas = pa.Table.from_arrays([pa.array(borradas, type = campo.type) if campo.name == clave
+                                         else pa.nulls(len(borradas), campo.type) for campo in esquema], schema = esquema)
+
+        parche = [_filtrar(anterior, clave, claves, excluir = True)] if anterior is not None else []
+        parche += [nueva.append_column(BORRADA, pa.array(np.zeros(len(nueva), dtype = bool))) for nueva in nuevas]
+        parche += [marcadas.append_column(BORRADA, pa.array(np.ones(len(borradas), dtype = bool)))]
+        parche = pa.concat_tables([parte.cast(esquema_parche) for parte in parche])
+
+        if len(parche) <= FRACCION_PARCHE * leer_arrow(ruta_cache(tabla, con)).num_rows:
+            _escribir(parche, ruta_parche(tabla, con), version)
+            return True
+
+    try:
+        datos = pa.concat_tables([_filtrar(_leer_cache(tabla, con), clave, claves, excluir = True)]
+                                 + (partes if nuevas is None else nuevas), promote_options = 'permissive')
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        return False
+
+    _escribir(datos, ruta_cache(tabla, con), version)
+    if anterior is not None:
+        os.remove(ruta_parche(tabla, con))
+
+    return True
+
+
+if __name__ == '__main__':
+    ruta = sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/airbnb.db'
+    tabla = sys.argv[2] if len(sys.argv) > 2 else 'df_preparado'
+
+    inicio = time.perf_counter()
+    with abrir(ruta) as conexion:
+        df = pd.read_sql(f'SELECT * FROM "{tabla}"', conexion)
+    print(f'read_sql: {time.perf_counter() - inicio:.3f} s, {df.shape}')
+
+    leer_tabla(tabla, ruta)  # primera vez: crea la caché si no está
+
+    inicio = time.perf_counter()
+    df = leer_tabla(tabla, ruta)
+    print(f'leer_tabla (caché): {time.perf_counter() - inicio:.3f} s, {df.shape}')
+
+    inicio = time.perf_counter()
+    df = leer_tabla(tabla, ruta, columnas = ['distrito', 'precio_total'])
+    print(f'leer_tabla (2 columnas): {time.perf_counter() - inicio:.3f} s, {df.shape}')
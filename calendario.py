@@ -0,0 +1,172 @@
+"""OCUPACIÓN A PARTIR DEL CALENDARIO (CALENDAR.CSV.GZ) POR BLOQUES
+
+En el script de datos no usábamos calendar.csv.gz: tiene una fila por inmueble y día del año siguiente (decenas de
+millones de filas para Madrid) y cargarlo entero no cabía en memoria, así que la ocupación sale de availability_365.
+
+Aquí lo leemos por bloques y en cada bloque agregamos por inmueble y mes:
+
+- dias: días del calendario
+- dias_ocupados: días no disponibles (available = 'f')
+- dias_finde / dias_ocupados_finde: lo mismo solo para las noches de viernes y sábado
+- suma_precio / dias_precio: para el precio medio anunciado
+
+Los parciales de los bloques se van sumando en un acumulador que se compacta cuando crece, así que la memoria depende
+del número de inmuebles y meses (el tamaño del resultado) y no del número de filas del calendario.
+
+Resultados (en el datamart):
+
+- calendario_mensual: una fila por inmueble y mes con los contadores anteriores
+- calendario: una fila por inmueble con ocupacion_calendario, ocupacion_laborable, ocupacion_finde (% de días no
+  disponibles) y precio_medio_calendario, que se pueden cruzar por id con df_preparado
+
+Ojo: un día no disponible puede ser una reserva o un bloqueo del propietario, igual que en availability_365. La ventaja
+es tenerlo por mes y separar laborables y fines de semana.
+
+Uso: python calendario.py [DatosCaso1/calendar.csv.gz] [DatosCaso1/airbnb.db]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache_columnar import leer_tabla
+from ingesta import pico_rss_mb
+from persistencia import abrir, guardar_tabla
+
+TAM_BLOQUE_CALENDARIO = 500_000
+
+# Cuando el acumulador pasa de este número de filas (y del doble de lo que quedó en la última compactación) se agrupa
+# para volver a una fila por inmueble y mes
+
+MAX_FILAS_ACUMULADOR = 2_000_000
+
+COLUMNAS_CALENDARIO = ['listing_id', 'date', 'available', 'price']
+
+CONTADORES = ['dias', 'dias_ocupados', 'dias_finde', 'dias_ocupados_finde', 'suma_precio', 'dias_precio']
+
+# Noches de fin de semana: viernes (4) y sábado (5)
+
+DIAS_FINDE = (4, 5)
+
+
+def _precio(categorias):
+    # '$1,234.00' -> 1234.0. Se hace sobre las categorías (pocos valores distintos) y no sobre cada fila
+
+    return pd.to_numeric(pd.Index(categorias).astype(str).str.replace(r'[$,]', '', regex = True), errors = 'coerce')
+
+
+def agregar_bloque(bloque):
+    """Contadores por inmueble y mes (AAAAMM) de un bloque del calendario."""
+
+    fechas = pd.to_datetime(bloque.date.cat.categories, format = '%Y-%m-%d')
+    codigos_fecha = bloque.date.cat.codes.to_numpy()
+
+    mes = (fechas.year * 100 + fechas.month).to_numpy()[codigos_fecha]
+    finde = np.isin(fechas.dayofweek.to_numpy(), DIAS_FINDE)[codigos_fecha]
+    ocupado = (bloque.available == 'f').to_numpy()
+
+    precio = _precio(bloque.price.cat.categories).to_numpy(dtype = 'float64')[bloque.price.cat.codes.to_numpy()]
+    precio[bloque.price.cat.codes.to_numpy() < 0] = np.nan
+    con_precio = ~np.isnan(precio)
+
+    parcial = pd.DataFrame({'id': bloque.listing_id.to_numpy(),
+                            'mes': mes,
+                            'dias': 1,
+                            'dias_ocupados': ocupado.astype('int32'),
+                            'dias_finde': finde.astype('int32'),
+                            'dias_ocupados_finde': (ocupado & finde).astype('int32'),
+                            'suma_precio': np.where(con_precio, precio, 0.0),
+                            'dias_precio': con_precio.astype('int32')})
+
+    return parcial.groupby(['id', 'mes'], sort = False).sum()
+
+
+def _compactar(parciales):
+    return pd.concat(parciales).groupby(level = ['id', 'mes'], sort = False).sum()
+
+
+def agregar_calendario(ruta = 'DatosCaso1/calendar.csv.gz', tam_bloque = TAM_BLOQUE_CALENDARIO):
+    """Lee el calendario por bloques y devuelve la tabla por inmueble y mes (calendario_mensual)."""
+
+    lector = pd.read_csv(ruta,
+                         usecols = COLUMNAS_CALENDARIO,
+                         dtype = {'listing_id': 'int64', 'date': 'category', 'available': 'category', 'price': 'category'},
+                         chunksize = tam_bloque)
+
+    # Si el resultado ya compactado pasa de MAX_FILAS_ACUMULADOR, compactar con un umbral fijo volvería a agrupar todo
+    # el acumulador en cada bloque. Con el doble de lo compactado el coste total se mantiene lineal.
+
+    parciales, filas, compactado = [], 0, 0
+
+    with lector:
+        for bloque in lector:
+            parcial = agregar_bloque(bloque)
+            parciales.append(parcial)
+            filas += len(parcial)
+
+            if filas > max(MAX_FILAS_ACUMULADOR, 2 * compactado):
+                parciales = [_compactar(parciales)]
+                filas = compactado = len(parciales[0])
+
+    if not parciales:
+        return pd.DataFrame(columns = ['id', 'mes'] + CONTADORES)
+
+    mensual = _compactar(parciales).sort_index().reset_index()
+    mensual['mes'] = mensual.mes.astype('int32')
+    for contador in CONTADORES:
+        if contador != 'suma_precio':
+            mensual[contador] = mensual[contador].astype('int32')
+
+    return mensual
+
+
+def resumir(mensual):
+    """Una fila por inmueble: % de días ocupados (total, laborables y fines de semana) y precio medio anunciado."""
+
+    total = mensual.groupby('id')[CONTADORES].sum()
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        resumen = pd.DataFrame({
+            'ocupacion_calendario': total.dias_ocupados / total.dias * 100,
+            'ocupacion_laborable': (total.dias_ocupados - total.dias_ocupados_finde) / (total.dias - total.dias_finde) * 100,
+            'ocupacion_finde': total.dias_ocupados_finde / total.dias_finde * 100,
+            'precio_medio_calendario': total.suma_precio / total.dias_precio.replace(0, np.nan),
+            'dias_calendario': total.dias.astype('int32'),
+        })
+
+    return resumen.astype({'ocupacion_calendario': 'float32', 'ocupacion_laborable': 'float32',
+                           'ocupacion_finde': 'float32', 'precio_medio_calendario': 'float32'}).reset_index()
+
+
+def procesar_calendario(ruta = 'DatosCaso1/calendar.csv.gz', con = 'DatosCaso1/airbnb.db', tam_bloque = TAM_BLOQUE_CALENDARIO):
+    """Agrega el calendario y guarda calendario_mensual y calendario en el datamart. Devuelve el resumen por inmueble."""
+
+    mensual = agregar_calendario(ruta, tam_bloque)
+    resumen = resumir(mensual)
+
+    guardar_tabla(mensual, 'calendario_mensual', con, indices = ['id', 'mes'])
+    guardar_tabla(resumen, 'calendario', con)
+
+    return resumen
+
+
+def leer_resumen(con, columnas = None):
+    """Resumen por inmueble del calendario si ya se ha procesado (python calendario.py), y si no None."""
+
+    with abrir(con) as conexion:
+        existe = conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'calendario'").fetchone()
+
+    return leer_tabla('calendario', con, columnas) if existe else None
+
+
+if __name__ == '__main__':
+    ruta = sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/calendar.csv.gz'
+    con = sys.argv[2] if len(sys.argv) > 2 else 'DatosCaso1/airbnb.db'
+
+    inicio = time.perf_counter()
+    resumen = procesar_calendario(ruta, con)
+
+    print(resumen.describe())
+    print(f'{len(resumen)} inmuebles, {time.perf_counter() - inicio:.1f} s, pico RSS {pico_rss_mb():.1f} MB')
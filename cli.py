@@ -0,0 +1,197 @@
+"""INFORME DE KPIS SIN GRÁFICOS (ARRANQUE RÁPIDO)
+
+Los tres scripts importan matplotlib.pyplot, seaborn, folium y sqlalchemy al principio y pintan gráficos
+(plt.show(), plot.kde(), value_counts().plot.bar()) aunque solo queramos el resultado impreso. En los nodos de batch
+eso son segundos de importación y de dibujo en cada ejecución.
+
+Este es el punto de entrada para esas ejecuciones:
+
+- lee de la caché columnar solo las columnas que necesita de df_preparado
+- imprime las tablas de KPIs de las preguntas semilla: precio, precio de compra y ocupación en total, por distrito,
+  por barrio y por tipo de alquiler, rankings y el minicubo por las discretizaciones
+- no importa matplotlib ni folium salvo que se pidan gráficos (--graficos, en PNG con el backend Agg, sin ventanas)
+  o el mapa (--mapa), y nunca importa seaborn ni sqlalchemy
+- mide el tiempo desde el arranque hasta la primera tabla de KPIs
+
+Uso:
+
+    python cli.py                                   # solo el informe por pantalla
+    python cli.py --top 15 --graficos graficos      # y los gráficos de barras en graficos/*.png
+    python cli.py --mapa mapa_madrid.html           # y el mapa de todos los inmuebles
+    python cli.py --medir-arranque                  # arranque en frío del informe frente a importar los gráficos
+"""
+
+import time
+
+# Antes de importar nada más, para que las importaciones cuenten en el tiempo hasta la primera tabla
+
+INICIO = time.perf_counter()
+
+import argparse
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from cache_columnar import leer_tabla
+from cubo import construir_cubo
+from kpis import calcular_kpis
+
+CON = 'DatosCaso1/airbnb.db'
+
+METRICAS = ['precio_total', 'precio_compra', 'ocupacion']
+
+DIMENSIONES = ['distrito', 'neighbourhood', 'room_type']
+
+DISCRETIZACIONES = ['bedrooms_disc', 'accommodates_disc', 'beds_disc', 'number_of_reviews_disc']
+
+# Lo que importan los scripts y este informe evita
+
+GRAFICOS = ['matplotlib', 'seaborn', 'folium', 'sqlalchemy']
+
+TOP = 10
+
+
+def cargar(con = CON):
+    """Las columnas de df_preparado que usa el informe (sin coordenadas, PdI, competencia ni textos)."""
+
+    return leer_tabla('df_preparado', con, columnas = DIMENSIONES + METRICAS + DISCRETIZACIONES)
+
+
+def tablas_kpis(df, top = TOP):
+    """Tablas del informe, en el orden en que se imprimen: nombre -> DataFrame."""
+
+    kpis = calcular_kpis(df, metricas = METRICAS)
+    columnas = ['grupo', 'inmuebles'] + [f'{metrica}_{agregacion}' for metrica in METRICAS
+                                         for agregacion in ('mediana', 'media')]
+
+    def nivel(nombre):
+        return kpis.loc[kpis.nivel == nombre, columnas].set_index('grupo')
+
+    distritos = nivel('distrito')
+    barrios = nivel('neighbourhood')
+
+    cubo = construir_cubo(df, DISCRETIZACIONES, METRICAS, agregaciones = 'median')
+
+    tablas = {
+        'Total': nivel('total'),
+        'Por distrito (mediana del precio por noche)': distritos.sort_values('precio_total_mediana', ascending = False),
+        f'Top {top} barrios por precio por noche': barrios.nlargest(top, 'precio_total_mediana'),
+        'Por tipo de alquiler': nivel('room_type'),
+        'Ocupación media por distrito': distritos.ocupacion_media.sort_values(ascending = False).to_frame(),
+        f'Top {top} barrios por ocupación media': barrios.nlargest(top, 'ocupacion_media')[['inmuebles', 'ocupacion_media']],
+        'Distritos más baratos de compra': distritos.nsmallest(top, 'precio_compra_mediana')[['inmuebles', 'precio_compra_mediana']],
+    }
+    for discretizacion in DISCRETIZACIONES:
+        tablas[f'Minicubo por {discretizacion}'] = cubo[discretizacion]
+
+    return tablas
+
+
+def guardar_graficos(tablas, carpeta):
+    """Un gráfico de barras por tabla en carpeta/<n>.png. Solo aquí se importa matplotlib, sin ventanas."""
+
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    os.makedirs(carpeta, exist_ok = True)
+
+    rutas = []
+    for numero, (nombre, tabla) in enumerate(tablas.items(), start = 1):
+        columna = next((c for c in tabla.columns if c.startswith(('precio_total', 'ocupacion'))), None)
+        if columna is None or len(tabla) < 2:
+            continue
+
+        figura, eje = plt.subplots(figsize = (8, max(3, 0.3 * len(tabla))))
+        tabla[columna].iloc[::-1].plot.barh(ax = eje, title = nombre)
+        eje.set_xlabel(columna)
+        figura.tight_layout()
+
+        rutas.append(os.path.join(carpeta, f'{numero:02d}.png'))
+        figura.savefig(rutas[-1], dpi = 100)
+        plt.close(figura)
+
+    return rutas
+
+
+def guardar_mapa(ruta, con = CON):
+    # folium solo se importa si se pide el mapa
+
+    from mapas import mapa_inmuebles
+
+    df = leer_tabla('df_preparado', con, columnas = ['latitude', 'longitude', 'precio_total'])
+    mapa_inmuebles(df, 'precio_total').save(ruta)
+
+
+def informe(con = CON, top = TOP, graficos = None, mapa = None):
+    """Imprime las tablas de KPIs (y guarda gráficos y mapa si se piden). Devuelve los segundos hasta la primera."""
+
+    df = cargar(con)
+    tablas = tablas_kpis(df, top)
+
+    primera = None
+    with pd.option_context('display.width', 160, 'display.max_columns', 20, 'display.float_format', '{:,.1f}'.format):
+        for nombre, tabla in tablas.items():
+            print(f'\n{nombre.upper()}\n')
+            print(tabla.to_string())
+            if primera is None:
+                primera = time.perf_counter() - INICIO
+                sys.stdout.flush()
+
+    if graficos:
+        print(f'\n{len(guardar_graficos(tablas, graficos))} gráficos en {graficos}/')
+    if mapa:
+        guardar_mapa(mapa, con)
+        print(f'Mapa en {mapa}')
+
+    return primera
+
+
+def _en_proceso_nuevo(comando):
+    resultado = subprocess.run([sys.executable] + comando, capture_output = True, text = True)
+    if resultado.returncode != 0:
+        return None
+    return float(resultado.stdout.strip().splitlines()[-1].split()[-1])
+
+
+def medir_arranque(con = CON, repeticiones = 3):
+    """Arranque en frío (un proceso nuevo cada vez, mínimo de las repeticiones) hasta la primera tabla de KPIs, y lo
+    que cuesta importar cada librería de gráficos de los scripts."""
+
+    informe = [_en_proceso_nuevo([os.path.abspath(__file__), '--con', con, '--solo-tiempo'])
+               for _ in range(repeticiones)]
+    print(f'Informe, hasta la primera tabla de KPIs: {min(informe):.2f} s')
+
+    for modulo in ['matplotlib.pyplot', 'seaborn', 'folium', 'sqlalchemy']:
+        importacion = [_en_proceso_nuevo(['-c', f'import time; inicio = time.perf_counter(); import {modulo}; '
+                                                f'print(time.perf_counter() - inicio)']) for _ in range(repeticiones)]
+        print(f'import {modulo}: ' + ('no instalado' if None in importacion else f'{min(importacion):.2f} s'))
+
+
+if __name__ == '__main__':
+    argumentos = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    argumentos.add_argument('--con', default = CON, help = 'base de datos SQLite del datamart')
+    argumentos.add_argument('--top', type = int, default = TOP)
+    argumentos.add_argument('--graficos', default = None, metavar = 'CARPETA', help = 'guarda los gráficos en PNG')
+    argumentos.add_argument('--mapa', default = None, metavar = 'HTML', help = 'guarda el mapa de los inmuebles')
+    argumentos.add_argument('--medir-arranque', action = 'store_true')
+    argumentos.add_argument('--solo-tiempo', action = 'store_true', help = 'no imprime las tablas, solo el tiempo')
+    argumentos = argumentos.parse_args()
+
+    if argumentos.medir_arranque:
+        medir_arranque(argumentos.con)
+        sys.exit()
+
+    if argumentos.solo_tiempo:
+        tablas_kpis(cargar(argumentos.con), argumentos.top)
+        print(f'{time.perf_counter() - INICIO:.4f}')
+        sys.exit()
+
+    primera = informe(argumentos.con, argumentos.top, argumentos.graficos, argumentos.mapa)
+
+    importados = [modulo for modulo in GRAFICOS if modulo in sys.modules]
+    print(f'\nPrimera tabla de KPIs a los {primera:.2f} s del arranque. '
+          f'Librerías de gráficos importadas: {", ".join(importados) or "ninguna"}')
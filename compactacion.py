@@ -0,0 +1,209 @@
+"""REPRESENTACIÓN COMPACTA DE DF_PREPARADO
+
+df_preparado es la tabla sobre la que trabajan insights, el cubo, los KPIs y los mapas, pero en memoria ocupa mucho
+más de lo que necesita:
+
+- description (y name) son textos largos como objetos de Python, y son la mayor parte de la tabla aunque solo se leen
+  para mirar algún inmueble suelto
+- los contadores pequeños (beds, bedrooms, accommodates, minimum_nights, ocupacion...) van en int64 o float64
+- distrito, neighbourhood, room_type y las etiquetas *_disc vuelven de SQLite como texto (object), repitiendo la misma
+  cadena en cada fila
+
+Aquí compactamos la tabla antes de guardarla:
+
+- los textos libres pasan a una tabla aparte (textos, con clave id) que se lee solo para los ids que hagan falta
+- los enteros bajan al tipo más pequeño en que caben, y los float que son enteros sin nulos pasan a entero. Los que
+  se multiplican entre sí (price, beds, m2, precio_m2) no bajan de int32: m2 x precio_m2 en int16 desborda
+- el resto de float pasa a float32, salvo latitud y longitud (float32 se queda en ~0.5 m) y precio_total (con float32
+  las medianas de los informes salen como 68.599998). Los ids siguen en int64 porque los ids nuevos de Inside Airbnb
+  tienen 18 cifras.
+- las columnas de texto pasan a categóricas con un conjunto de categorías fijo (room_type, las etiquetas de las
+  discretizaciones, el PdI más cercano), así los códigos son los mismos en todas las descargas. Las de dominio abierto
+  (distrito, barrio) van con sus categorías ordenadas.
+
+compactar() se puede aplicar dos veces sin cambiar nada, así que también sirve para recuperar los tipos si la tabla se
+ha leído de SQLite.
+
+Uso:
+
+    from compactacion import compactar, guardar_textos, leer_textos
+    guardar_textos(df, con)                                 # antes de compactar: la tabla textos
+    df = compactar(df)                                      # sin description ni name, ~5x menos memoria
+    leer_textos(con, ids = [12345, 67890])                  # description y name de esos inmuebles
+
+Para ver la memoria antes y después: python compactacion.py DatosCaso1/airbnb.db
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from distancias import PUNTOS_INTERES
+from limpieza import CATEGORICAS
+from motor_variables import PARAMETROS
+from persistencia import abrir, guardar_tabla, reemplazar_filas
+
+TEXTOS = ['description', 'name']
+
+TABLA_TEXTOS = 'textos'
+
+# Categorías fijas. Si aparece un valor que no está (p.e. un room_type nuevo) se añade al final, no se pierde.
+
+CATEGORIAS_FIJAS = {
+    'room_type': ['Entire home/apt', 'Private room', 'Shared room', 'Hotel room'],
+    'host_is_superhost': ['f', 't'],
+    'bedrooms_disc': list(PARAMETROS['bedrooms_disc_etiquetas'].values()) + ['-999'],
+    'pdi_cercano': list(PUNTOS_INTERES),
+    **{variable + '_disc': list(etiquetas) for variable, etiquetas in PARAMETROS['etiquetas_disc'].items()},
+}
+
+CATEGORIAS_ABIERTAS = CATEGORICAS + ['distrito']
+
+ENTEROS_ANCHOS = ['price', 'beds', 'm2', 'precio_m2']
+
+ANCHO_MINIMO = 'int32'
+
+# Columnas que no se tocan: identificadores de 18 cifras, coordenadas y el precio por noche
+
+SIN_COMPACTAR = ['id', 'host_id', 'latitude', 'longitude', 'precio_total']
+
+TAM_CONSULTA = 900
+
+
+def memoria_mb(df):
+    """Memoria de df en MB, contando el contenido de los objetos de Python."""
+
+    return df.memory_usage(deep = True, index = False).sum() / 1024 ** 2
+
+
+def _categorica(serie, fijas = None):
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        valores = serie.cat.categories[serie.cat.codes[serie.cat.codes >= 0].unique()]
+    else:
+        valores = serie.dropna().unique()
+
+    valores = pd.Index(valores).astype(str)
+    if fijas is None:
+        categorias = sorted(valores)
+    else:
+        categorias = list(fijas) + sorted(set(valores) - set(fijas))
+
+    if isinstance(serie.dtype, pd.CategoricalDtype) and list(serie.cat.categories) == categorias:
+        return serie
+
+    return pd.Categorical(serie.astype(object).where(serie.notna(), None).map(str, na_action = 'ignore'),
+                          categories = categorias)
+
+
+def _ensanchar(valores, minimo):
+    # Sube al entero minimo (con nulos si valores es Int8, Int16...) si el downcast ha bajado de ahí
+
+    if minimo is None or valores.dtype.itemsize >= np.dtype(minimo).itemsize:
+        return valores
+    if isinstance(valores.dtype, pd.api.extensions.ExtensionDtype):
+        return valores.astype(minimo.capitalize())
+    return valores.astype(minimo)
+
+
+def _numerica(serie, minimo = None):
+    if pd.api.types.is_bool_dtype(serie):
+        return serie
+
+    nulos = serie.isna()
+
+    if pd.api.types.is_integer_dtype(serie) or (pd.api.types.is_float_dtype(serie) and not nulos.any()):
+        # Con tolerancia: precio_compra es entero salvo el error de redondeo de factor_compra (0.7)
+
+        valores = serie.to_numpy(dtype = 'float64', na_value = np.nan)
+        enteros = np.round(valores)
+        if not nulos.any() and np.allclose(valores, enteros, rtol = 0, atol = 1e-6):
+            return _ensanchar(pd.to_numeric(enteros.astype('int64'), downcast = 'integer'), minimo)
+
+    if pd.api.types.is_integer_dtype(serie):
+        # Entero con nulos (Int16, Int32...): nos quedamos con el entero con nulos más pequeño
+
+        return _ensanchar(pd.to_numeric(serie, downcast = 'integer'), minimo)
+
+    return serie.to_numpy(dtype = 'float32', na_value = np.nan)
+
+
+def compactar(df, textos = TEXTOS):
+    """Copia de df sin las columnas de texto libre, con los números reducidos y el texto como categóricas."""
+
+    compacto = {}
+    for columna in df.columns:
+        serie = df[columna]
+
+        if columna in textos:
+            continue
+        if columna in SIN_COMPACTAR:
+            compacto[columna] = serie
+        elif columna in CATEGORIAS_FIJAS:
+            compacto[columna] = _categorica(serie, CATEGORIAS_FIJAS[columna])
+        elif columna in CATEGORIAS_ABIERTAS or isinstance(serie.dtype, pd.CategoricalDtype) \
+                or pd.api.types.is_string_dtype(serie) or serie.dtype == object:
+            compacto[columna] = _categorica(serie)
+        elif pd.api.types.is_numeric_dtype(serie):
+            compacto[columna] = _numerica(serie, ANCHO_MINIMO if columna in ENTEROS_ANCHOS else None)
+        else:
+            compacto[columna] = serie
+
+    return pd.DataFrame(compacto, index = df.index)
+
+
+# ALMACÉN DE TEXTOS
+
+def guardar_textos(df, con, textos = TEXTOS):
+    """Reemplaza la tabla textos con las columnas de texto libre de df por id."""
+
+    guardar_tabla(df[['id'] + [columna for columna in textos if columna in df.columns]], TABLA_TEXTOS, con,
+                  indices = ['id'])
+
+
+def reemplazar_textos(df, con, borrar = (), textos = TEXTOS):
+    """Upsert por id en la tabla textos (para la reconstrucción incremental)."""
+
+    reemplazar_filas(df[['id'] + [columna for columna in textos if columna in df.columns]], TABLA_TEXTOS, con,
+                     borrar = borrar)
+
+
+def leer_textos(con, ids = None, columnas = TEXTOS):
+    """Textos de los inmuebles con esos ids (todos si ids es None), con el id como índice."""
+
+    seleccion = ', '.join(f'"{columna}"' for columna in ['id'] + list(columnas))
+
+    with abrir(con) as conexion:
+        if ids is None:
+            textos = pd.read_sql(f'SELECT {seleccion} FROM "{TABLA_TEXTOS}"', conexion)
+        else:
+            ids = [int(id_) for id_ in pd.unique(np.asarray(ids, dtype = 'int64'))]
+            partes = [pd.read_sql(f'SELECT {seleccion} FROM "{TABLA_TEXTOS}" WHERE id IN '
+                                  f'({", ".join("?" * len(ids[inicio:inicio + TAM_CONSULTA]))})',
+                                  conexion, params = ids[inicio:inicio + TAM_CONSULTA])
+                      for inicio in range(0, len(ids), TAM_CONSULTA)]
+            textos = pd.concat(partes, ignore_index = True) if partes else pd.DataFrame(columns = ['id', *columnas])
+
+    return textos.set_index('id')
+
+
+def con_textos(df, con, columnas = TEXTOS):
+    """df con las columnas de texto de sus inmuebles (solo se leen las de sus ids)."""
+
+    return df.join(leer_textos(con, df.id, columnas), on = 'id')
+
+
+if __name__ == '__main__':
+    ruta = sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/airbnb.db'
+
+    with abrir(ruta) as conexion:
+        df = pd.read_sql('SELECT * FROM df_preparado', conexion)
+
+    compacto = compactar(df)
+
+    print(f'df_preparado desde SQLite: {memoria_mb(df):.1f} MB, compacto: {memoria_mb(compacto):.1f} MB '
+          f'({memoria_mb(df) / memoria_mb(compacto):.1f}x)')
+    print(pd.DataFrame({'antes': df.dtypes.astype(str), 'despues': compacto.dtypes.astype(str),
+                        'mb_antes': df.memory_usage(deep = True, index = False) / 1024 ** 2,
+                        'mb_despues': compacto.memory_usage(deep = True, index = False) / 1024 ** 2})
+          .round(3).to_string())
@@ -0,0 +1,168 @@
+"""COMPETENCIA ESPACIAL ENTRE INMUEBLES
+
+Hasta ahora la única medida de competencia era el número de inmuebles por barrio (neighbourhood) y el
+calculated_host_listings_count revisado a ojo. Pero un barrio grande y uno pequeño no son comparables, y un piso
+en el borde de un barrio compite con los del barrio de al lado.
+
+Aquí construimos una sola vez un índice espacial (KD-tree) sobre las coordenadas proyectadas a metros de todos los
+inmuebles del datamart, y con él respondemos en bloque para todos los inmuebles a:
+
+- ¿cuántos inmuebles hay a menos de R metros?
+- ¿cuáles son los k inmuebles más cercanos?
+
+El KD-tree hace cada consulta en tiempo logarítmico, así que escala a cientos de miles de inmuebles sin el bucle
+O(n²) de comparar todos contra todos. Las consultas usan workers hilos (por defecto -1, todos los núcleos); dentro de un
+pool de procesos (pipeline.py) hay que pasar workers = 1 para no tener procesos x núcleos hilos.
+
+Uso:
+
+    from competencia import crear_variables_competencia
+    df = df.join(crear_variables_competencia(df))
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from distancias import proyectar_metros
+
+
+class IndiceEspacial:
+    """KD-tree sobre las coordenadas (en metros) de un conjunto de inmuebles."""
+
+    def __init__(self, latitudes, longitudes, origen = None, workers = -1):
+
+        latitudes = np.asarray(latitudes, dtype = 'float64')
+        longitudes = np.asarray(longitudes, dtype = 'float64')
+
+        # Guardamos el origen para proyectar consultas de puntos externos (p.e. un inmueble candidato) igual que los indexados
+
+        self.origen = origen if origen is not None else (latitudes.mean(), longitudes.mean())
+        self.xy = proyectar_metros(latitudes, longitudes, self.origen)
+        self.arbol = cKDTree(self.xy)
+        self.workers = workers
+
+    @classmethod
+    def desde_df(cls, df, lat = 'latitude', lon = 'longitude', workers = -1):
+        return cls(df[lat].to_numpy(), df[lon].to_numpy(), workers = workers)
+
+    def __len__(self):
+        return self.xy.shape[0]
+
+    def _workers(self, workers):
+        # Los de la consulta o, si no se dan, los del índice
+
+        return self.workers if workers is None else workers
+
+    def _puntos(self, latitudes, longitudes, bloque = slice(None)):
+        # Devuelve los puntos a consultar y, si son inmuebles indexados, su posición en el índice
+
+        if latitudes is None:
+            posiciones = np.arange(len(self))[bloque]
+            return self.xy[posiciones], posiciones
+        return proyectar_metros(latitudes, longitudes, self.origen), None
+
+    def contar_en_radio(self, radio, latitudes = None, longitudes = None, bloque = slice(None), workers = None):
+        """Número de inmuebles a menos de radio metros de cada punto.
+
+        Sin coordenadas se consulta para los inmuebles indexados (o solo los de bloque) y cada uno no se cuenta a sí mismo.
+        """
+
+        puntos, propios = self._puntos(latitudes, longitudes, bloque)
+        conteo = self.arbol.query_ball_point(puntos, r = radio, return_length = True, workers = self._workers(workers))
+
+        return conteo - 1 if propios is not None else conteo
+
+    def vecinos_en_radio(self, radio, latitudes = None, longitudes = None, workers = None):
+        """Posiciones de los inmuebles a menos de radio metros de cada punto (array de arrays)."""
+
+        puntos, propios = self._puntos(latitudes, longitudes)
+        vecinos = self.arbol.query_ball_point(puntos, r = radio, workers = self._workers(workers))
+
+        salida = np.empty(len(vecinos), dtype = object)
+        for i, lista in enumerate(vecinos):
+            lista = np.asarray(lista, dtype = 'int64')
+            salida[i] = lista[lista != i] if propios is not None else lista
+
+        return salida
+
+    def k_vecinos(self, k, latitudes = None, longitudes = None, bloque = slice(None), workers = None):
+        """Distancias (m) y posiciones de los k inmuebles más cercanos a cada punto, ordenados de más cerca a más lejos.
+
+        Sin coordenadas se consulta para los inmuebles indexados (o solo los de bloque) excluyendo el propio
+        inmueble. Si hay menos de k inmuebles la distancia es inf y la posición es len(indice), igual que en scipy.
+        """
+
+        puntos, propios = self._puntos(latitudes, longitudes, bloque)
+
+        if propios is None:
+            distancias, posiciones = self.arbol.query(puntos, k = k, workers = self._workers(workers))
+            return distancias.reshape(-1, k), posiciones.reshape(-1, k)
+
+        # Pedimos uno más y quitamos el propio inmueble. Si hay varios en las mismas coordenadas el propio puede
+        # no salir el primero (o ni salir), en ese caso quitamos la última columna.
+
+        distancias, posiciones = self.arbol.query(puntos, k = k + 1, workers = self._workers(workers))
+        distancias, posiciones = distancias.reshape(-1, k + 1), posiciones.reshape(-1, k + 1)
+
+        mantener = posiciones != propios[:, np.newaxis]
+        mantener[mantener.all(axis = 1), -1] = False
+
+        return distancias[mantener].reshape(-1, k), posiciones[mantener].reshape(-1, k)
+
+
+def crear_variables_competencia(df, radios = (250, 500, 1000), k = 20, radio_precio = 500,
+                                precio = 'precio_total', indice = None, filas = None, tam_bloque = 100_000,
+                                workers = None):
+    """Variables de competencia por inmueble.
+
+    - competidores_<radio>m: número de otros inmuebles a menos de esa distancia
+    - precio_mediano_competencia: mediana del precio de los k competidores más cercanos que estén a menos de
+      radio_precio metros (NaN si no hay ninguno)
+    - dist_competidor_cercano: distancia en metros al competidor más cercano
+
+    La competencia se mide siempre contra todos los inmuebles de df, pero con filas (posiciones en df) se calcula
+    solo para esos inmuebles. Devuelve un DataFrame con el índice de df (o de esas filas).
+
+    workers: hilos de las consultas al KD-tree (por defecto los del índice, y si se crea aquí -1, todos los núcleos).
+    """
+
+    if indice is None:
+        indice = IndiceEspacial.desde_df(df, workers = -1 if workers is None else workers)
+
+    filas = np.arange(len(df)) if filas is None else np.asarray(filas, dtype = 'int64')
+
+    salida = pd.DataFrame(index = df.index[filas])
+
+    for radio in radios:
+        salida[f'competidores_{radio}m'] = indice.contar_en_radio(radio, bloque = filas, workers = workers).astype('int32')
+
+    # La mediana la sacamos de los k vecinos más cercanos. Así la memoria es n x k y no depende de la densidad de la zona.
+    # Vamos por bloques para acotar esa memoria cuando n es muy grande.
+
+    precios = np.append(df[precio].to_numpy(dtype = 'float64'), np.nan)
+    mediana = np.empty(len(filas), dtype = 'float64')
+    cercano = np.empty(len(filas), dtype = 'float64')
+
+    k = max(min(k, len(df) - 1), 1)
+
+    for inicio in range(0, len(filas), tam_bloque):
+        bloque = slice(inicio, inicio + tam_bloque)
+        distancias, posiciones = indice.k_vecinos(k, bloque = filas[bloque], workers = workers)
+
+        precios_vecinos = np.where(distancias <= radio_precio, precios[posiciones], np.nan)
+
+        # np.nanmedian avisa cuando una fila es toda NaN (inmueble sin competidores cerca), que aquí es lo esperado
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category = RuntimeWarning)
+            mediana[bloque] = np.nanmedian(precios_vecinos, axis = 1)
+        cercano[bloque] = distancias[:, 0]
+
+    salida['precio_mediano_competencia'] = mediana
+    salida['dist_competidor_cercano'] = cercano
+
+    return salida
+
@@ -0,0 +1,159 @@
+"""CONSULTAS DE KPIS EN SQLITE (SIN CARGAR LA TABLA)
+
+Cada pregunta del script de insights empieza cargando df_preparado entero en pandas y después agrupa por distrito o
+por barrio. Para una pregunta suelta (la mediana del precio por distrito de los pisos enteros, los 10 barrios con más
+ocupación...) eso es deserializar toda la tabla para quedarnos con veinte filas.
+
+Aquí la pregunta se convierte en una consulta SQL que se resuelve dentro de SQLite y solo vuelve a Python el resultado
+agregado:
+
+- agregaciones: count, mean, min, max, sum y median. La mediana se calcula con funciones de ventana (ROW_NUMBER y COUNT
+  por grupo, y la media de la fila o las dos filas centrales), igual que la mediana de pandas
+- filtros de igualdad o de lista de valores (p.e. room_type = 'Entire home/apt'), con parámetros y no con texto pegado
+- ranking de los N primeros con ORDER BY y LIMIT
+- los índices compuestos (agrupación, room_type, métrica) que persistencia.py crea al guardar df_preparado: con ellos
+  SQLite resuelve las consultas por distrito o barrio de precio_total, ocupacion y precio_compra leyendo solo el índice
+  (covering index), sin tocar las filas de la tabla con sus 40 columnas. Aquí solo se lee: consultar no crea índices
+
+Los nombres de tabla y columnas no pueden ir como parámetros en SQL, así que solo se aceptan los que existen en la
+tabla (PRAGMA table_info) y las agregaciones de AGREGACIONES.
+
+Uso:
+
+    from consultas import consultar
+    consultar(con, 'precio_total', 'distrito')                                          # mediana por distrito
+    consultar(con, 'ocupacion', 'neighbourhood', ['mean', 'median'], top = 10)         # 10 barrios con más ocupación
+    consultar(con, 'precio_total', 'distrito', filtros = {'room_type': 'Entire home/apt'})
+
+Para comparar con cargar la tabla y agrupar en pandas: python consultas.py DatosCaso1/airbnb.db
+"""
+
+import sys
+import time
+
+import pandas as pd
+
+from persistencia import abrir
+
+TABLA = 'df_preparado'
+
+# La mediana del grupo viene repetida en todas sus filas por el cruce con medianas: MAX se queda con ella
+
+AGREGACIONES = {'count': 'COUNT(valor)', 'mean': 'AVG(valor)', 'min': 'MIN(valor)', 'max': 'MAX(valor)',
+                'sum': 'SUM(valor)', 'median': 'MAX(mediana)'}
+
+
+def columnas_tabla(conexion, tabla = TABLA):
+    columnas = [fila[1] for fila in conexion.execute('SELECT * FROM pragma_table_info(?)', (tabla,))]
+    if not columnas:
+        raise ValueError(f'No existe la tabla {tabla}')
+    return columnas
+
+
+def _validar(nombres, permitidos, que):
+    desconocidos = [nombre for nombre in nombres if nombre not in permitidos]
+    if desconocidos:
+        raise ValueError(f'{que} no válidos: {desconocidos}. Disponibles: {sorted(permitidos)}')
+
+
+def sql_consulta(metrica, dimensiones = (), agregaciones = ('median',), filtros = None, top = None,
+                 ascendente = False, tabla = TABLA):
+    """SQL y parámetros de la consulta (los nombres ya validados)."""
+
+    filtros = filtros or {}
+
+    grupos = ', '.join(f'"{dimension}"' for dimension in dimensiones)
+    seleccion = ', '.join([f'"{dimension}"' for dimension in dimensiones] + [f'"{metrica}" AS valor'])
+
+    # Como en groupby de pandas, las filas con la dimensión nula no forman grupo
+
+    condiciones = [f'"{dimension}" IS NOT NULL' for dimension in dimensiones]
+    valores_filtros = []
+    for columna, valor in filtros.items():
+        valores = list(valor) if isinstance(valor, (list, tuple, set)) else [valor]
+        condiciones.append(f'"{columna}" IN ({", ".join("?" * len(valores))})')
+        valores_filtros += valores
+    donde = ' AND '.join(condiciones) or '1 = 1'
+
+    particion = f'PARTITION BY {grupos}' if dimensiones else ''
+    union = f'USING ({grupos})' if dimensiones else 'ON 1 = 1'
+    agrupar = f'GROUP BY {grupos}' if dimensiones else ''
+
+    # Mediana: dentro de cada grupo, la media de las filas (n + 1) / 2 y (n + 2) / 2 en orden (la misma fila si n es
+    # impar). Los nulos de la métrica no cuentan, como en pandas. Las ventanas leen la tabla directamente (no de una
+    # subconsulta materializada) para que SQLite pueda usar los índices compuestos de persistencia.py.
+
+    consulta = f'''
+        WITH medianas AS (
+            SELECT {grupos + ', ' if dimensiones else ''}AVG(valor) AS mediana
+            FROM (
+                SELECT {seleccion},
+                       ROW_NUMBER() OVER ({particion} ORDER BY "{metrica}") AS fila,
+                       COUNT(*) OVER ({particion}) AS n
+                FROM "{tabla}" WHERE {donde} AND "{metrica}" IS NOT NULL
+            )
+            WHERE fila IN ((n + 1) / 2, (n + 2) / 2)
+            {agrupar}
+        )
+        SELECT {', '.join([f'"{dimension}"' for dimension in dimensiones]
+                          + ['COUNT(*) AS inmuebles']
+                          + [f'{AGREGACIONES[agregacion]} AS "{agregacion}"' for agregacion in agregaciones])}
+        FROM (SELECT {seleccion} FROM "{tabla}" WHERE {donde}) LEFT JOIN medianas {union}
+        {agrupar}
+        ORDER BY {f'"{agregaciones[0]}" {"ASC" if ascendente else "DESC"}' if top else grupos or 'inmuebles'}
+        {'LIMIT ?' if top else ''}
+    '''
+
+    parametros = valores_filtros * 2
+    if top:
+        parametros.append(int(top))
+
+    return consulta, parametros
+
+
+def consultar(con, metrica, dimensiones = (), agregaciones = 'median', filtros = None, top = None, ascendente = False,
+              tabla = TABLA):
+    """KPI de una métrica por grupo calculado en SQLite. Devuelve un DataFrame con las dimensiones como índice, el
+    número de inmuebles y una columna por agregación.
+
+    dimensiones: una columna o una lista (p.e. ['distrito', 'neighbourhood']); vacío para el total.
+    filtros: {columna: valor o lista de valores}.
+    top: los N primeros grupos por la primera agregación (descendente salvo ascendente = True).
+    """
+
+    dimensiones = [dimensiones] if isinstance(dimensiones, str) else list(dimensiones)
+    agregaciones = [agregaciones] if isinstance(agregaciones, str) else list(agregaciones)
+    filtros = dict(filtros or {})
+
+    with abrir(con) as conexion:
+        columnas = columnas_tabla(conexion, tabla)
+        _validar([metrica] + dimensiones + list(filtros), columnas, 'Columnas')
+        _validar(agregaciones, AGREGACIONES, 'Agregaciones')
+
+        consulta, parametros = sql_consulta(metrica, dimensiones, agregaciones, filtros, top, ascendente, tabla)
+        resultado = pd.read_sql(consulta, conexion, params = parametros)
+
+    return resultado.set_index(dimensiones) if dimensiones else resultado
+
+
+def _comparar(ruta):
+    # La misma pregunta cargando la tabla y agrupando en pandas, y en SQLite
+
+    inicio = time.perf_counter()
+    with abrir(ruta) as conexion:
+        df = pd.read_sql(f'SELECT * FROM {TABLA}', conexion)
+    pandas = df.loc[df.room_type == 'Entire home/apt'].groupby('distrito').precio_total.agg(['count', 'median', 'mean'])
+    print(f'read_sql + groupby: {time.perf_counter() - inicio:.3f} s')
+
+    inicio = time.perf_counter()
+    sql = consultar(ruta, 'precio_total', 'distrito', ['count', 'median', 'mean'],
+                    filtros = {'room_type': 'Entire home/apt'})
+    print(f'consultar: {time.perf_counter() - inicio:.3f} s')
+
+    diferencia = (sql[['count', 'median', 'mean']] - pandas.loc[sql.index]).abs().max().max()
+    print(f'Diferencia máxima con pandas: {diferencia:.2e}')
+    print(sql)
+
+
+if __name__ == '__main__':
+    _comparar(sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/airbnb.db')
@@ -0,0 +1,229 @@
+"""CUBO OLAP PRECALCULADO (GROUPING SETS Y ROLLUPS)
+
+El minicubo del script de insights pasaba las cuatro dimensiones discretizadas a formato transaccional con melt (cada
+inmueble se convierte en cuatro filas) y después agregaba con un groupby. Si se quería también para la ocupación, o
+por distrito y barrio, había que repetirlo a mano.
+
+Aquí el cubo se define con:
+
+- dimensiones: cada una genera su propio agrupamiento (lo mismo que daba el melt)
+- jerarquias: rollups, p.e. ['distrito', 'neighbourhood'] da el total, por distrito y por distrito y barrio
+- metricas y agregaciones: se calculan todas a la vez para todos los agrupamientos
+
+Cada dimensión se pasa a códigos enteros una sola vez. Para cada agrupamiento los códigos se combinan en una clave
+entera y las agregaciones se hacen con numpy sobre esa clave (bincount para conteos, sumas y medias, y una ordenación
+por clave y valor para mediana, mínimo y máximo). No hay melt ni se copian filas.
+
+El resultado es un diccionario agrupamiento -> tabla agregada, así que minicubo.loc['beds_disc'] es una consulta a un
+diccionario. Se puede guardar en el datamart (tabla cubo_<nombre> y su caché Arrow) y volver a leer sin recalcular.
+
+Uso:
+
+    from cubo import construir_cubo
+    minicubo = construir_cubo(df, ['bedrooms_disc', 'beds_disc'], ['precio_total', 'precio_compra', 'ocupacion'],
+                              jerarquias = [['distrito', 'neighbourhood']])
+    minicubo.loc['beds_disc']
+    minicubo.loc['distrito', 'neighbourhood']
+"""
+
+import numpy as np
+import pandas as pd
+
+from cache_columnar import guardar_cache, leer_tabla
+from persistencia import guardar_tabla
+
+AGREGACIONES = ('count', 'sum', 'mean', 'median', 'min', 'max')
+
+SEPARADOR = '|'
+
+TOTAL = 'total'
+
+
+def nombre_agrupamiento(dimensiones):
+    """Nombre con el que se guarda un agrupamiento: 'beds_disc', 'distrito|neighbourhood' o 'total'."""
+
+    if isinstance(dimensiones, str):
+        return dimensiones
+    return SEPARADOR.join(dimensiones) if len(dimensiones) else TOTAL
+
+
+def rollup(jerarquia):
+    """Agrupamientos de un rollup: (), (d1,), (d1, d2)..."""
+
+    return [tuple(jerarquia[:nivel]) for nivel in range(len(jerarquia) + 1)]
+
+
+class Cubo:
+    """Tablas agregadas por agrupamiento. cubo.loc['beds_disc'] y cubo['beds_disc'] son lo mismo."""
+
+    def __init__(self, tablas, metricas, agregaciones):
+        self.tablas = tablas
+        self.metricas = list(metricas)
+        self.agregaciones = list(agregaciones)
+
+    def __getitem__(self, agrupamiento):
+        return self.tablas[nombre_agrupamiento(agrupamiento)]
+
+    @property
+    def loc(self):
+        return self
+
+    @property
+    def agrupamientos(self):
+        return list(self.tablas)
+
+    def __repr__(self):
+        return f'Cubo({self.agrupamientos}, metricas = {self.metricas}, agregaciones = {self.agregaciones})'
+
+
+def _codigos(serie):
+    # Códigos enteros (-1 para nulos) y valores de cada código, en el orden de las categorías si es categórica
+
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy().astype('int64'), serie.cat.categories
+
+    codigos, valores = pd.factorize(serie, sort = True)
+    return codigos.astype('int64'), valores
+
+
+def _agregar(grupos, valores, orden, n_grupos, agregaciones):
+    # grupos: código de grupo (0..n_grupos-1, -1 si la fila no entra) de cada fila. orden: posiciones de las filas
+    # ordenadas por valor de la métrica, calculado una vez por métrica. Los nulos de la métrica no cuentan, como en pandas
+
+    grupos, valores = grupos[orden], valores[orden]
+    validos = (grupos >= 0) & ~np.isnan(valores)
+    grupos, valores = grupos[validos], valores[validos]
+
+    conteo = np.bincount(grupos, minlength = n_grupos)
+    vacios = conteo == 0
+    resultado = {'count': conteo}
+
+    if {'sum', 'mean'} & set(agregaciones):
+        suma = np.bincount(grupos, weights = valores, minlength = n_grupos)
+        resultado['sum'] = suma
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            resultado['mean'] = np.where(vacios, np.nan, suma / conteo)
+
+    if {'median', 'min', 'max'} & set(agregaciones):
+        # Los valores ya vienen ordenados: una ordenación estable por grupo (enteros) los deja ordenados dentro de cada grupo
+
+        # (con menos de 32768 grupos pasamos a int16, para el que numpy usa radix sort)
+
+        claves = grupos.astype('int16') if n_grupos < 2 ** 15 else grupos
+        ordenados = np.append(valores[np.argsort(claves, kind = 'stable')], np.nan)
+        inicio = np.cumsum(conteo) - conteo
+
+        def posicion(indices):
+            return np.where(vacios, np.nan, ordenados[np.where(vacios, -1, indices)])
+
+        resultado['min'] = posicion(inicio)
+        resultado['max'] = posicion(inicio + conteo - 1)
+        resultado['median'] = (posicion(inicio + (conteo - 1) // 2) + posicion(inicio + conteo // 2)) / 2
+
+    return {agregacion: resultado[agregacion] for agregacion in agregaciones}
+
+
+def construir_cubo(df, dimensiones = (), metricas = ('precio_total',), agregaciones = ('median',), jerarquias = (),
+                   agrupamientos = None):
+    """Calcula las agregaciones de las métricas para todos los agrupamientos.
+
+    Por defecto los agrupamientos son cada dimensión por separado más los rollups de cada jerarquía. Con agrupamientos
+    (lista de tuplas de dimensiones) se eligen a mano, p.e. [('distrito', 'beds_disc')].
+
+    Si hay una sola agregación las columnas de cada tabla son las métricas; si hay varias, metrica_agregacion.
+    """
+
+    agregaciones = [agregaciones] if isinstance(agregaciones, str) else list(agregaciones)
+    desconocidas = set(agregaciones) - set(AGREGACIONES)
+    if desconocidas:
+        raise ValueError(f'Agregaciones no soportadas: {sorted(desconocidas)}. Disponibles: {AGREGACIONES}')
+
+    if agrupamientos is None:
+        agrupamientos = [(dimension,) for dimension in dimensiones]
+        for jerarquia in jerarquias:
+            agrupamientos += [agrupamiento for agrupamiento in rollup(jerarquia) if agrupamiento not in agrupamientos]
+
+    agrupamientos = [(agrupamiento,) if isinstance(agrupamiento, str) else tuple(agrupamiento)
+                     for agrupamiento in agrupamientos]
+
+    # Cada dimensión y métrica se convierte una sola vez
+
+    codigos = {dimension: _codigos(df[dimension]) for dimension in {d for a in agrupamientos for d in a}}
+    valores = {metrica: df[metrica].to_numpy(dtype = 'float64', na_value = np.nan) for metrica in metricas}
+    ordenes = {metrica: np.argsort(valores[metrica]) for metrica in metricas}
+
+    tablas = {}
+
+    for agrupamiento in agrupamientos:
+        if agrupamiento:
+            matriz = np.stack([codigos[dimension][0] for dimension in agrupamiento])
+            completas = (matriz >= 0).all(axis = 0)
+            tamanos = [len(codigos[dimension][1]) for dimension in agrupamiento]
+            clave = np.ravel_multi_index(matriz[:, completas], tamanos)
+
+            # Solo los grupos que existen en los datos, ordenados por código (el orden de las categorías)
+
+            claves, inversa = np.unique(clave, return_inverse = True)
+            grupos = np.full(len(df), -1, dtype = 'int64')
+            grupos[completas] = inversa
+            posiciones = np.unravel_index(claves, tamanos)
+
+            niveles = [codigos[dimension][1][posicion] for dimension, posicion in zip(agrupamiento, posiciones)]
+            indice = pd.Index(niveles[0], name = agrupamiento[0]) if len(agrupamiento) == 1 \
+                else pd.MultiIndex.from_arrays(niveles, names = agrupamiento)
+        else:
+            claves, grupos = np.zeros(1, dtype = 'int64'), np.zeros(len(df), dtype = 'int64')
+            indice = pd.Index([TOTAL], name = TOTAL)
+
+        columnas = {}
+        for metrica in metricas:
+            agregados = _agregar(grupos, valores[metrica], ordenes[metrica], len(claves), agregaciones)
+            for agregacion, resultado in agregados.items():
+                columnas[metrica if len(agregaciones) == 1 else f'{metrica}_{agregacion}'] = resultado
+
+        tablas[nombre_agrupamiento(agrupamiento)] = pd.DataFrame(columnas, index = indice)
+
+    return Cubo(tablas, metricas, agregaciones)
+
+
+# PERSISTENCIA
+
+def guardar_cubo(cubo, nombre, con):
+    """Guarda el cubo en la tabla cubo_<nombre> (y su caché Arrow): una fila por grupo con su agrupamiento, el valor de
+    cada dimensión (nulo si no forma parte del agrupamiento) y las métricas."""
+
+    partes = []
+    for agrupamiento, tabla in cubo.tablas.items():
+        parte = tabla.reset_index()
+        if agrupamiento == TOTAL:
+            parte = parte.drop(columns = TOTAL)
+        parte.insert(0, 'agrupamiento', agrupamiento)
+        partes.append(parte)
+
+    largo = pd.concat(partes, ignore_index = True)
+    tabla = 'cubo_' + nombre
+
+    guardar_tabla(largo, tabla, con, indices = ['agrupamiento'])
+    guardar_cache(largo, tabla, con)
+
+    return largo
+
+
+def leer_cubo(nombre, con):
+    """Lee un cubo guardado con guardar_cubo. Las dimensiones salen de los nombres de los agrupamientos y el resto de
+    columnas son las métricas."""
+
+    largo = leer_tabla('cubo_' + nombre, con)
+
+    agrupamientos = list(dict.fromkeys(largo.agrupamiento))
+    dimensiones = {d for agrupamiento in agrupamientos if agrupamiento != TOTAL for d in agrupamiento.split(SEPARADOR)}
+    metricas = [columna for columna in largo.columns if columna not in dimensiones and columna != 'agrupamiento']
+
+    tablas = {}
+    for agrupamiento, parte in largo.groupby('agrupamiento', sort = False):
+        if agrupamiento == TOTAL:
+            tablas[agrupamiento] = parte[metricas].set_axis(pd.Index([TOTAL], name = TOTAL))
+        else:
+            tablas[agrupamiento] = parte.set_index(agrupamiento.split(SEPARADOR))[metricas]
+
+    return Cubo(tablas, metricas, agregaciones = [])
@@ -0,0 +1,166 @@
+"""DISTANCIAS A PUNTOS DE INTERÉS
+
+En el script de variables calculábamos la distancia de cada inmueble a la Puerta del Sol con un apply fila a fila
+sobre la función haversine escrita con el módulo math. Funciona, pero es el paso más lento de la preparación de
+variables y solo nos da una distancia. En una situación real querremos muchas de este tipo.
+
+Aquí tenemos la misma fórmula de Haversine pero vectorizada con NumPy, y un catálogo de puntos de interés (PdI) para
+calcular de una sola pasada (inmuebles x PdIs) una columna de distancia por cada punto, además del PdI más cercano
+y su distancia.
+
+Uso:
+
+    from distancias import distancias_pdi
+    df = df.join(distancias_pdi(df))
+
+Para comparar con la versión apply: python distancias.py
+"""
+
+import time
+from math import radians, cos, sin, asin, sqrt
+
+import numpy as np
+import pandas as pd
+
+# Radio de la tierra en km, el mismo que usábamos en el script de variables
+
+R = 6372.8
+
+# Catálogo de puntos de interés (latitud, longitud). La clave se usa para nombrar la columna: pdi_<clave>
+
+PUNTOS_INTERES = {
+    'sol': (40.4167278, -3.7033387),
+    'prado': (40.4137818, -3.6921270),
+    'bernabeu': (40.4530541, -3.6883445),
+    'atocha': (40.4065990, -3.6899340),
+    'ifema': (40.4634400, -3.6160060),
+    'metropolitano': (40.4361910, -3.5994910),
+    'palacio_real': (40.4179530, -3.7143120),
+    'gran_via': (40.4200650, -3.7055770),
+}
+
+
+def haversine_vectorizada(lat1, lon1, lat2, lon2):
+    """Distancia de Haversine en km entre arrays (o escalares) de coordenadas en grados. Admite broadcasting."""
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+
+    return 2 * R * np.arcsin(np.sqrt(a))
+
+
+def matriz_distancias(latitudes, longitudes, puntos = PUNTOS_INTERES, tam_bloque = 50_000):
+    """Matriz (inmuebles x PdIs) de distancias en km.
+
+    Se procesa por bloques de inmuebles para que la memoria intermedia quede acotada por tam_bloque x num_pdis.
+    """
+
+    latitudes = np.asarray(latitudes, dtype = 'float64')
+    longitudes = np.asarray(longitudes, dtype = 'float64')
+
+    pdi = np.array(list(puntos.values()), dtype = 'float64')
+    lat_pdi = np.radians(pdi[:, 0])[np.newaxis, :]
+    lon_pdi = np.radians(pdi[:, 1])[np.newaxis, :]
+    cos_lat_pdi = np.cos(lat_pdi)
+
+    salida = np.empty((latitudes.shape[0], pdi.shape[0]), dtype = 'float64')
+
+    # Precalculamos lo que depende solo de los PdIs y en cada bloque solo lo que depende de los inmuebles
+
+    for inicio in range(0, latitudes.shape[0], tam_bloque):
+        fin = inicio + tam_bloque
+        lat = np.radians(latitudes[inicio:fin])[:, np.newaxis]
+        lon = np.radians(longitudes[inicio:fin])[:, np.newaxis]
+
+        a = np.sin((lat_pdi - lat) / 2) ** 2 + np.cos(lat) * cos_lat_pdi * np.sin((lon_pdi - lon) / 2) ** 2
+        salida[inicio:fin] = 2 * R * np.arcsin(np.sqrt(a))
+
+    return salida
+
+
+def distancias_pdi(df, puntos = PUNTOS_INTERES, tam_bloque = 50_000, lat = 'latitude', lon = 'longitude'):
+    """Devuelve un DataFrame con el mismo índice que df y las columnas pdi_<clave>, pdi_cercano y pdi_cercano_dist."""
+
+    distancias = matriz_distancias(df[lat].to_numpy(), df[lon].to_numpy(), puntos, tam_bloque)
+
+    salida = pd.DataFrame(distancias, index = df.index, columns = ['pdi_' + clave for clave in puntos])
+
+    cercano = distancias.argmin(axis = 1)
+    salida['pdi_cercano'] = pd.Categorical.from_codes(cercano, categories = list(puntos))
+    salida['pdi_cercano_dist'] = distancias[np.arange(distancias.shape[0]), cercano]
+
+    return salida
+
+
+def proyectar_metros(latitudes, longitudes, origen = None):
+    """Proyección equirectangular local a metros (x hacia el este, y hacia el norte).
+
+    A la escala de una ciudad el error frente a la distancia de Haversine es despreciable, y en coordenadas
+    planas ya podemos usar índices espaciales euclídeos (KD-tree). Por defecto el origen es el centroide de los puntos.
+    """
+
+    latitudes = np.asarray(latitudes, dtype = 'float64')
+    longitudes = np.asarray(longitudes, dtype = 'float64')
+
+    if origen is None:
+        origen = (latitudes.mean(), longitudes.mean())
+
+    lat0, lon0 = np.radians(origen[0]), np.radians(origen[1])
+
+    x = R * 1000 * (np.radians(longitudes) - lon0) * np.cos(lat0)
+    y = R * 1000 * (np.radians(latitudes) - lat0)
+
+    return np.column_stack([x, y])
+
+
+# BENCHMARK CONTRA LA VERSIÓN APPLY
+
+# Es la función tal cual estaba en el script de variables
+
+def haversine(lat1, lon1, lat2, lon2):
+
+      dLat = radians(lat2 - lat1)
+      dLon = radians(lon2 - lon1)
+      lat1 = radians(lat1)
+      lat2 = radians(lat2)
+
+      a = sin(dLat/2)**2 + cos(lat1)*cos(lat2)*sin(dLon/2)**2
+      c = 2*asin(sqrt(a))
+
+      return R * c
+
+
+def benchmark(num_inmuebles = 20_000, semilla = 0):
+    """Compara el apply fila a fila (solo Sol) con la versión vectorizada (todo el catálogo)."""
+
+    rng = np.random.default_rng(semilla)
+    df = pd.DataFrame({'latitude': rng.uniform(40.33, 40.56, num_inmuebles),
+                       'longitude': rng.uniform(-3.84, -3.52, num_inmuebles)})
+
+    lat1, lon1 = PUNTOS_INTERES['sol']
+
+    inicio = time.perf_counter()
+    con_apply = df.apply(lambda registro: haversine(lat1,lon1,registro.latitude,registro.longitude),axis = 1)
+    t_apply = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    vectorizada = distancias_pdi(df)
+    t_vectorizada = time.perf_counter() - inicio
+
+    # Comprobamos que ambas versiones dan lo mismo
+
+    error = np.abs(con_apply.to_numpy() - vectorizada.pdi_sol.to_numpy()).max()
+
+    print(f'Inmuebles: {num_inmuebles}')
+    print(f'apply (1 PdI): {t_apply:.3f} s')
+    print(f'vectorizada ({len(PUNTOS_INTERES)} PdIs): {t_vectorizada:.3f} s')
+    print(f'Aceleración por PdI: {t_apply * len(PUNTOS_INTERES) / t_vectorizada:.0f}x')
+    print(f'Diferencia máxima: {error:.2e} km')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,589 @@
+"""ETAPAS DEL DATAMART CON CACHÉ POR CONTENIDO
+
+El script de insights necesita que los de datos y variables hayan dejado df y df_preparado en SQLite, pero nada dice si
+esas tablas están al día: si cambia una descarga, el precio mínimo de 19 euros, la exclusión de los hoteles o la tabla
+de m2 por habitaciones, hay que acordarse de volver a ejecutar los scripts, y se ejecutan enteros.
+
+Aquí los pasos de los scripts son etapas registradas con:
+
+- las entradas que necesitan (ficheros de la descarga o salidas de otras etapas)
+- las salidas que producen
+- los parámetros de negocio que usan
+- los módulos de los que depende su código (con los módulos del repositorio que estos importan, directa o
+  indirectamente: la etapa de competencia declara competencia.py, y competencia.py importa distancias.py)
+
+Cada etapa tiene una clave: el hash de su código, del valor de sus parámetros y de las claves de sus entradas (el
+contenido de los ficheros, o la clave de la etapa que produjo la salida). Las salidas se guardan en la caché bajo esa
+clave (<carpeta>/etapas_cache/<etapa>/<clave>/, DataFrames en Arrow y el resto en JSON), así que:
+
+- si no ha cambiado nada, no se ejecuta nada
+- si cambia un parámetro solo se ejecutan las etapas que lo usan y las que van detrás. Con precio_minimo = 25 se
+  repiten la limpieza de listings, el cruce y lo que sigue, pero no la lectura de los CSV ni la limpieza de listings_det
+- las salidas de las etapas que no se ejecutan solo se leen de la caché si alguna etapa posterior las necesita
+
+Las claves se calculan antes de ejecutar nada. Las tablas del datamart (df, df_preparado, textos, kpis, rejilla,
+histogramas_ocupacion) se publican en SQLite con la clave con la que se hicieron (tabla _etapas), y estado() dice
+cuáles están desactualizadas. Una ejecución con parámetros distintos de los de por defecto es una prueba (¿y si el
+precio mínimo fuera 25?): sus salidas quedan en la caché pero no sustituyen a las tablas del datamart, salvo que se
+pida con publicar = True (--publicar).
+
+Los scripts de datos y variables recorren los mismos pasos con sus análisis y publican sus propias tablas con
+GRAFO.publicar, con la clave de la etapa que las produce (y dejándolas en su caché), así que después de ejecutarlos las
+tablas están al día sin rehacer nada, y el de insights avisa si alguna no lo está. incremental.py, que reescribe
+solo las filas cambiadas, apunta con GRAFO.sellar las tablas que deja al día para los ficheros actuales: solo se
+marcan como desactualizadas si cambian los ficheros, los parámetros o el código sin volver a pasar por él.
+
+Uso:
+
+    python etapas.py                                    # todo, sobre DatosCaso1
+    python etapas.py df_preparado --carpeta datos/madrid/2024-03
+    python etapas.py --parametro precio_minimo=25       # solo se repite lo que depende del precio mínimo (sin publicar)
+    python etapas.py --parametro precio_minimo=25 --publicar
+    python etapas.py --estado                           # qué etapas están en caché y qué tablas están al día
+
+    from etapas import GRAFO
+    df_preparado = GRAFO.ejecutar('df_preparado', 'DatosCaso1', {'factor_compra': 0.75})['df_preparado']
+"""
+
+import argparse
+import ast
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+from cache_columnar import escribir_arrow, guardar_cache, leer_arrow
+from compactacion import TABLA_TEXTOS, TEXTOS, compactar
+from competencia import crear_variables_competencia
+from histogramas import TABLA as TABLA_HISTOGRAMAS, construir_histogramas
+from ingesta import leer_listings_det
+from instrumentacion import tramo
+from kpis import calcular_kpis
+from limpieza import (MAPA_DISTRITOS, PRECIO_MINIMO, TIPOS_EXCLUIDOS, construir_df, leer_listings, leer_precio_m2,
+                      limpiar_listings, limpiar_listings_det, preparar_precio_m2)
+from motor_variables import PARAMETROS as PARAMETROS_MOTOR
+from persistencia import abrir, guardar_tabla, ruta_db, version_tabla
+from rejilla import construir_rejilla
+from variables_derivadas import crear_variables
+
+CARPETA_DATOS = 'DatosCaso1'
+
+CARPETA_CACHE = 'etapas_cache'
+
+CARPETA_MODULOS = os.path.dirname(os.path.abspath(__file__))
+
+# Claves que se guardan de cada etapa (para poder volver a un valor anterior de un parámetro sin recalcular)
+
+VERSIONES = 3
+
+TABLA_ETAPAS = '_etapas'
+
+INDICES = {'kpis': ['nivel'], 'rejilla': ['nivel'], TABLA_HISTOGRAMAS: ['dimension']}
+
+# Ficheros de la descarga que pueden ser entradas de una etapa
+
+FICHEROS = {'listings.csv': 'listings.csv',
+            'listings.csv.gz': 'listings.csv.gz',
+            'precios_idealista.csv': 'precios_idealista.csv'}
+
+PARAMETROS = {
+    'tipos_excluidos': TIPOS_EXCLUIDOS,
+    'precio_minimo': PRECIO_MINIMO,
+    'mapa_distritos': MAPA_DISTRITOS,
+    'radios_competencia': (250, 500, 1000),
+    **{parametro: valor for parametro, valor in PARAMETROS_MOTOR.items() if parametro != 'cortes_disc'},
+}
+
+PARAMETROS_VARIABLES = [parametro for parametro in PARAMETROS_MOTOR if parametro != 'cortes_disc']
+
+
+def _hash(*partes):
+    return hashlib.sha256(json.dumps(partes, sort_keys = True, default = repr).encode()).hexdigest()
+
+
+def hash_fichero(ruta, tam_bloque = 2 ** 20):
+    """sha256 del contenido del fichero."""
+
+    resumen = hashlib.sha256()
+    with open(ruta, 'rb') as fichero:
+        for bloque in iter(lambda: fichero.read(tam_bloque), b''):
+            resumen.update(bloque)
+
+    return resumen.hexdigest()
+
+
+def modulos_locales(modulos, carpeta = CARPETA_MODULOS):
+    """Código de los módulos y, recursivamente, de los módulos de carpeta (el repositorio) que importan, por nombre."""
+
+    fuentes = {}
+    pendientes = list(modulos)
+    while pendientes:
+        modulo = pendientes.pop()
+        ruta = os.path.join(carpeta, modulo + '.py')
+        if modulo in fuentes or not os.path.exists(ruta):
+            continue
+
+        with open(ruta, encoding = 'utf-8') as fichero:
+            fuentes[modulo] = fichero.read()
+
+        for nodo in ast.walk(ast.parse(fuentes[modulo])):
+            if isinstance(nodo, ast.Import):
+                pendientes.extend(alias.name.split('.')[0] for alias in nodo.names)
+            elif isinstance(nodo, ast.ImportFrom) and nodo.level == 0 and nodo.module:
+                pendientes.append(nodo.module.split('.')[0])
+
+    return dict(sorted(fuentes.items()))
+
+
+class Etapa:
+
+    def __init__(self, nombre, entradas, salidas, parametros, modulos, tablas, funcion):
+        self.nombre = nombre
+        self.entradas = entradas
+        self.salidas = salidas
+        self.parametros = parametros
+        self.modulos = modulos
+        self.tablas = tablas
+        self.funcion = funcion
+
+    def codigo(self):
+        """Hash del código de la función de la etapa y de los módulos de los que depende (con los que estos importan)."""
+
+        return _hash(inspect.getsource(self.funcion), modulos_locales(self.modulos))
+
+
+class GrafoEtapas:
+    """Registro de etapas con sus dependencias, claves por contenido y ejecución con caché."""
+
+    def __init__(self, parametros = None, ficheros = None):
+        self.parametros = dict(parametros or {})
+        self.ficheros = dict(ficheros or {})
+        self.etapas = {}
+        self.productoras = {}
+
+    def registrar(self, nombre, entradas, salidas, parametros = (), modulos = (), tablas = None):
+        """Decorador: registra una función f(entradas, parametros) que devuelve la salida (o una tupla si hay varias).
+
+        entradas es un diccionario nombre -> valor con las salidas de otras etapas (o la ruta, si es un fichero).
+        tablas: salida -> tabla de SQLite en la que se publica.
+        """
+
+        salidas = [salidas] if isinstance(salidas, str) else list(salidas)
+
+        def decorador(funcion):
+            etapa = Etapa(nombre, list(entradas), salidas, list(parametros), list(modulos), dict(tablas or {}), funcion)
+            for salida in salidas:
+                if salida in self.productoras:
+                    raise ValueError(f'La salida {salida} ya la produce la etapa {self.productoras[salida].nombre}')
+                self.productoras[salida] = etapa
+            self.etapas[nombre] = etapa
+            return funcion
+
+        return decorador
+
+    def orden(self, objetivos = None):
+        """Etapas necesarias para obtener los objetivos (salidas o nombres de etapa), en orden de dependencias."""
+
+        objetivos = list(self.etapas) if objetivos is None else [objetivos] if isinstance(objetivos, str) else objetivos
+        orden, visitando = [], set()
+
+        def visitar(nombre):
+            if nombre in self.ficheros:
+                return
+            etapa = self.etapas.get(nombre) or self.productoras.get(nombre)
+            if etapa is None:
+                raise KeyError(f'{nombre} no es una etapa, una salida de una etapa ni un fichero')
+            if etapa in orden:
+                return
+            if etapa.nombre in visitando:
+                raise ValueError(f'Dependencia circular en {etapa.nombre}')
+
+            visitando.add(etapa.nombre)
+            for entrada in etapa.entradas:
+                visitar(entrada)
+            visitando.discard(etapa.nombre)
+
+            orden.append(etapa)
+
+        for objetivo in objetivos:
+            visitar(objetivo)
+
+        return orden
+
+    def claves(self, etapas, carpeta, parametros):
+        """Clave de cada etapa y de cada entrada, sin ejecutar nada."""
+
+        claves = {}
+        for etapa in etapas:
+            entradas = {}
+            for entrada in etapa.entradas:
+                if entrada not in claves:
+                    claves[entrada] = hash_fichero(os.path.join(carpeta, self.ficheros[entrada]))
+                entradas[entrada] = claves[entrada]
+
+            clave = _hash(etapa.nombre, etapa.codigo(), {p: parametros[p] for p in etapa.parametros}, entradas)
+            claves[etapa.nombre] = clave
+            for salida in etapa.salidas:
+                claves[salida] = _hash(clave, salida)
+
+        return claves
+
+    # CACHÉ
+
+    @staticmethod
+    def _carpeta_cache(carpeta, etapa, clave):
+        return os.path.join(carpeta, CARPETA_CACHE, etapa.nombre, clave[:24])
+
+    def en_cache(self, carpeta, etapa, clave):
+        return os.path.exists(os.path.join(self._carpeta_cache(carpeta, etapa, clave), 'etapa.json'))
+
+    def _usar(self, carpeta, etapa, clave):
+        # Al usar una entrada de la caché la marcamos como reciente, para que no se borre al guardar otras versiones
+
+        os.utime(self._carpeta_cache(carpeta, etapa, clave))
+
+    def _guardar(self, carpeta, etapa, clave, valores, segundos):
+        destino = self._carpeta_cache(carpeta, etapa, clave)
+        temporal = destino + '.tmp'
+        shutil.rmtree(temporal, ignore_errors = True)
+        os.makedirs(temporal)
+
+        formatos = {}
+        for salida, valor in valores.items():
+            if isinstance(valor, pd.DataFrame):
+                escribir_arrow(valor, os.path.join(temporal, salida + '.arrow'), indice = None)
+                formatos[salida] = 'arrow'
+            else:
+                with open(os.path.join(temporal, salida + '.json'), 'w', encoding = 'utf-8') as fichero:
+                    json.dump(valor, fichero, ensure_ascii = False)
+                formatos[salida] = 'json'
+
+        # etapa.json se escribe el último: si está, la entrada de la caché está completa
+
+        with open(os.path.join(temporal, 'etapa.json'), 'w', encoding = 'utf-8') as fichero:
+            json.dump({'etapa': etapa.nombre, 'clave': clave, 'formatos': formatos, 'segundos': round(segundos, 3),
+                       'fecha': time.strftime('%Y-%m-%dT%H:%M:%S')}, fichero, indent = 2)
+
+        shutil.rmtree(destino, ignore_errors = True)
+        os.replace(temporal, destino)
+
+        # Nos quedamos con las VERSIONES claves más recientes de la etapa
+
+        anteriores = sorted((os.path.join(os.path.dirname(destino), nombre) for nombre in os.listdir(os.path.dirname(destino))),
+                            key = os.path.getmtime, reverse = True)
+        for ruta in anteriores[VERSIONES:]:
+            shutil.rmtree(ruta, ignore_errors = True)
+
+    def _leer(self, carpeta, etapa, clave, salida):
+        origen = self._carpeta_cache(carpeta, etapa, clave)
+        with open(os.path.join(origen, 'etapa.json'), encoding = 'utf-8') as fichero:
+            formato = json.load(fichero)['formatos'][salida]
+
+        if formato == 'arrow':
+            return leer_arrow(os.path.join(origen, salida + '.arrow')).to_pandas()
+
+        with open(os.path.join(origen, salida + '.json'), encoding = 'utf-8') as fichero:
+            return json.load(fichero)
+
+    # EJECUCIÓN
+
+    def ejecutar(self, objetivos = None, carpeta = CARPETA_DATOS, parametros = None, forzar = (), publicar = None,
+                 con = None):
+        """Ejecuta (o saca de la caché) las etapas necesarias para los objetivos y devuelve sus salidas.
+
+        parametros sustituyen a los de por defecto en esta ejecución. forzar: etapas que se ejecutan aunque estén en
+        caché. Con publicar, las tablas de las etapas se escriben en SQLite (con, por defecto <carpeta>/airbnb.db) si
+        la publicada no tiene la misma clave. Por defecto solo se publica si ningún parámetro cambia de valor.
+        """
+
+        objetivos = list(self.etapas) if objetivos is None else [objetivos] if isinstance(objetivos, str) else objetivos
+        cambiados = sorted(p for p, v in (parametros or {}).items() if _hash(v) != _hash(self.parametros.get(p)))
+        publicar = not cambiados if publicar is None else publicar
+        parametros = {**self.parametros, **(parametros or {})}
+        con = con or os.path.join(carpeta, 'airbnb.db')
+
+        etapas = self.orden(objetivos)
+        claves = self.claves(etapas, carpeta, parametros)
+        valores = {}
+
+        # Hacen falta las etapas de los objetivos, las forzadas y las de las tablas por publicar y, de las que no están
+        # en caché, las que producen sus entradas: si una etapa está en caché no se rehace nada de lo anterior
+
+        en_cache = {etapa.nombre: etapa.nombre not in forzar and self.en_cache(carpeta, etapa, claves[etapa.nombre])
+                    for etapa in etapas}
+        necesarias = {(self.etapas.get(objetivo) or self.productoras[objetivo]).nombre for objetivo in objetivos
+                      if objetivo not in self.ficheros} | set(forzar)
+        if publicar:
+            necesarias |= {etapa.nombre for etapa in etapas
+                           if any(clave_publicada(con, tabla) != claves[salida] for salida, tabla in etapa.tablas.items())}
+        for etapa in reversed(etapas):
+            if etapa.nombre in necesarias and not en_cache[etapa.nombre]:
+                necesarias |= {self.productoras[entrada].nombre for entrada in etapa.entradas if entrada not in self.ficheros}
+
+        def valor(nombre):
+            if nombre in self.ficheros:
+                return os.path.join(carpeta, self.ficheros[nombre])
+            if nombre not in valores:
+                productora = self.productoras[nombre]
+                valores[nombre] = self._leer(carpeta, productora, claves[productora.nombre], nombre)
+            return valores[nombre]
+
+        for etapa in etapas:
+            clave = claves[etapa.nombre]
+            if etapa.nombre not in necesarias:
+                continue
+            if en_cache[etapa.nombre]:
+                self._usar(carpeta, etapa, clave)
+                print(f'{etapa.nombre}: en caché ({clave[:12]})')
+                continue
+
+            entradas = {entrada: valor(entrada) for entrada in etapa.entradas}
+
+            inicio = time.perf_counter()
+            with tramo(etapa.nombre):
+                resultado = etapa.funcion(entradas, {p: parametros[p] for p in etapa.parametros})
+            segundos = time.perf_counter() - inicio
+
+            resultado = dict(zip(etapa.salidas, resultado if len(etapa.salidas) > 1 else [resultado]))
+            self._guardar(carpeta, etapa, clave, resultado, segundos)
+            valores.update(resultado)
+
+            print(f'{etapa.nombre}: ejecutada en {segundos:.2f} s ({clave[:12]})')
+
+        if publicar:
+            for etapa in (etapa for etapa in etapas if etapa.nombre in necesarias):
+                for salida, tabla in etapa.tablas.items():
+                    if clave_publicada(con, tabla) != claves[salida]:
+                        publicar_tabla(valor(salida), tabla, con, claves[salida], etapa.nombre)
+                        print(f'{tabla}: publicada en {ruta_db(con)}')
+        elif cambiados:
+            print(f'Tablas sin publicar (parámetros cambiados: {", ".join(cambiados)}). Para publicarlas: publicar = True')
+
+        return {objetivo: valor(objetivo) for objetivo in objetivos if objetivo not in self.etapas}
+
+    def publicar(self, valores, carpeta = CARPETA_DATOS, con = None):
+        """Publica salidas calculadas fuera del grafo con la clave que tienen con los ficheros, parámetros y código actuales.
+
+        Es lo que usan los scripts de datos y variables, que recorren los mismos pasos que las etapas con sus análisis
+        entre medias: publican su propio df o df_preparado en vez de rehacerlo. valores: salida -> valor. Si están
+        todas las salidas de una etapa se guardan también en su caché, y las etapas siguientes parten de ellas.
+        """
+
+        con = con or os.path.join(carpeta, 'airbnb.db')
+        etapas = self.orden(list(valores))
+        claves = self.claves(etapas, carpeta, self.parametros)
+
+        for etapa in etapas:
+            salidas = {salida: valores[salida] for salida in etapa.salidas if salida in valores}
+            if len(salidas) == len(etapa.salidas) and not self.en_cache(carpeta, etapa, claves[etapa.nombre]):
+                self._guardar(carpeta, etapa, claves[etapa.nombre], salidas, 0)
+
+            for salida, tabla in etapa.tablas.items():
+                if salida in salidas:
+                    publicar_tabla(salidas[salida], tabla, con, claves[salida], etapa.nombre)
+                    print(f'{tabla}: publicada en {ruta_db(con)}')
+
+    def sellar(self, tablas, carpeta = CARPETA_DATOS, con = None, origen = 'incremental.py'):
+        """Apunta tablas reescritas por otro camino que deja lo mismo que las etapas (incremental.py) como al día con
+        los ficheros, parámetros y código actuales: la clave de su etapa con la versión que tienen ahora."""
+
+        con = con or os.path.join(carpeta, 'airbnb.db')
+        etapas = self.orden()
+        claves = self.claves(etapas, carpeta, self.parametros)
+        salidas = {tabla: salida for etapa in etapas for salida, tabla in etapa.tablas.items()}
+
+        for tabla in tablas:
+            apuntar_tabla(tabla, con, claves[salidas[tabla]], origen)
+
+    def estado(self, carpeta = CARPETA_DATOS, parametros = None, con = None):
+        """Para cada etapa, si está en caché, y para cada tabla, si la publicada en SQLite está al día."""
+
+        parametros = {**self.parametros, **(parametros or {})}
+        con = con or os.path.join(carpeta, 'airbnb.db')
+
+        etapas = self.orden()
+        claves = self.claves(etapas, carpeta, parametros)
+
+        return pd.DataFrame([{'etapa': etapa.nombre, 'clave': claves[etapa.nombre][:12],
+                              'en_cache': self.en_cache(carpeta, etapa, claves[etapa.nombre]),
+                              'tablas': ', '.join(etapa.tablas.values()),
+                              'desactualizadas': ', '.join(tabla for salida, tabla in etapa.tablas.items()
+                                                           if clave_publicada(con, tabla) != claves[salida])}
+                             for etapa in etapas])
+
+    def desactualizadas(self, carpeta = CARPETA_DATOS, parametros = None, con = None):
+        """Tablas publicadas en SQLite que no corresponden a los ficheros, parámetros y código actuales."""
+
+        estado = self.estado(carpeta, parametros, con)
+        return [tabla for tablas in estado.desactualizadas for tabla in tablas.split(', ') if tabla]
+
+
+# PUBLICACIÓN EN SQLITE
+
+def clave_publicada(con, tabla):
+    """Clave con la que se publicó la tabla, o None si no se ha publicado o se ha reescrito después por otro camino."""
+
+    if not os.path.exists(ruta_db(con)):
+        return None
+
+    with abrir(con) as conexion:
+        try:
+            fila = conexion.execute(f'SELECT clave, version FROM {TABLA_ETAPAS} WHERE tabla = ?', (tabla,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+    # Si la tabla se ha reescrito después por otro camino sin volver a apuntarla (pipeline.py, un guardado a mano), su
+    # versión ya no es la publicada
+
+    if fila is None or fila[1] != version_tabla(con, tabla):
+        return None
+
+    return fila[0]
+
+
+def publicar_tabla(df, tabla, con, clave, etapa):
+    guardar_tabla(df, tabla, con, indices = INDICES.get(tabla))
+    if tabla != TABLA_TEXTOS:
+        guardar_cache(df, tabla, con)
+
+    apuntar_tabla(tabla, con, clave, etapa)
+
+
+def apuntar_tabla(tabla, con, clave, etapa):
+    """Guarda en _etapas la clave y la versión actual de la tabla, y qué la ha escrito (etapa o script)."""
+
+    with abrir(con) as conexion:
+        conexion.execute(f'CREATE TABLE IF NOT EXISTS {TABLA_ETAPAS} '
+                         '(tabla TEXT PRIMARY KEY, clave TEXT, version TEXT, etapa TEXT, fecha TEXT)')
+        conexion.execute(f'INSERT OR REPLACE INTO {TABLA_ETAPAS} VALUES (?, ?, ?, ?, ?)',
+                         (tabla, clave, version_tabla(con, tabla), etapa, time.strftime('%Y-%m-%dT%H:%M:%S')))
+
+
+# ETAPAS DE LOS SCRIPTS DE DATOS Y VARIABLES
+
+GRAFO = GrafoEtapas(PARAMETROS, FICHEROS)
+
+
+@GRAFO.registrar('carga_listings', ['listings.csv'], 'listings', modulos = ['limpieza'])
+def _carga_listings(e, p):
+    return leer_listings(e['listings.csv'])
+
+
+@GRAFO.registrar('carga_listings_det', ['listings.csv.gz'], 'listings_det', modulos = ['ingesta'])
+def _carga_listings_det(e, p):
+    return leer_listings_det(e['listings.csv.gz'])
+
+
+@GRAFO.registrar('precio_m2', ['precios_idealista.csv'], 'precio_m2', ['mapa_distritos'], modulos = ['limpieza'])
+def _precio_m2(e, p):
+    return preparar_precio_m2(leer_precio_m2(e['precios_idealista.csv']), p['mapa_distritos'])
+
+
+@GRAFO.registrar('limpieza_listings', ['listings'], 'listings_limpio', ['tipos_excluidos', 'precio_minimo'],
+                 modulos = ['limpieza'])
+def _limpieza_listings(e, p):
+    return limpiar_listings(e['listings'], list(p['tipos_excluidos']), p['precio_minimo'])
+
+
+@GRAFO.registrar('limpieza_listings_det', ['listings_det'], 'listings_det_limpio',
+                 ['imputacion_cortes', 'imputacion_valores'], modulos = ['limpieza', 'motor_variables'])
+def _limpieza_listings_det(e, p):
+    return limpiar_listings_det(e['listings_det'], **p)
+
+
+@GRAFO.registrar('cruce', ['listings_limpio', 'listings_det_limpio', 'precio_m2'], 'df', modulos = ['limpieza'],
+                 tablas = {'df': 'df'})
+def _cruce(e, p):
+    return construir_df(e['listings_limpio'], e['listings_det_limpio'], e['precio_m2'])
+
+
+@GRAFO.registrar('variables', ['df'], ['df_variables', 'cortes'], PARAMETROS_VARIABLES,
+                 modulos = ['variables_derivadas', 'motor_variables', 'distancias'])
+def _variables(e, p):
+    return crear_variables(e['df'], **p)
+
+
+@GRAFO.registrar('competencia', ['df_variables'], 'df_competencia', ['radios_competencia'], modulos = ['competencia'])
+def _competencia(e, p):
+    df = e['df_variables']
+    return df.join(crear_variables_competencia(df, radios = tuple(p['radios_competencia'])))
+
+
+@GRAFO.registrar('compactacion', ['df_competencia'], ['df_preparado', 'textos'], modulos = ['compactacion'],
+                 tablas = {'df_preparado': 'df_preparado', 'textos': TABLA_TEXTOS})
+def _compactacion(e, p):
+    df = e['df_competencia']
+    return compactar(df, TEXTOS), df[['id'] + [columna for columna in TEXTOS if columna in df.columns]]
+
+
+@GRAFO.registrar('kpis', ['df_preparado'], 'kpis', modulos = ['kpis', 'cubo'], tablas = {'kpis': 'kpis'})
+def _kpis(e, p):
+    return calcular_kpis(e['df_preparado'])
+
+
+@GRAFO.registrar('rejilla', ['df_preparado'], 'rejilla', modulos = ['rejilla', 'motor_variables'],
+                 tablas = {'rejilla': 'rejilla'})
+def _rejilla(e, p):
+    return construir_rejilla(e['df_preparado'])
+
+
+@GRAFO.registrar('histogramas', ['df_preparado'], 'histogramas', modulos = ['histogramas'],
+                 tablas = {'histogramas': TABLA_HISTOGRAMAS})
+def _histogramas(e, p):
+    return construir_histogramas(e['df_preparado'])
+
+
+def _numero(texto):
+    for tipo in (int, float):
+        try:
+            return tipo(texto)
+        except ValueError:
+            pass
+    return texto
+
+
+def _claves_numericas(pares):
+    # En JSON las claves siempre son texto, pero las tablas del motor (m2_por_habitaciones, bedrooms_disc_etiquetas...)
+    # van por número de habitaciones: {"1": 40} tiene que llegar como {1: 40}
+
+    return {_numero(clave): valor for clave, valor in pares}
+
+
+def _valor_parametro(texto):
+    clave, _, valor = texto.partition('=')
+    try:
+        return clave, json.loads(valor, object_pairs_hook = _claves_numericas)
+    except json.JSONDecodeError:
+        return clave, valor
+
+
+if __name__ == '__main__':
+    argumentos = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    argumentos.add_argument('objetivos', nargs = '*', help = 'salidas o etapas (por defecto todas)')
+    argumentos.add_argument('--carpeta', default = CARPETA_DATOS)
+    argumentos.add_argument('--parametro', action = 'append', default = [], metavar = 'NOMBRE=VALOR',
+                            help = 'valor JSON de un parámetro, p.e. precio_minimo=25 (se puede repetir)')
+    argumentos.add_argument('--forzar', nargs = '+', default = [], help = 'etapas a ejecutar aunque estén en caché')
+    argumentos.add_argument('--publicar', action = 'store_true', default = None,
+                            help = 'publica las tablas en SQLite aunque haya parámetros cambiados')
+    argumentos.add_argument('--estado', action = 'store_true', help = 'solo muestra el estado de la caché y las tablas')
+    argumentos = argumentos.parse_args()
+
+    parametros = dict(_valor_parametro(parametro) for parametro in argumentos.parametro)
+    desconocidos = set(parametros) - set(PARAMETROS)
+    if desconocidos:
+        sys.exit(f'Parámetros desconocidos: {sorted(desconocidos)}. Disponibles: {sorted(PARAMETROS)}')
+
+    if argumentos.estado:
+        print(GRAFO.estado(argumentos.carpeta, parametros).to_string(index = False))
+    else:
+        inicio = time.perf_counter()
+        GRAFO.ejecutar(argumentos.objetivos or None, argumentos.carpeta, parametros, argumentos.forzar,
+                       argumentos.publicar)
+        print(f'Tiempo: {time.perf_counter() - inicio:.2f} s')
@@ -0,0 +1,232 @@
+"""GEOMETRÍA DE BARRIOS (NEIGHBOURHOODS.GEOJSON)
+
+En el script de datos neighbourhoods.geojson solo se miraba en un bloque comentado. El barrio y el distrito de cada
+inmueble vienen como texto en listings y no se comprueban contra nada, y no teníamos la superficie de los barrios para
+medir la densidad de oferta.
+
+Aquí cargamos los polígonos de los barrios una vez y:
+
+- asignamos barrio y distrito a todos los inmuebles por su posición, con un test punto en polígono (ray casting,
+  regla par-impar, así que los huecos de los polígonos funcionan solos) vectorizado con numpy
+- para no probar cada punto contra cada lado de cada barrio usamos dos índices: las cajas (bounding boxes) de los
+  barrios descartan los barrios lejanos, y los lados de cada barrio están repartidos en franjas horizontales, así que
+  para cada punto solo se miran los lados del barrio que cruzan la horizontal del punto
+- calculamos la superficie de cada barrio en km2 (fórmula del área de Gauss sobre coordenadas proyectadas a metros)
+  para tener inmuebles por km2
+
+Uso:
+
+    from geometria import leer_barrios, asignar_barrios, densidad
+    barrios = leer_barrios('DatosCaso1/neighbourhoods.geojson')
+    asignados = asignar_barrios(df, barrios)        # neighbourhood_geo, neighbourhood_group_geo
+    densidad(df, barrios)                           # inmuebles por km2 de cada barrio
+    guardar_densidad(densidad(df, barrios), con)    # tabla densidad_barrios, se cruza por neighbourhood
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from distancias import proyectar_metros
+from persistencia import guardar_tabla
+
+FRANJAS = 256
+
+TAM_BLOQUE = 50_000
+
+# La densidad es del barrio, no del inmueble: va en su propia tabla y no en df_preparado, donde cada alta o baja
+# obligaría a reescribir todos los inmuebles del barrio
+
+TABLA_DENSIDAD = 'densidad_barrios'
+
+
+class Barrios:
+    """Polígonos de los barrios preparados para consultas: cajas, lados por franjas y áreas."""
+
+    def __init__(self, nombres, grupos, anillos):
+        # anillos: lista de (barrio, es_exterior, array n x 2 de (longitud, latitud)) de todos los polígonos
+
+        self.nombres = np.asarray(nombres, dtype = object)
+        self.grupos = np.asarray(grupos, dtype = object)
+
+        barrio = np.concatenate([np.full(len(puntos) - 1, indice) for indice, _, puntos in anillos])
+        inicio = np.concatenate([puntos[:-1] for _, _, puntos in anillos])
+        fin = np.concatenate([puntos[1:] for _, _, puntos in anillos])
+
+        # Cajas de cada barrio: (lon_min, lat_min, lon_max, lat_max)
+
+        extremos = pd.DataFrame({'barrio': barrio, 'x': inicio[:, 0], 'y': inicio[:, 1]}).groupby('barrio')
+        self.cajas = np.column_stack([extremos.x.min(), extremos.y.min(), extremos.x.max(), extremos.y.max()])
+
+        self._indexar_lados(barrio, inicio, fin)
+        self.areas_km2 = self._areas(anillos)
+
+    def _indexar_lados(self, barrio, inicio, fin):
+        # Cada lado se apunta en todas las franjas horizontales que cruza. Quitamos los lados horizontales, que nunca
+        # cortan la semirrecta horizontal del punto.
+
+        no_horizontal = inicio[:, 1] != fin[:, 1]
+        barrio, inicio, fin = barrio[no_horizontal], inicio[no_horizontal], fin[no_horizontal]
+
+        self.y0 = min(inicio[:, 1].min(), fin[:, 1].min())
+        self.alto_franja = (max(inicio[:, 1].max(), fin[:, 1].max()) - self.y0) / FRANJAS or 1.0
+
+        y_min = np.minimum(inicio[:, 1], fin[:, 1])
+        y_max = np.maximum(inicio[:, 1], fin[:, 1])
+        franja_min = self._franja(y_min)
+        franja_max = self._franja(y_max)
+
+        repeticiones = franja_max - franja_min + 1
+        lado = np.repeat(np.arange(len(barrio)), repeticiones)
+        franja = np.repeat(franja_min, repeticiones) + (np.arange(len(lado)) - np.repeat(np.cumsum(repeticiones) - repeticiones, repeticiones))
+
+        # Ordenados por (barrio, franja): los lados de un barrio en una franja son un tramo contiguo
+
+        clave = barrio[lado] * FRANJAS + franja
+        orden = np.argsort(clave, kind = 'stable')
+        lado, clave = lado[orden], clave[orden]
+
+        self.lados = np.column_stack([inicio[lado], fin[lado]])  # x1, y1, x2, y2
+        self.tramos = np.searchsorted(clave, np.arange(len(self.nombres) * FRANJAS + 1))
+
+    def _franja(self, y):
+        return np.clip(((y - self.y0) / self.alto_franja).astype('int64'), 0, FRANJAS - 1)
+
+    def _areas(self, anillos):
+        todos = np.concatenate([puntos for _, _, puntos in anillos])
+        origen = (todos[:, 1].mean(), todos[:, 0].mean())
+
+        areas = np.zeros(len(self.nombres))
+        for barrio, exterior, puntos in anillos:
+            xy = proyectar_metros(puntos[:, 1], puntos[:, 0], origen = origen)
+            area = abs(np.dot(xy[:-1, 0], xy[1:, 1]) - np.dot(xy[1:, 0], xy[:-1, 1])) / 2
+            areas[barrio] += area if exterior else -area
+
+        return areas / 1e6
+
+    def tabla(self):
+        """Barrios con su distrito y superficie en km2."""
+
+        return pd.DataFrame({'neighbourhood': self.nombres, 'neighbourhood_group': self.grupos,
+                             'area_km2': self.areas_km2})
+
+    def localizar(self, latitudes, longitudes, tam_bloque = TAM_BLOQUE):
+        """Índice del barrio que contiene cada punto (-1 si no está en ninguno)."""
+
+        latitudes = np.asarray(latitudes, dtype = 'float64')
+        longitudes = np.asarray(longitudes, dtype = 'float64')
+
+        resultado = np.full(len(latitudes), -1, dtype = 'int64')
+        for inicio in range(0, len(latitudes), tam_bloque):
+            bloque = slice(inicio, inicio + tam_bloque)
+            resultado[bloque] = self._localizar_bloque(longitudes[bloque], latitudes[bloque])
+
+        return resultado
+
+    def _localizar_bloque(self, x, y):
+        # 1. Parejas (punto, barrio) cuya caja contiene al punto
+
+        dentro_caja = (x[:, None] >= self.cajas[:, 0]) & (x[:, None] <= self.cajas[:, 2]) \
+            & (y[:, None] >= self.cajas[:, 1]) & (y[:, None] <= self.cajas[:, 3])
+        punto, barrio = np.nonzero(dentro_caja)
+
+        # 2. Para cada pareja, los lados de ese barrio en la franja del punto
+
+        clave = barrio * FRANJAS + self._franja(y[punto])
+        desde, hasta = self.tramos[clave], self.tramos[clave + 1]
+        n_lados = hasta - desde
+
+        pareja = np.repeat(np.arange(len(punto)), n_lados)
+        lado = np.repeat(desde, n_lados) + (np.arange(n_lados.sum()) - np.repeat(np.cumsum(n_lados) - n_lados, n_lados))
+
+        # 3. Ray casting hacia +x: el lado cruza la horizontal del punto y el corte está a su derecha
+
+        px, py = x[punto[pareja]], y[punto[pareja]]
+        x1, y1, x2, y2 = self.lados[lado].T
+
+        cruza = (y1 > py) != (y2 > py)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            corte = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        cortes = np.bincount(pareja, weights = cruza & (px < corte), minlength = len(punto))
+
+        dentro = cortes % 2 == 1
+
+        # Un punto justo en la frontera de dos barrios se queda con el primero
+
+        resultado = np.full(len(x), -1, dtype = 'int64')
+        resultado[punto[dentro][::-1]] = barrio[dentro][::-1]
+
+        return resultado
+
+
+def leer_barrios(ruta = 'DatosCaso1/neighbourhoods.geojson'):
+    """Carga los polígonos de neighbourhoods.geojson (Polygon o MultiPolygon, con huecos)."""
+
+    with open(ruta, encoding = 'utf-8') as fichero:
+        geojson = json.load(fichero)
+
+    nombres, grupos, anillos = [], [], []
+    for elemento in geojson['features']:
+        geometria = elemento.get('geometry')
+        if not geometria:
+            continue
+
+        poligonos = geometria['coordinates'] if geometria['type'] == 'MultiPolygon' else [geometria['coordinates']]
+
+        indice = len(nombres)
+        nombres.append(elemento['properties'].get('neighbourhood'))
+        grupos.append(elemento['properties'].get('neighbourhood_group'))
+
+        for poligono in poligonos:
+            for orden, anillo in enumerate(poligono):
+                puntos = np.asarray(anillo, dtype = 'float64')[:, :2]
+                if not np.array_equal(puntos[0], puntos[-1]):
+                    puntos = np.vstack([puntos, puntos[:1]])
+                anillos.append((indice, orden == 0, puntos))
+
+    return Barrios(nombres, grupos, anillos)
+
+
+def asignar_barrios(df, barrios):
+    """Barrio y distrito de cada inmueble según su posición (nulos si cae fuera de todos), con el índice de df."""
+
+    indice = barrios.localizar(df.latitude.to_numpy(dtype = 'float64', na_value = np.nan),
+                               df.longitude.to_numpy(dtype = 'float64', na_value = np.nan))
+    fuera = indice < 0
+
+    nombres = np.where(fuera, None, barrios.nombres[indice])
+    grupos = np.where(fuera, None, barrios.grupos[indice])
+
+    return pd.DataFrame({'neighbourhood_geo': nombres, 'neighbourhood_group_geo': grupos}, index = df.index)
+
+
+def validar_barrios(df, barrios):
+    """Inmuebles cuyo barrio o distrito del CSV no coincide con el de su posición."""
+
+    asignados = asignar_barrios(df, barrios)
+    distinto = (df.neighbourhood.astype(str) != asignados.neighbourhood_geo.astype(str)) \
+        | (df.neighbourhood_group.astype(str) != asignados.neighbourhood_group_geo.astype(str))
+
+    return df.loc[distinto, ['id', 'neighbourhood', 'neighbourhood_group', 'latitude', 'longitude']] \
+        .join(asignados.loc[distinto])
+
+
+def densidad(df, barrios, columna = 'neighbourhood'):
+    """Inmuebles por km2 de cada barrio (por el barrio del CSV, o el asignado si columna = 'neighbourhood_geo')."""
+
+    superficie = barrios.tabla().set_index('neighbourhood')
+
+    if columna not in df.columns:
+        df = df.join(asignar_barrios(df, barrios))
+
+    inmuebles = df[columna].astype(str).value_counts().reindex(superficie.index, fill_value = 0)
+
+    superficie['inmuebles'] = inmuebles
+    superficie['inmuebles_km2'] = inmuebles / superficie.area_km2
+
+    return superficie.reset_index()
+
+
+def guardar_densidad(densidad_barrios, con):
+    guardar_tabla(densidad_barrios, TABLA_DENSIDAD, con, indices = ['neighbourhood'])
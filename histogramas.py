@@ -0,0 +1,104 @@
+"""MATRICES DE PROBABILIDAD DE LA OCUPACIÓN POR DISTRITO Y BARRIO
+
+En insights la probabilidad de cada nivel de ocupación en cada distrito se calculaba con un groupby por distrito y
+ocupación seguido de otro groupby con apply(lambda), que llama a una función de Python por distrito, y al final
+reset_index(drop = True) tiraba las etiquetas de distrito y nivel: quedaba una lista de porcentajes sin saber de qué.
+
+Aquí cada matriz (grupos x niveles de ocupación de 0 a 100) es un histograma 2-D de una sola pasada:
+
+- los grupos se pasan a códigos enteros (los códigos de la categórica si df viene compacto)
+- la clave de cada inmueble es código x 101 + ocupación, y np.bincount con esa clave cuenta todas las celdas a la vez
+- la probabilidad es el conteo entre los inmuebles del grupo (en %, como en insights) y la acumulada su suma por filas
+  (probabilidad de tener esa ocupación o menos)
+
+Las matrices salen con las etiquetas (grupos en el índice, niveles en las columnas), y construir_histogramas las junta
+en formato largo para guardarlas en el datamart (tabla histogramas_ocupacion y su caché Arrow), de donde las leen los
+informes y los mapas sin volver a cargar df_preparado.
+
+Uso:
+
+    from histogramas import matrices_ocupacion, construir_histogramas, guardar_histogramas, leer_histogramas
+    conteos, probabilidad, acumulada = matrices_ocupacion(df, 'distrito')
+    guardar_histogramas(construir_histogramas(df), con)
+    leer_histogramas(con, 'neighbourhood', 'acumulada')
+"""
+
+import numpy as np
+import pandas as pd
+
+from cache_columnar import guardar_cache, leer_tabla
+from persistencia import guardar_tabla
+
+DIMENSIONES = ['distrito', 'neighbourhood']
+
+NIVELES = 101
+
+VALORES = ['inmuebles', 'probabilidad', 'acumulada']
+
+TABLA = 'histogramas_ocupacion'
+
+
+def _codigos(serie):
+    # Códigos enteros (-1 para nulos) y etiqueta de cada código, sin los grupos que no tienen inmuebles
+
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype('category')
+    serie = serie.cat.remove_unused_categories()
+
+    return serie.cat.codes.to_numpy().astype('int64'), serie.cat.categories
+
+
+def matrices_ocupacion(df, dimension = 'distrito', variable = 'ocupacion', niveles = NIVELES):
+    """Conteos, probabilidad (%) y probabilidad acumulada (%) de cada nivel de variable (0 a niveles - 1) por grupo de
+    dimension, como DataFrames grupos x niveles."""
+
+    codigos, grupos = _codigos(df[dimension])
+    valores = df[variable].to_numpy(dtype = 'float64', na_value = np.nan)
+
+    validos = (codigos >= 0) & (valores >= 0) & (valores < niveles)
+    clave = codigos[validos] * niveles + valores[validos].astype('int64')
+
+    conteos = np.bincount(clave, minlength = len(grupos) * niveles).reshape(len(grupos), niveles)
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        probabilidad = 100 * conteos / conteos.sum(axis = 1, keepdims = True)
+
+    etiquetas = {'index': pd.Index(grupos, name = dimension), 'columns': pd.RangeIndex(niveles, name = variable)}
+
+    return (pd.DataFrame(conteos, **etiquetas), pd.DataFrame(probabilidad, **etiquetas),
+            pd.DataFrame(np.cumsum(probabilidad, axis = 1), **etiquetas))
+
+
+def construir_histogramas(df, dimensiones = DIMENSIONES, variable = 'ocupacion', niveles = NIVELES):
+    """Las matrices de cada dimensión en formato largo: dimension, grupo, nivel, inmuebles, probabilidad y acumulada."""
+
+    partes = []
+    for dimension in dimensiones:
+        matrices = matrices_ocupacion(df, dimension, variable, niveles)
+        grupos = matrices[0].index.astype(str)
+
+        partes.append(pd.DataFrame({
+            'dimension': dimension,
+            'grupo': np.repeat(grupos, niveles),
+            'nivel': np.tile(np.arange(niveles), len(grupos)),
+            **{valor: matriz.to_numpy().ravel() for valor, matriz in zip(VALORES, matrices)},
+        }))
+
+    return pd.concat(partes, ignore_index = True).astype({'nivel': 'int8', 'inmuebles': 'int32'})
+
+
+def guardar_histogramas(histogramas, con):
+    guardar_tabla(histogramas, TABLA, con, indices = ['dimension'])
+    guardar_cache(histogramas, TABLA, con)
+
+
+def leer_histogramas(con, dimension = 'distrito', valor = 'probabilidad'):
+    """Matriz guardada (grupos x niveles) de una dimensión: inmuebles, probabilidad o acumulada."""
+
+    histogramas = leer_tabla(TABLA, con)
+    histogramas = histogramas.loc[histogramas.dimension == dimension]
+
+    matriz = histogramas.pivot(index = 'grupo', columns = 'nivel', values = valor)
+    matriz.index.name, matriz.columns.name = dimension, 'ocupacion'
+
+    return matriz
@@ -0,0 +1,370 @@
+"""RECONSTRUCCIÓN INCREMENTAL DEL DATAMART
+
+Con cada actualización de Inside Airbnb volvíamos a ejecutar el script de datos de principio a fin: carga completa de
+los CSV, limpieza completa, pd.merge completo por id y to_sql reemplazando las tablas. Pero entre dos descargas la
+mayoría de los inmuebles no cambian.
+
+En modo incremental:
+
+1. Calculamos un hash de cada fila de origen (solo las columnas que usamos de listings y listings_det, cruzadas por id)
+   y lo comparamos con los hashes guardados en la anterior reconstrucción (_hashes_fuente).
+2. Así sabemos qué ids se han insertado, actualizado y borrado.
+3. Solo para los insertados y actualizados repetimos limpieza, imputación, cruce con el precio del m2 y variables
+   derivadas (con los mismos cortes de discretización de la reconstrucción completa).
+4. Las variables de competencia dependen de los vecinos, así que también se recalculan para los inmuebles cerca de un
+   cambio, según el tipo de cambio: con altas, bajas y cambios de posición, los que están a menos del radio máximo
+   (y los aislados, cuyo competidor más cercano puede estar más lejos); con un cambio solo de precio, los que están a
+   menos de RADIO_PRECIO, que son los únicos cuya mediana de precio de competencia lo puede incluir.
+5. Hacemos upsert por id en df, df_preparado (compacta, compactacion.py), textos y _hashes_fuente. De los vecinos
+   solo se actualizan las columnas de competencia (actualizar_columnas), y las cachés columnares se parchean con las
+   filas cambiadas (cache_columnar.parchear_cache) en vez de reescribirse.
+6. Rehacemos las tablas que se calculan sobre df_preparado entero (actualizar_derivadas): sketches de la descarga,
+   kpis, rejilla, histogramas_ocupacion y densidad_barrios. Son agregados de toda la ciudad, pero se calculan sobre la
+   caché columnar sin volver a pasar por la limpieza ni la competencia.
+
+Después de reescribirlas, apuntamos en _etapas (GRAFO.sellar) df, df_preparado, textos, kpis, rejilla e
+histogramas_ocupacion con la clave que tienen en etapas.py para los ficheros actuales: son las que saldrían de las
+etapas, así que el script de insights y python etapas.py --estado no las dan por desactualizadas.
+
+Además guardamos una huella global de lo que afecta a todos los inmuebles: los precios del m2, los parámetros de
+limpieza, de negocio (motor_variables.PARAMETROS) y de competencia (los radios de etapas.PARAMETROS y RADIO_PRECIO) y
+el código de los módulos que construyen las filas (y de los que estos importan). Si cambia, o si no hay una
+reconstrucción anterior, se hace una reconstrucción completa: si no, los inmuebles sin cambios se quedarían con el
+precio_compra o las imputaciones de antes junto a los recalculados.
+
+Si no hay reconstrucción anterior pero los scripts de datos y variables (etapas.py) han publicado df, df_preparado y
+textos y están al día con los ficheros actuales, no se reconstruye nada: esas tablas son las que saldrían de la
+reconstrucción completa, así que solo apuntamos los hashes de las filas y los cortes de discretización.
+
+Leer y hashear los CSV sigue siendo proporcional al tamaño de la ciudad (hay que leerlos para saber qué ha cambiado),
+pero eso es lo barato. Todo lo demás es proporcional al número de inmuebles que han cambiado.
+
+Uso:
+
+    python incremental.py                 # incremental si se puede
+    python incremental.py --completo      # fuerza la reconstrucción completa
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache_columnar import guardar_cache, leer_tabla, parchear_cache
+from compactacion import TABLA_TEXTOS, compactar, guardar_textos, reemplazar_textos
+from competencia import IndiceEspacial, crear_variables_competencia
+from etapas import GRAFO, PARAMETROS as PARAMETROS_ETAPAS, modulos_locales
+from geometria import densidad, guardar_densidad, leer_barrios
+from histogramas import TABLA as TABLA_HISTOGRAMAS, construir_histogramas, guardar_histogramas
+from ingesta import leer_listings_det
+from kpis import calcular_kpis
+from limpieza import (A_ELIMINAR, A_INCLUIR, MAPA_DISTRITOS, PRECIO_MINIMO, TIPOS_EXCLUIDOS, construir_df,
+                      leer_listings, leer_precio_m2, limpiar_listings, limpiar_listings_det, preparar_precio_m2)
+from motor_variables import PARAMETROS
+from persistencia import abrir, actualizar_columnas, guardar_tabla, reemplazar_filas, ruta_db, version_tabla
+from rejilla import construir_rejilla, guardar_rejilla
+from sketches import fecha_descarga, guardar_sketches
+from variables_derivadas import crear_variables
+
+CARPETA_DATOS = 'DatosCaso1'
+
+CIUDAD = 'madrid'
+
+TABLAS = ['df', 'df_preparado', TABLA_TEXTOS]
+
+# Las que se calculan sobre df_preparado entero y también publica etapas.py
+
+DERIVADAS = ['kpis', 'rejilla', TABLA_HISTOGRAMAS]
+
+# Los mismos radios que la etapa de competencia de etapas.py
+
+RADIOS_COMPETENCIA = tuple(PARAMETROS_ETAPAS['radios_competencia'])
+
+RADIO_PRECIO = 500
+
+COLUMNAS_COMPETENCIA = ['id', 'latitude', 'longitude', 'precio_total']
+
+# Módulos cuyo código entra en la huella global (con los módulos del repositorio que importan)
+
+MODULOS = ['limpieza', 'motor_variables', 'variables_derivadas', 'competencia', 'compactacion']
+
+
+def leer_fuentes(carpeta = CARPETA_DATOS):
+    listings = leer_listings(os.path.join(carpeta, 'listings.csv'))
+    listings_det = leer_listings_det(os.path.join(carpeta, 'listings.csv.gz'))
+    precio_m2 = preparar_precio_m2(leer_precio_m2(os.path.join(carpeta, 'precios_idealista.csv')))
+
+    return listings, listings_det, precio_m2
+
+
+def hash_filas(listings, listings_det):
+    """Hash (int64) por id de las columnas de origen que usamos."""
+
+    fuente = pd.merge(left = listings.drop(columns = A_ELIMINAR + ['index'], errors = 'ignore'),
+                      right = listings_det.loc[:, A_INCLUIR],
+                      how = 'left', on = 'id')
+
+    hashes = pd.util.hash_pandas_object(fuente, index = False).to_numpy().view('int64')
+
+    return pd.Series(hashes, index = fuente['id'].to_numpy(), name = 'hash')
+
+
+def huella_global(precio_m2):
+    """Lo que afecta a todos los inmuebles: el precio del m2 por distrito, los parámetros de limpieza, de negocio y de
+    competencia y el código de MODULOS."""
+
+    contenido = precio_m2.sort_values('distrito').to_csv(index = False) \
+        + repr((TIPOS_EXCLUIDOS, PRECIO_MINIMO, sorted(MAPA_DISTRITOS.items()), PARAMETROS, RADIOS_COMPETENCIA,
+                RADIO_PRECIO)) \
+        + json.dumps(modulos_locales(MODULOS))
+
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+def _leer_metadatos(con):
+    with abrir(con) as conexion:
+        try:
+            metadatos = dict(conexion.execute('SELECT clave, valor FROM _incremental').fetchall())
+            hashes = pd.read_sql('SELECT id, hash FROM _hashes_fuente', conexion).set_index('id').hash
+            tablas = {fila[0] for fila in conexion.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        except (sqlite3.OperationalError, pd.errors.DatabaseError):
+            return None, None
+
+    if not set(TABLAS) <= tablas:
+        return None, None
+
+    return metadatos, hashes
+
+
+def _guardar_metadatos(con, huella, cortes):
+    with abrir(con) as conexion:
+        conexion.execute('CREATE TABLE IF NOT EXISTS _incremental (clave TEXT PRIMARY KEY, valor TEXT)')
+        conexion.executemany('INSERT OR REPLACE INTO _incremental VALUES (?, ?)',
+                             [('huella_global', huella), ('cortes', json.dumps(cortes))])
+
+
+def _guardar_hashes(con, listings, listings_det):
+    hashes = hash_filas(listings, listings_det)
+    guardar_tabla(pd.DataFrame({'id': hashes.index, 'hash': hashes.to_numpy()}), '_hashes_fuente', con)
+
+    return hashes
+
+
+def _adoptar_publicadas(con, fuentes):
+    # Las tablas de GRAFO se publican en <carpeta>/airbnb.db. Si df, df_preparado y textos están al día con los
+    # ficheros, parámetros y código actuales, son las de la reconstrucción completa: solo faltan hashes y cortes
+
+    carpeta = os.path.dirname(ruta_db(con))
+    if set(TABLAS) & set(GRAFO.desactualizadas(carpeta, con = con)):
+        return None, None
+
+    listings, listings_det, precio_m2 = fuentes
+
+    cortes = GRAFO.ejecutar('cortes', carpeta, con = con)['cortes']
+    hashes = _guardar_hashes(con, listings, listings_det)
+    _guardar_metadatos(con, huella_global(precio_m2), cortes)
+
+    print('Tablas publicadas por etapas.py al día: se usan como reconstrucción anterior')
+
+    return _leer_metadatos(con)[0], hashes
+
+
+def reconstruir_completo(con, fuentes, workers = -1):
+    listings, listings_det, precio_m2 = fuentes
+
+    df = construir_df(limpiar_listings(listings), limpiar_listings_det(listings_det), precio_m2)
+    guardar_tabla(df, 'df', con)
+    guardar_cache(df, 'df', con)
+
+    df_preparado, cortes = crear_variables(df)
+    df_preparado = df_preparado.join(crear_variables_competencia(df_preparado, radios = RADIOS_COMPETENCIA,
+                                                                 radio_precio = RADIO_PRECIO, workers = workers))
+    guardar_textos(df_preparado, con)
+    df_preparado = compactar(df_preparado)
+    guardar_tabla(df_preparado, 'df_preparado', con)
+    guardar_cache(df_preparado, 'df_preparado', con)
+
+    _guardar_hashes(con, listings, listings_det)
+    _guardar_metadatos(con, huella_global(precio_m2), cortes)
+
+    print(f'Reconstrucción completa: {len(df_preparado)} inmuebles')
+
+    return True
+
+
+def detectar_cambios(hashes_anteriores, hashes_nuevos):
+    """Devuelve (insertados, actualizados, borrados) como arrays de ids."""
+
+    comunes = hashes_nuevos.index.intersection(hashes_anteriores.index)
+
+    insertados = hashes_nuevos.index.difference(hashes_anteriores.index).to_numpy()
+    borrados = hashes_anteriores.index.difference(hashes_nuevos.index).to_numpy()
+    actualizados = comunes[hashes_nuevos.loc[comunes].to_numpy() != hashes_anteriores.loc[comunes].to_numpy()].to_numpy()
+
+    return insertados, actualizados, borrados
+
+
+def _afectados_por_competencia(anterior, nuevo_estado, tocados, indice):
+    # Inmuebles sin cambios cuya competencia puede haber cambiado, según el tipo de cambio de los tocados:
+    # - altas, bajas y cambios de posición mueven los conteos de todos los radios y los k vecinos más cercanos: los que
+    #   están a menos del radio máximo de la posición anterior o nueva, y los aislados (competidor más cercano más allá)
+    # - un cambio solo de precio no mueve conteos ni vecinos, solo la mediana de precio de quienes lo tienen entre sus
+    #   k vecinos, que están a menos de RADIO_PRECIO
+    # - el resto de cambios (valoraciones, descripción...) no cambia la competencia de los demás
+
+    posicion = ['latitude', 'longitude']
+
+    antes = anterior.loc[anterior.id.isin(tocados)].set_index('id')
+    despues = nuevo_estado.loc[nuevo_estado.id.isin(tocados)].set_index('id')
+    comunes = antes.index.intersection(despues.index)
+
+    movidos = (antes.loc[comunes, posicion] != despues.loc[comunes, posicion]).any(axis = 1)
+    precio_antes, precio_despues = antes.loc[comunes, 'precio_total'], despues.loc[comunes, 'precio_total']
+    con_precio = (precio_antes != precio_despues) & ~(precio_antes.isna() & precio_despues.isna()) & ~movidos
+
+    estructurales = antes.index.symmetric_difference(despues.index).union(comunes[movidos.to_numpy()])
+    puntos = pd.concat([antes.loc[antes.index.intersection(estructurales), posicion],
+                        despues.loc[despues.index.intersection(estructurales), posicion]])
+    puntos_precio = despues.loc[comunes[con_precio.to_numpy()], posicion]
+
+    posiciones = [np.empty(0, dtype = 'int64')]
+    for radio, origen in [(max(RADIOS_COMPETENCIA), puntos), (RADIO_PRECIO, puntos_precio)]:
+        posiciones += list(indice.vecinos_en_radio(radio, origen.latitude.to_numpy(), origen.longitude.to_numpy()))
+
+    afectados = nuevo_estado.id.to_numpy()[np.unique(np.concatenate(posiciones))]
+
+    if len(estructurales):
+        aislados = anterior.id[anterior.dist_competidor_cercano > max(RADIOS_COMPETENCIA)]
+        afectados = np.intersect1d(np.union1d(afectados, aislados.to_numpy()), nuevo_estado.id.to_numpy())
+
+    return np.setdiff1d(afectados, tocados)
+
+
+def reconstruir_incremental(con, fuentes, workers = -1):
+    """Aplica los cambios de las fuentes desde la anterior reconstrucción. Devuelve True si ha cambiado df_preparado."""
+
+    listings, listings_det, precio_m2 = fuentes
+
+    metadatos, hashes_anteriores = _leer_metadatos(con)
+    if metadatos is None:
+        metadatos, hashes_anteriores = _adoptar_publicadas(con, fuentes)
+
+    if metadatos is None or metadatos.get('huella_global') != huella_global(precio_m2):
+        print('No hay una reconstrucción anterior compatible, hacemos la completa')
+        return reconstruir_completo(con, fuentes, workers)
+
+    hashes_nuevos = hash_filas(listings, listings_det)
+    insertados, actualizados, borrados = detectar_cambios(hashes_anteriores, hashes_nuevos)
+
+    print(f'Insertados: {len(insertados)}, actualizados: {len(actualizados)}, borrados: {len(borrados)}')
+
+    if not (len(insertados) or len(actualizados) or len(borrados)):
+        return False
+
+    cambiados = np.concatenate([insertados, actualizados])
+    tocados = np.concatenate([cambiados, borrados])
+
+    # Limpieza, imputación y cruce con el precio del m2 solo de los cambiados. Algunos pueden quedarse fuera por los
+    # filtros (p.e. si ahora es un hotel), por eso borramos todos los tocados e insertamos los que sobreviven.
+
+    df_cambios = construir_df(limpiar_listings(listings.loc[listings.id.isin(cambiados)]),
+                              limpiar_listings_det(listings_det.loc[listings_det.id.isin(cambiados)]),
+                              precio_m2)
+
+    version_df = version_tabla(con, 'df')
+    reemplazar_filas(df_cambios, 'df', con, borrar = tocados)
+    parchear_cache('df', con, version_df, filas = df_cambios, borrar = tocados)
+
+    preparado_cambios, _ = crear_variables(df_cambios, json.loads(metadatos['cortes']))
+
+    # Competencia: índice sobre el nuevo estado completo (solo coordenadas y precio), cálculo solo de los afectados
+
+    anterior = leer_tabla('df_preparado', con, columnas = COLUMNAS_COMPETENCIA + ['dist_competidor_cercano'])
+
+    nuevo_estado = pd.concat([anterior.loc[~anterior.id.isin(tocados), COLUMNAS_COMPETENCIA],
+                              preparado_cambios[COLUMNAS_COMPETENCIA]],
+                             ignore_index = True)
+
+    indice = IndiceEspacial.desde_df(nuevo_estado, workers = workers)
+    vecinos = _afectados_por_competencia(anterior, nuevo_estado, tocados, indice)
+
+    filas = np.flatnonzero(nuevo_estado.id.isin(np.concatenate([preparado_cambios.id.to_numpy(), vecinos])))
+    competencia = crear_variables_competencia(nuevo_estado, radios = RADIOS_COMPETENCIA, radio_precio = RADIO_PRECIO,
+                                              indice = indice, filas = filas)
+    competencia.index = nuevo_estado.id.to_numpy()[filas]
+
+    preparado_cambios = preparado_cambios.join(competencia, on = 'id')
+    reemplazar_textos(preparado_cambios, con, borrar = tocados)
+    preparado_cambios = compactar(preparado_cambios)
+
+    # De los vecinos afectados solo cambian las columnas de competencia
+
+    competencia_vecinos = compactar(competencia.loc[vecinos].rename_axis('id').reset_index())
+
+    version_preparado = version_tabla(con, 'df_preparado')
+    reemplazar_filas(preparado_cambios, 'df_preparado', con, borrar = tocados)
+    actualizar_columnas(competencia_vecinos, 'df_preparado', con)
+    parchear_cache('df_preparado', con, version_preparado, filas = preparado_cambios, actualizadas = competencia_vecinos,
+                   borrar = tocados)
+
+    hashes_cambiados = hashes_nuevos.loc[cambiados]
+    reemplazar_filas(pd.DataFrame({'id': hashes_cambiados.index, 'hash': hashes_cambiados.to_numpy()}),
+                     '_hashes_fuente', con, borrar = borrados)
+
+    print(f'df: {len(df_cambios)} filas reescritas, df_preparado: {len(preparado_cambios)} filas reescritas y '
+          f'{len(vecinos)} con la competencia actualizada')
+
+    return True
+
+
+def actualizar_derivadas(con, carpeta = CARPETA_DATOS, descarga = None, ciudad = None):
+    """Rehace las tablas calculadas sobre df_preparado entero: sketches de la descarga, kpis, rejilla,
+    histogramas_ocupacion y, si está neighbourhoods.geojson, densidad_barrios. Devuelve los KPIs.
+
+    descarga: por defecto la fecha del listings.csv.gz de carpeta (sketches.fecha_descarga). Con ciudad (pipeline.py)
+    los KPIs llevan ciudad y descarga en columnas; sin ella son como los del script de variables.
+    """
+
+    df = leer_tabla('df_preparado', con)
+    descarga = descarga or fecha_descarga(os.path.join(carpeta, 'listings.csv.gz'))
+
+    guardar_sketches(df, descarga, con, ciudad = ciudad or CIUDAD)
+
+    kpis = calcular_kpis(df, ciudad, descarga if ciudad else None)
+    guardar_tabla(kpis, 'kpis', con, indices = ['nivel'])
+
+    guardar_rejilla(construir_rejilla(df), con)
+    guardar_histogramas(construir_histogramas(df), con)
+
+    geojson = os.path.join(carpeta, 'neighbourhoods.geojson')
+    if os.path.exists(geojson):
+        guardar_densidad(densidad(df, leer_barrios(geojson)), con)
+
+    return kpis
+
+
+def reconstruir(carpeta = CARPETA_DATOS, con = None, completo = False):
+    con = con or os.path.join(carpeta, 'airbnb.db')
+
+    inicio = time.perf_counter()
+    fuentes = leer_fuentes(carpeta)
+
+    if completo:
+        cambios = reconstruir_completo(con, fuentes)
+    else:
+        cambios = reconstruir_incremental(con, fuentes)
+
+    if cambios:
+        actualizar_derivadas(con, carpeta)
+        GRAFO.sellar(TABLAS + DERIVADAS, carpeta, con)
+
+    print(f'Tiempo: {time.perf_counter() - inicio:.2f} s')
+
+
+if __name__ == '__main__':
+    reconstruir(completo = '--completo' in sys.argv)
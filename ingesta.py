@@ -0,0 +1,121 @@
+"""INGESTA DE LISTINGS.CSV.GZ POR BLOQUES
+
+El fichero de detalle de listings tiene unas 75 columnas, algunas de texto libre muy grandes, y en el script de datos
+lo leíamos entero en memoria para luego quedarnos solo con las 11 columnas de a_incluir y pasar host_is_superhost a
+categórica.
+
+Aquí declaramos por adelantado el esquema que necesitamos (columnas y tipos) y leemos el gzip por bloques:
+
+- usecols: las columnas que no vamos a usar ni se llegan a parsear
+- host_is_superhost como categórica con sus dos niveles fijos
+- los conteos (accommodates, bedrooms, beds, number_of_reviews) como enteros con nulos (Int16/Int32)
+- las valoraciones y bathrooms como float32 (en memoria y en la caché: al guardarlas en SQLite, persistencia.py las
+  vuelve a pasar a float64 con el mismo valor decimal que en el CSV)
+
+Así el pico de memoria de la carga queda acotado por el tamaño del bloque y no por el tamaño del fichero (más lo que
+ocupa la tabla final ya recortada, que es la que vamos a usar de todas formas).
+
+Para comparar el pico de memoria con la lectura completa: python ingesta.py DatosCaso1/listings.csv.gz
+"""
+
+import resource
+import subprocess
+import sys
+
+import pandas as pd
+
+# Esquema de la tabla de detalle: las columnas de a_incluir del script de datos con su tipo final
+
+ESQUEMA_LISTINGS_DET = {
+    'id': 'int64',
+    'description': 'object',
+    'host_is_superhost': pd.CategoricalDtype(['f', 't']),
+    'accommodates': 'Int16',
+    'bathrooms': 'float32',
+    'bedrooms': 'Int16',
+    'beds': 'Int16',
+    'number_of_reviews': 'Int32',
+    'review_scores_rating': 'float32',
+    'review_scores_communication': 'float32',
+    'review_scores_location': 'float32',
+}
+
+TAM_BLOQUE = 20_000
+
+
+def _tipos_lectura(esquema):
+    # Los enteros con nulos los parseamos como float64 (exacto para estos rangos) y los convertimos en cada bloque,
+    # porque según la versión de pandas el parser no acepta valores como '1.0' directamente en Int16
+
+    return {columna: ('float64' if isinstance(tipo, str) and tipo.startswith(('Int', 'UInt')) else tipo)
+            for columna, tipo in esquema.items()}
+
+
+def _aplicar_esquema(bloque, esquema):
+    for columna, tipo in esquema.items():
+        if bloque[columna].dtype != tipo:
+            bloque[columna] = bloque[columna].astype(tipo)
+    return bloque
+
+
+def leer_por_bloques(ruta, esquema = ESQUEMA_LISTINGS_DET, tam_bloque = TAM_BLOQUE, **kwargs):
+    """Generador de bloques del CSV (comprimido o no) ya recortados y tipados según el esquema."""
+
+    lector = pd.read_csv(ruta,
+                         usecols = list(esquema),
+                         dtype = _tipos_lectura(esquema),
+                         chunksize = tam_bloque,
+                         **kwargs)
+
+    with lector:
+        for bloque in lector:
+            yield _aplicar_esquema(bloque, esquema)[list(esquema)]
+
+
+def leer_listings_det(ruta = 'DatosCaso1/listings.csv.gz', esquema = ESQUEMA_LISTINGS_DET, tam_bloque = TAM_BLOQUE):
+    """Lee el fichero de detalle de listings por bloques y devuelve un DataFrame con solo las columnas del esquema."""
+
+    bloques = list(leer_por_bloques(ruta, esquema, tam_bloque))
+
+    if not bloques:
+        return _aplicar_esquema(pd.DataFrame({columna: pd.Series(dtype = 'float64') for columna in esquema}), esquema)
+
+    return pd.concat(bloques, ignore_index = True)
+
+
+# MEDICIÓN DEL PICO DE MEMORIA
+
+def pico_rss_mb():
+    # En Linux ru_maxrss viene en KB, en macOS en bytes
+
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024 ** 2 if sys.platform == 'darwin' else pico / 1024
+
+
+def _medir(modo, ruta):
+    if modo == 'completo':
+        # Como se hacía en el script de datos
+
+        listings_det = pd.read_csv(ruta, compression = 'gzip' if ruta.endswith('.gz') else 'infer')
+        listings_det = listings_det.loc[:, list(ESQUEMA_LISTINGS_DET)]
+        listings_det['host_is_superhost'] = listings_det['host_is_superhost'].astype('category')
+    else:
+        listings_det = leer_listings_det(ruta)
+
+    print(f'{modo}: {listings_det.shape[0]} filas, '
+          f'{listings_det.memory_usage(deep = True).sum() / 1024 ** 2:.1f} MB en la tabla, '
+          f'pico RSS {pico_rss_mb():.1f} MB')
+
+
+def comparar(ruta):
+    """Mide el pico de RSS de cada forma de leer en un proceso nuevo, para que una medición no contamine a la otra."""
+
+    for modo in ['completo', 'bloques']:
+        subprocess.run([sys.executable, __file__, '--medir', modo, ruta], check = True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--medir':
+        _medir(sys.argv[2], sys.argv[3])
+    else:
+        comparar(sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/listings.csv.gz')
@@ -0,0 +1,258 @@
+"""INSTRUMENTACIÓN POR TRAMOS CON INFORME JSON
+
+Los scripts de datos, variables e insights van de arriba abajo con print(). Cuando una actualización va lenta no
+sabemos si el coste está en leer el gzip, en el merge por id, en la imputación, en las distancias o en guardar en SQLite.
+
+Aquí marcamos cada paso lógico como un tramo con nombre y para cada uno guardamos:
+
+- tiempo de reloj y de CPU
+- RSS al empezar y al acabar y el incremento del pico de RSS durante el tramo (un hilo muestrea la RSS mientras haya
+  tramos abiertos)
+- filas de entrada y de salida (si se le pasa un DataFrame o un número)
+
+Los tramos se pueden anidar (dentro de 'variables' puede haber 'variables/distancias'). Al terminar el proceso se
+escribe un informe JSON por ejecución en informes/<script>_<fecha>_<pid>.json con los tramos y el entorno.
+
+Está desactivado por defecto: sin la variable de entorno INSTRUMENTACION, tramo(), empezar() y terminar() no hacen
+nada (una llamada a función que devuelve enseguida). Para activarlo:
+
+    INSTRUMENTACION=1 python analisis_inmobiliario_madrid_datos.py           # informes/
+    INSTRUMENTACION=/tmp/informes python analisis_inmobiliario_madrid_datos.py
+
+Uso:
+
+    from instrumentacion import tramo, empezar, terminar
+
+    with tramo('cruce', entrada = listings) as t:          # en módulos
+        df = pd.merge(...)
+        t.salida(df)
+
+    empezar('carga_listings')                              # en los scripts, sin reindentar el código
+    listings = pd.read_csv(...)
+    terminar('carga_listings', salida = listings)
+"""
+
+import atexit
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+VARIABLE_ENTORNO = 'INSTRUMENTACION'
+
+CARPETA_INFORMES = 'informes'
+
+INTERVALO_MUESTREO = 0.01
+
+_PAGINA_MB = os.sysconf('SC_PAGE_SIZE') / 1024 ** 2 if hasattr(os, 'sysconf') else None
+
+
+def rss_mb():
+    """RSS actual del proceso en MB (en sistemas sin /proc, el pico de RSS)."""
+
+    try:
+        with open('/proc/self/statm') as fichero:
+            return int(fichero.read().split()[1]) * _PAGINA_MB
+    except (OSError, TypeError):
+        import resource
+
+        # En Linux ru_maxrss viene en KB, en macOS en bytes
+
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 1024 ** 2 if sys.platform == 'darwin' else pico / 1024
+
+
+def _filas(objeto):
+    if objeto is None:
+        return None
+    if isinstance(objeto, int):
+        return objeto
+    return len(objeto) if hasattr(objeto, '__len__') else None
+
+
+class Tramo:
+    """Un paso medido. Se usa como context manager o con empezar() / terminar()."""
+
+    def __init__(self, informe, nombre, entrada = None):
+        self.informe = informe
+        self.nombre = nombre
+        self.filas_entrada = _filas(entrada)
+        self.filas_salida = None
+
+    def salida(self, objeto):
+        """Filas de salida del tramo (un DataFrame o un número)."""
+
+        self.filas_salida = _filas(objeto)
+
+    def __enter__(self):
+        self.informe._abrir(self)
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        self.informe._cerrar(self, error)
+
+    def resultado(self):
+        return {'nombre': self.nombre, 'ruta': self.ruta, 'nivel': self.nivel, 'inicio': round(self.inicio, 4),
+                'segundos': round(self.segundos, 4), 'cpu': round(self.cpu, 4),
+                'rss_inicio_mb': round(self.rss_inicio, 1), 'rss_fin_mb': round(self.rss_fin, 1),
+                'incremento_pico_mb': round(self.rss_pico - self.rss_inicio, 1),
+                'filas_entrada': self.filas_entrada, 'filas_salida': self.filas_salida, 'error': self.error}
+
+
+class _TramoNulo:
+    # Lo que devuelve tramo() con la instrumentación desactivada: no mide nada
+
+    def salida(self, objeto):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        pass
+
+
+_NULO = _TramoNulo()
+
+
+class Informe:
+    """Tramos de una ejecución y el hilo que muestrea la RSS mientras hay alguno abierto."""
+
+    def __init__(self, carpeta = CARPETA_INFORMES, script = None):
+        self.carpeta = carpeta
+        self.script = script or os.path.splitext(os.path.basename(sys.argv[0] or 'interactivo'))[0] or 'interactivo'
+        self.tramos = []
+        self.abiertos = []
+        self.inicio = time.time()
+        self._reloj = time.perf_counter()
+        self._cerrojo = threading.Lock()
+        self._hay_abiertos = threading.Event()
+        threading.Thread(target = self._muestrear, daemon = True).start()
+
+    def _muestrear(self):
+        while True:
+            self._hay_abiertos.wait()
+            rss = rss_mb()
+            with self._cerrojo:
+                for tramo in self.abiertos:
+                    tramo.rss_pico = max(tramo.rss_pico, rss)
+            time.sleep(INTERVALO_MUESTREO)
+
+    def _abrir(self, tramo):
+        with self._cerrojo:
+            tramo.nivel = len(self.abiertos)
+            tramo.ruta = '/'.join([abierto.nombre for abierto in self.abiertos] + [tramo.nombre])
+            tramo.error = None
+            tramo.rss_inicio = tramo.rss_pico = rss_mb()
+            tramo.inicio = time.perf_counter() - self._reloj
+            tramo._cpu = time.process_time()
+            self.abiertos.append(tramo)
+            self.tramos.append(tramo)
+        self._hay_abiertos.set()
+
+    def _cerrar(self, tramo, error = None):
+        segundos = time.perf_counter() - self._reloj - tramo.inicio
+        cpu = time.process_time() - tramo._cpu
+        with self._cerrojo:
+            tramo.segundos, tramo.cpu = segundos, cpu
+            tramo.rss_fin = rss_mb()
+            tramo.rss_pico = max(tramo.rss_pico, tramo.rss_fin)
+            tramo.error = error if error is None or isinstance(error, str) else repr(error)
+            self.abiertos.remove(tramo)
+            if not self.abiertos:
+                self._hay_abiertos.clear()
+
+    def resumen(self):
+        # Los tramos que sigan abiertos (el script ha fallado o no se ha llamado a terminar) se cierran al escribir
+
+        for tramo in reversed(list(self.abiertos)):
+            self._cerrar(tramo, 'sin terminar')
+
+        return {'script': self.script, 'argumentos': sys.argv[1:],
+                'inicio': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.inicio)),
+                'segundos': round(time.perf_counter() - self._reloj, 4),
+                'rss_fin_mb': round(rss_mb(), 1),
+                'entorno': {'python': platform.python_version(), 'plataforma': platform.platform(),
+                            'cpus': os.cpu_count(), 'pid': os.getpid(),
+                            **{modulo: getattr(sys.modules[modulo], '__version__', None)
+                               for modulo in ('numpy', 'pandas', 'sqlalchemy') if modulo in sys.modules}},
+                'tramos': [tramo.resultado() for tramo in self.tramos]}
+
+    def escribir(self, ruta = None):
+        """Escribe el informe JSON y devuelve su ruta."""
+
+        if ruta is None:
+            os.makedirs(self.carpeta, exist_ok = True)
+            fecha = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.inicio))
+            ruta = os.path.join(self.carpeta, f'{self.script}_{fecha}_{os.getpid()}.json')
+
+        with open(ruta, 'w', encoding = 'utf-8') as fichero:
+            json.dump(self.resumen(), fichero, ensure_ascii = False, indent = 2)
+
+        return ruta
+
+
+_INFORME = None
+
+
+def activar(carpeta = CARPETA_INFORMES, script = None):
+    """Activa la instrumentación en este proceso; el informe se escribe en carpeta al terminar."""
+
+    global _INFORME
+
+    if _INFORME is None:
+        _INFORME = Informe(carpeta, script)
+        atexit.register(_INFORME.escribir)
+
+    return _INFORME
+
+
+def activa():
+    return _INFORME is not None
+
+
+def tramo(nombre, entrada = None):
+    """Context manager que mide el tramo (o no hace nada si la instrumentación está desactivada)."""
+
+    if _INFORME is None:
+        return _NULO
+
+    return Tramo(_INFORME, nombre, entrada)
+
+
+def empezar(nombre, entrada = None):
+    """Abre un tramo que se cierra con terminar(nombre). Para los scripts, donde un with obligaría a reindentar."""
+
+    if _INFORME is None:
+        return _NULO
+
+    return tramo(nombre, entrada).__enter__()
+
+
+def terminar(nombre = None, salida = None):
+    """Cierra el tramo abierto con ese nombre (o el último abierto) y los que se hubieran abierto dentro de él."""
+
+    if _INFORME is None or not _INFORME.abiertos:
+        return
+
+    posicion = len(_INFORME.abiertos) - 1
+    if nombre is not None:
+        nombres = [abierto.nombre for abierto in _INFORME.abiertos]
+        if nombre not in nombres:
+            return
+        posicion = len(nombres) - 1 - nombres[::-1].index(nombre)
+
+    cerrado = _INFORME.abiertos[posicion]
+    for abierto in reversed(_INFORME.abiertos[posicion + 1:]):
+        _INFORME._cerrar(abierto)
+
+    if salida is not None:
+        cerrado.salida(salida)
+    _INFORME._cerrar(cerrado)
+
+
+if os.environ.get(VARIABLE_ENTORNO, '').strip() not in ('', '0'):
+    _valor = os.environ[VARIABLE_ENTORNO].strip()
+    activar(CARPETA_INFORMES if _valor.lower() in ('1', 'true', 'si', 'sí') else _valor)
@@ -0,0 +1,54 @@
+"""TABLAS DE KPIs DEL DATAMART
+
+Los KPIs de palancas que miramos en el script de insights (precio_total, precio_compra y ocupacion) en total, por
+distrito, por barrio y por tipo de alquiler, en una tabla larga: una fila por nivel y grupo con el número de inmuebles
+y la mediana y la media de cada métrica.
+
+Se calculan con el cubo (cubo.py) de una pasada. Al llevar la ciudad y la descarga en columnas, las tablas de varias
+particiones se pueden concatenar (pipeline.py) y comparar entre ciudades y en el tiempo.
+"""
+
+import pandas as pd
+
+from cubo import TOTAL, construir_cubo, nombre_agrupamiento
+
+METRICAS_KPI = ['precio_total', 'precio_compra', 'ocupacion']
+
+AGREGACIONES_KPI = ['count', 'median', 'mean']
+
+AGRUPAMIENTOS_KPI = [(), ('distrito',), ('distrito', 'neighbourhood'), ('room_type',)]
+
+
+def calcular_kpis(df, ciudad = None, descarga = None, metricas = METRICAS_KPI, agrupamientos = AGRUPAMIENTOS_KPI):
+    """Tabla larga de KPIs: nivel, grupo (el valor del último nivel), inmuebles y metrica_median / metrica_mean."""
+
+    metricas = [metrica for metrica in metricas if metrica in df.columns]
+    agrupamientos = [a for a in agrupamientos if all(dimension in df.columns for dimension in a)]
+
+    cubo = construir_cubo(df, metricas = metricas, agregaciones = AGREGACIONES_KPI, agrupamientos = agrupamientos)
+
+    partes = []
+    for agrupamiento in agrupamientos:
+        tabla = cubo[agrupamiento]
+
+        parte = pd.DataFrame({'nivel': nombre_agrupamiento(agrupamiento[-1:]),
+                              'grupo': tabla.index.get_level_values(-1).astype(str) if agrupamiento else TOTAL,
+                              'inmuebles': tabla[metricas[0] + '_count'].to_numpy()})
+
+        if len(agrupamiento) > 1:
+            parte['padre'] = tabla.index.get_level_values(-2).astype(str)
+
+        for metrica in metricas:
+            parte[metrica + '_mediana'] = tabla[metrica + '_median'].to_numpy()
+            parte[metrica + '_media'] = tabla[metrica + '_mean'].to_numpy()
+
+        partes.append(parte)
+
+    kpis = pd.concat(partes, ignore_index = True)
+
+    if descarga is not None:
+        kpis.insert(0, 'descarga', descarga)
+    if ciudad is not None:
+        kpis.insert(0, 'ciudad', ciudad)
+
+    return kpis
@@ -0,0 +1,151 @@
+"""LIMPIEZA Y CONSTRUCCIÓN DEL DATAMART (df)
+
+Los pasos de calidad de datos y creación del datamart como funciones que se pueden aplicar a cualquier subconjunto de
+inmuebles. El script de datos las llama paso a paso (con sus análisis entre medias), y el modo incremental
+(incremental.py) y las etapas (etapas.py) las usan para reprocesar solo lo que ha cambiado. Los criterios (variables a
+eliminar, filtros, imputaciones, cruce con el precio del m2) solo están aquí.
+"""
+
+import pandas as pd
+
+from motor_variables import MOTOR
+
+# Variables de listings que no necesitamos
+
+A_ELIMINAR = ['host_name',
+              'number_of_reviews',
+              'last_review',
+              'reviews_per_month',
+              'number_of_reviews_ltm',
+              'license'
+             ]
+
+# Variables de listings_det que sí nos aportan (bathrooms se elimina después porque está totalmente a nulos)
+
+A_INCLUIR = ['id',
+             'description',
+             'host_is_superhost',
+             'accommodates',
+             'bathrooms',
+             'bedrooms',
+             'beds',
+             'number_of_reviews',
+             'review_scores_rating',
+             'review_scores_communication',
+             'review_scores_location'
+            ]
+
+CATEGORICAS = ['neighbourhood_group', 'neighbourhood', 'room_type']
+
+# Nuestra empresa no compra hoteles, y por debajo de 20 euros la noche es difícil obtener rentabilidad
+
+TIPOS_EXCLUIDOS = ['Hotel room']
+PRECIO_MINIMO = 19
+
+# Literales de distrito de idealista que no coinciden con los de Airbnb
+
+MAPA_DISTRITOS = {'Fuencarral': 'Fuencarral - El Pardo',
+                  'Moncloa': 'Moncloa - Aravaca',
+                  'San Blas': 'San Blas - Canillejas'}
+
+
+def leer_listings(ruta = 'DatosCaso1/listings.csv'):
+    return pd.read_csv(ruta)
+
+
+def leer_precio_m2(ruta = 'DatosCaso1/precios_idealista.csv'):
+    """Precio del m2 por distrito de idealista: quitamos el primer registro (el total de Madrid) y limpiamos el precio."""
+
+    precio_m2 = pd.read_csv(ruta) \
+        .loc[1:, ['table__cell', 'icon-elbow']] \
+        .rename(columns = {'table__cell': 'precio_m2', 'icon-elbow': 'distrito'})
+
+    precio_m2['precio_m2'] = precio_m2.precio_m2.str.split(expand = True)[0].str.replace('.', '', regex = False).astype('int')
+
+    return precio_m2
+
+
+def preparar_precio_m2(precio_m2, mapa_distritos = MAPA_DISTRITOS):
+    precio_m2 = precio_m2.copy()
+    precio_m2['distrito'] = precio_m2.distrito.map(mapa_distritos).fillna(precio_m2.distrito)
+    return precio_m2
+
+
+def quitar_variables(listings):
+    """Sin las variables de A_ELIMINAR y con las de CATEGORICAS como categóricas."""
+
+    listings = listings.drop(columns = A_ELIMINAR + ['index'], errors = 'ignore')
+
+    for variable in CATEGORICAS:
+        listings[variable] = listings[variable].astype('category')
+
+    return listings
+
+
+def excluir_tipos(listings, tipos_excluidos = TIPOS_EXCLUIDOS):
+    return listings.loc[~listings.room_type.isin(tipos_excluidos)]
+
+
+def filtrar_precio(listings, precio_minimo = PRECIO_MINIMO):
+    return listings.loc[listings.price > precio_minimo]
+
+
+def limpiar_listings(listings, tipos_excluidos = TIPOS_EXCLUIDOS, precio_minimo = PRECIO_MINIMO):
+    return filtrar_precio(excluir_tipos(quitar_variables(listings), tipos_excluidos), precio_minimo)
+
+
+def imputar_beds(listings_det, **parametros):
+    # Una o dos personas se suelen corresponder con una cama, tres o cuatro con dos, cinco o seis con tres, y más con cuatro
+
+    return MOTOR.calcular(listings_det, 'beds_imputadas', **parametros)
+
+
+def imputar_bedrooms(listings_det, **parametros):
+    # Cero, una o dos camas se suelen corresponder con una habitación, tres o cuatro con dos, cinco o seis con tres, y más con cuatro
+
+    return MOTOR.calcular(listings_det, 'bedrooms_imputadas', **parametros)
+
+
+def seleccionar_det(listings_det):
+    """Solo las variables de A_INCLUIR, con host_is_superhost como categórica (de la base de datos vuelve como texto)."""
+
+    listings_det = listings_det.loc[:, A_INCLUIR].copy()
+    listings_det['host_is_superhost'] = listings_det['host_is_superhost'].astype('category')
+
+    return listings_det
+
+
+def quitar_vacias(listings_det):
+    # bathrooms está totalmente a nulos
+
+    return listings_det.drop(columns = 'bathrooms')
+
+
+def limpiar_listings_det(listings_det, **parametros):
+    """Columnas de A_INCLUIR con camas y habitaciones imputadas (imputacion_cortes / imputacion_valores del motor)."""
+
+    listings_det = seleccionar_det(listings_det)
+
+    # bedrooms se imputa a partir de las camas ya imputadas
+
+    listings_det['beds'] = imputar_beds(listings_det, **parametros)
+    listings_det['bedrooms'] = imputar_bedrooms(listings_det, **parametros)
+
+    return quitar_vacias(listings_det)
+
+
+def construir_df(listings, listings_det, precio_m2):
+    """Cruza listings (manda) con su detalle por id y con el precio del m2 por distrito.
+
+    Las categóricas se quedan solo con las categorías que siguen apareciendo tras los filtros: si no, el room_type
+    excluido (Hotel room) llega a la caché de df y sale como un grupo vacío en cada groupby.
+    """
+
+    df = pd.merge(left = listings, right = listings_det, how = 'left', on = 'id')
+    df = pd.merge(left = df, right = precio_m2, how = 'left', left_on = 'neighbourhood_group', right_on = 'distrito')
+
+    for variable in df.columns:
+        if isinstance(df[variable].dtype, pd.CategoricalDtype):
+            df[variable] = df[variable].cat.remove_unused_categories()
+
+    return df
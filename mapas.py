@@ -0,0 +1,155 @@
+"""MAPAS DE INMUEBLES CON FOLIUM SIN UN MARCADOR POR FILA
+
+En insights el mapa se construía recorriendo los inmuebles con iterrows y añadiendo un folium.CircleMarker por piso.
+Cada marcador es un objeto de Python y un bloque de JavaScript propio en el HTML: solo San Blas ya son ~470 KB
+(mapa_circular_optimizado.html) y con toda la ciudad (más de 17.000 inmuebles) la página pesa varios MB y apenas se mueve.
+
+Aquí todos los puntos van en una sola capa:
+
+- los datos se incrustan una vez, por columnas (latitudes, longitudes, índice de color y valor), redondeados
+- en el navegador se dibujan con el renderer canvas de Leaflet (un único canvas en vez de un elemento SVG por punto),
+  o agrupados en clusters (agrupar = True) con Leaflet.markercluster
+- el color de cada punto es su cuartil (o los cuantiles que se pidan) de la métrica, calculado con numpy
+- el popup se crea al hacer clic, no uno por punto
+
+No hay ningún bucle en Python sobre las filas.
+
+Uso:
+
+    from mapas import mapa_inmuebles
+    mapa = mapa_inmuebles(df, 'precio_total')
+    mapa.save('DatosCaso1/mapa_madrid.html')
+"""
+
+import json
+import sys
+import time
+
+import numpy as np
+import folium
+from branca.element import MacroElement
+from folium.plugins import FastMarkerCluster
+from jinja2 import Template
+
+# Puerta del Sol
+
+CENTRO = (40.4167278, -3.7033387)
+
+CUANTILES = (0, .25, .5, .75, 1)
+
+COLORES = ('yellow', 'orange', 'blue', 'red')
+
+DECIMALES_COORDENADAS = 5
+
+
+class CapaPuntos(MacroElement):
+    """Capa de Leaflet con todos los puntos en canvas a partir de arrays por columnas."""
+
+    _template = Template('''
+        {% macro script(this, kwargs) %}
+        (function() {
+            var datos = {{ this.datos }};
+            var colores = {{ this.colores }};
+            var renderer = L.canvas({padding: 0.5});
+            var capa = L.featureGroup();
+
+            for (var i = 0; i < datos.lat.length; i++) {
+                var color = colores[datos.color[i]];
+                L.circleMarker([datos.lat[i], datos.lon[i]], {
+                    renderer: renderer, radius: {{ this.radio }}, stroke: false,
+                    fillColor: color, fillOpacity: {{ this.opacidad }}, valor: datos.valor[i]
+                }).addTo(capa);
+            }
+
+            capa.on('click', function(e) {
+                L.popup().setLatLng(e.latlng).setContent({{ this.etiqueta }} + ': ' + e.layer.options.valor).openOn({{ this._parent.get_name() }});
+            });
+
+            capa.addTo({{ this._parent.get_name() }});
+        })();
+        {% endmacro %}
+    ''')
+
+    def __init__(self, datos, colores, etiqueta, radio = 4, opacidad = 0.9):
+        super().__init__()
+        self._name = 'CapaPuntos'
+        self.datos = json.dumps(datos, separators = (',', ':'))
+        self.colores = json.dumps(list(colores))
+        self.etiqueta = json.dumps(etiqueta)
+        self.radio = radio
+        self.opacidad = opacidad
+
+
+def colores_por_cuantil(valores, cuantiles = CUANTILES):
+    """Índice de color de cada valor según sus cuantiles (como pd.qcut: intervalos cerrados por la derecha) y cortes."""
+
+    valores = np.asarray(valores, dtype = 'float64')
+    cortes = np.nanquantile(valores, cuantiles)
+
+    return np.searchsorted(cortes[1:-1], valores, side = 'left'), cortes
+
+
+def mapa_inmuebles(df, metrica = 'precio_total', cuantiles = CUANTILES, colores = COLORES, agrupar = False,
+                   centro = CENTRO, zoom = 12, radio = 4, decimales = 1):
+    """Mapa folium con todos los inmuebles de df coloreados por cuantil de la métrica.
+
+    agrupar = True agrupa los puntos en clusters en el navegador (mejor para ver densidad a poco zoom).
+    """
+
+    if len(colores) != len(cuantiles) - 1:
+        raise ValueError('Tiene que haber un color por cada intervalo entre cuantiles')
+
+    datos = df.loc[df[metrica].notna() & df.latitude.notna() & df.longitude.notna(), ['latitude', 'longitude', metrica]]
+    indices, cortes = colores_por_cuantil(datos[metrica], cuantiles)
+
+    latitudes = np.round(datos.latitude.to_numpy(dtype = 'float64'), DECIMALES_COORDENADAS)
+    longitudes = np.round(datos.longitude.to_numpy(dtype = 'float64'), DECIMALES_COORDENADAS)
+    valores = np.round(datos[metrica].to_numpy(dtype = 'float64'), decimales)
+
+    mapa = folium.Map(location = list(centro), zoom_start = zoom, prefer_canvas = True)
+
+    if agrupar:
+        # FastMarkerCluster recibe los datos como una lista y crea los marcadores en JavaScript con el callback
+
+        callback = ('function (fila) {'
+                    f'  var colores = {json.dumps(list(colores))};'
+                    f'  return L.circleMarker(new L.LatLng(fila[0], fila[1]), {{radius: {radio}, stroke: false,'
+                    '     fillColor: colores[fila[2]], fillOpacity: 0.9})'
+                    f'    .bindPopup({json.dumps(metrica)} + ": " + fila[3]);'
+                    '}')
+        filas = np.column_stack([latitudes, longitudes, indices, valores]).tolist()
+        FastMarkerCluster(filas, callback = callback).add_to(mapa)
+    else:
+        CapaPuntos({'lat': latitudes.tolist(), 'lon': longitudes.tolist(), 'color': indices.tolist(),
+                    'valor': valores.tolist()},
+                   colores, metrica, radio = radio).add_to(mapa)
+
+    # Leyenda con los cortes de cada color
+
+    leyenda = ''.join(f'<div><span style="background:{color};width:12px;height:12px;display:inline-block"></span> '
+                      f'{desde:,.{decimales}f} - {hasta:,.{decimales}f}</div>'
+                      for color, desde, hasta in zip(colores, cortes[:-1], cortes[1:]))
+    mapa.get_root().html.add_child(folium.Element(
+        '<div style="position:fixed;bottom:20px;left:20px;z-index:1000;background:white;padding:6px;font-size:12px">'
+        f'<b>{metrica}</b>{leyenda}</div>'))
+
+    return mapa
+
+
+if __name__ == '__main__':
+    import os
+    import sqlalchemy as sa
+
+    from cache_columnar import leer_tabla
+
+    ruta = sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/airbnb.db'
+    df = leer_tabla('df_preparado', sa.create_engine(f'sqlite:///{ruta}'),
+                    columnas = ['latitude', 'longitude', 'precio_total'])
+
+    # Los mapas se guardan junto a la base de datos de la que salen
+
+    for agrupar, nombre in [(False, 'mapa_madrid.html'), (True, 'mapa_madrid_clusters.html')]:
+        salida = os.path.join(os.path.dirname(ruta), nombre)
+        inicio = time.perf_counter()
+        mapa_inmuebles(df, agrupar = agrupar).save(salida)
+        print(f'{salida}: {len(df)} inmuebles, {time.perf_counter() - inicio:.2f} s, {os.path.getsize(salida) / 1024:.0f} KB')
@@ -0,0 +1,290 @@
+"""MOTOR ALTERNATIVO CON DUCKDB SOBRE LOS CSV.GZ O PARQUET
+
+Para responder las preguntas semilla de una descarga nueva hoy hay que ejecutar el script de datos entero y
+materializar las tablas en SQLite antes de poder agrupar nada.
+
+Aquí lo hacemos todo en SQL dentro de una DuckDB embebida (en memoria, multihilo), leyendo directamente los ficheros
+de la descarga (listings.csv, listings.csv.gz y precios_idealista.csv, o su versión Parquet si existe):
+
+- limpieza de listings: sin hoteles (tipos_excluidos) y price > precio_minimo
+- detalle: las columnas de A_INCLUIR con camas imputadas a partir de las personas y habitaciones a partir de las camas
+  (los mismos tramos del motor de variables)
+- precio del m2 de idealista sin la fila de Madrid y con los distritos renombrados (MAPA_DISTRITOS)
+- cruce por id con el detalle y por distrito con el precio del m2
+- precio_total, ocupacion, m2 y precio_compra con las fórmulas del motor de variables
+- KPIs: inmuebles, mediana y media de precio_total, precio_compra y ocupacion en total, por distrito, por barrio y por
+  tipo de alquiler, de una pasada con GROUPING SETS y con el mismo formato que kpis.py
+
+Los parámetros de negocio son los mismos (y con los mismos valores por defecto) que los de limpieza.py y
+motor_variables.py. comparar_con_pandas() ejecuta los dos caminos sobre la misma descarga y devuelve las diferencias,
+y python motor_duckdb.py termina con error si algún grupo falta en uno de los dos o difiere en más de TOLERANCIA.
+
+Necesita duckdb (pip install duckdb). El resto del proyecto no.
+
+Uso:
+
+    from motor_duckdb import kpis_duckdb
+    kpis = kpis_duckdb('DatosCaso1', hilos = 8)
+
+    python motor_duckdb.py DatosCaso1                 # KPIs y comparación con el camino de pandas
+    python motor_duckdb.py DatosCaso1 --parquet       # antes convierte los CSV a Parquet
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from cubo import TOTAL
+from limpieza import A_ELIMINAR, A_INCLUIR, MAPA_DISTRITOS, PRECIO_MINIMO, TIPOS_EXCLUIDOS
+from motor_variables import PARAMETROS as PARAMETROS_MOTOR
+
+PARAMETROS = {
+    'tipos_excluidos': TIPOS_EXCLUIDOS,
+    'precio_minimo': PRECIO_MINIMO,
+    'mapa_distritos': MAPA_DISTRITOS,
+    **PARAMETROS_MOTOR,
+}
+
+FICHEROS = {'listings': 'listings.csv', 'listings_det': 'listings.csv.gz', 'precio_m2': 'precios_idealista.csv'}
+
+METRICAS = ['precio_total', 'precio_compra', 'ocupacion']
+
+# Diferencia relativa máxima admitida entre los dos caminos (el orden de las sumas cambia la media en ~1e-15)
+
+TOLERANCIA = 1e-9
+
+# Tipos de las columnas que usamos del detalle (el resto del fichero no se llega a convertir)
+
+TIPOS_DETALLE = {'id': 'BIGINT', 'description': 'VARCHAR', 'host_is_superhost': 'VARCHAR', 'accommodates': 'INTEGER',
+                 'bathrooms': 'DOUBLE', 'bedrooms': 'INTEGER', 'beds': 'INTEGER', 'number_of_reviews': 'INTEGER',
+                 'review_scores_rating': 'DOUBLE', 'review_scores_communication': 'DOUBLE',
+                 'review_scores_location': 'DOUBLE'}
+
+
+def conectar(hilos = None):
+    """DuckDB en memoria con hilos threads (por defecto todos los núcleos)."""
+
+    con = duckdb.connect()
+    if hilos:
+        con.execute(f'SET threads = {int(hilos)}')
+    return con
+
+
+def _fuente(carpeta, nombre, opciones = ''):
+    # Parquet si existe <nombre>.parquet, y si no el CSV (DuckDB descomprime el .gz al leer)
+
+    parquet = os.path.join(carpeta, nombre + '.parquet')
+    if os.path.exists(parquet):
+        return f"read_parquet('{parquet}')"
+
+    return f"read_csv('{os.path.join(carpeta, FICHEROS[nombre])}', header = true{opciones})"
+
+
+def convertir_a_parquet(carpeta, con = None):
+    """Escribe <carpeta>/<tabla>.parquet de los tres ficheros (comprimido con zstd) y devuelve sus rutas."""
+
+    con = con or conectar()
+    rutas = []
+    for nombre in FICHEROS:
+        ruta = os.path.join(carpeta, nombre + '.parquet')
+        opciones = f', types = {TIPOS_DETALLE}' if nombre == 'listings_det' else ''
+        con.execute(f"COPY (SELECT * FROM {_fuente(carpeta, nombre, opciones)}) TO '{ruta}' "
+                    "(FORMAT PARQUET, COMPRESSION ZSTD)")
+        rutas.append(ruta)
+
+    return rutas
+
+
+def _literales(valores):
+    # Las vistas no admiten parámetros preparados: los textos van entre comillas simples y escapados
+
+    return ', '.join("'" + str(valor).replace("'", "''") + "'" for valor in valores) or 'NULL'
+
+
+def _por_tramos(columna, cortes, valores):
+    # Igual que _por_tramos del motor: hasta cortes[0] -> valores[0], ..., por encima del último el último valor
+
+    casos = ' '.join(f'WHEN {columna} <= {float(corte)!r} THEN {float(valor)!r}' for corte, valor in zip(cortes, valores))
+    return f'CASE WHEN {columna} IS NULL THEN NULL {casos} ELSE {float(valores[-1])!r} END'
+
+
+def _por_valor(columna, tabla, defecto):
+    # Igual que _por_valor del motor: valor exacto de la tabla, y el último también para los mayores
+
+    claves = sorted(tabla)
+    casos = [f'WHEN {columna} = {float(clave)!r} THEN {tabla[clave]!r}' for clave in claves[:-1]]
+    casos.append(f'WHEN {columna} >= {float(claves[-1])!r} THEN {tabla[claves[-1]]!r}')
+    return f'CASE {" ".join(casos)} ELSE {defecto!r} END'
+
+
+def crear_df(con, carpeta, **parametros):
+    """Crea en con la vista df: listings limpios cruzados con su detalle y el precio del m2, con precio_total,
+    ocupacion, m2 y precio_compra."""
+
+    p = {**PARAMETROS, **parametros}
+
+    con.execute(f'''
+        CREATE OR REPLACE VIEW listings AS
+        SELECT * EXCLUDE ({", ".join(c for c in A_ELIMINAR)})
+        FROM {_fuente(carpeta, 'listings')}
+        WHERE room_type NOT IN ({_literales(p['tipos_excluidos'])}) AND price > {float(p['precio_minimo'])!r}
+    ''')
+
+    beds = _por_tramos('accommodates', p['imputacion_cortes'], p['imputacion_valores'])
+    con.execute(f'''
+        CREATE OR REPLACE VIEW listings_det AS
+        SELECT * EXCLUDE (beds, bedrooms, bathrooms),
+               beds_imputadas AS beds,
+               coalesce(bedrooms, {_por_tramos('beds_imputadas', p['imputacion_cortes'], p['imputacion_valores'])})
+                   AS bedrooms
+        FROM (
+            SELECT {", ".join(A_INCLUIR)}, coalesce(beds, {beds}) AS beds_imputadas
+            FROM {_fuente(carpeta, 'listings_det', f', types = {TIPOS_DETALLE}')}
+        )
+    ''')
+
+    # Precio del m2: la primera fila es el total de Madrid; '4.600 €/m2' -> 4600
+
+    mapa = pd.DataFrame({'origen': list(p['mapa_distritos']), 'destino': list(p['mapa_distritos'].values())})
+    con.register('mapa_distritos', mapa)
+    con.execute(f'''
+        CREATE OR REPLACE VIEW precio_m2 AS
+        SELECT CAST(replace(split_part(table__cell, ' ', 1), '.', '') AS INTEGER) AS precio_m2,
+               coalesce(mapa_distritos.destino, "icon-elbow") AS distrito
+        FROM (SELECT *, row_number() OVER () AS fila FROM {_fuente(carpeta, 'precio_m2')})
+        LEFT JOIN mapa_distritos ON "icon-elbow" = mapa_distritos.origen
+        WHERE fila > 1
+    ''')
+
+    con.execute(f'''
+        CREATE OR REPLACE VIEW df AS
+        SELECT *,
+               CASE WHEN beds > 1 AND room_type IN ({_literales(p['tipos_por_habitacion'])})
+                    THEN price * beds * {float(p['factor_habitaciones'])!r} ELSE price END AS precio_total,
+               CAST(trunc((365 - availability_365) / 365 * 100) AS INTEGER) AS ocupacion,
+               m2 * precio_m2 * {float(p['factor_compra'])!r} AS precio_compra
+        FROM (
+            SELECT listings.*, listings_det.* EXCLUDE (id), precio_m2.*,
+                   {_por_valor('listings_det.bedrooms', p['m2_por_habitaciones'], -999)} AS m2
+            FROM listings
+            LEFT JOIN listings_det USING (id)
+            LEFT JOIN precio_m2 ON listings.neighbourhood_group = precio_m2.distrito
+        )
+    ''')
+
+    return con
+
+
+def calcular_kpis_sql(con, metricas = METRICAS):
+    """KPIs de la vista df con el formato de kpis.calcular_kpis (nivel, grupo, inmuebles, padre, metrica_mediana,
+    metrica_media), con GROUPING SETS en una sola consulta."""
+
+    agregados = ', '.join(f'median({m}) AS {m}_mediana, avg({m}) AS {m}_media' for m in metricas)
+
+    kpis = con.execute(f'''
+        SELECT CASE WHEN grouping(neighbourhood) = 0 THEN 'neighbourhood'
+                    WHEN grouping(distrito) = 0 THEN 'distrito'
+                    WHEN grouping(room_type) = 0 THEN 'room_type'
+                    ELSE '{TOTAL}' END AS nivel,
+               CAST(coalesce(neighbourhood, distrito, room_type, '{TOTAL}') AS VARCHAR) AS grupo,
+               count(*) AS inmuebles,
+               CASE WHEN grouping(neighbourhood) = 0 THEN distrito END AS padre,
+               {agregados}
+        FROM df
+        GROUP BY GROUPING SETS ((), (distrito), (distrito, neighbourhood), (room_type))
+        -- como el cubo, los grupos con la dimensión nula no cuentan
+        HAVING (grouping(distrito) = 1 OR distrito IS NOT NULL)
+           AND (grouping(neighbourhood) = 1 OR neighbourhood IS NOT NULL)
+           AND (grouping(room_type) = 1 OR room_type IS NOT NULL)
+        ORDER BY nivel, padre, grupo
+    ''').df()
+
+    return kpis
+
+
+def kpis_duckdb(carpeta, hilos = None, **parametros):
+    """KPIs de la descarga de carpeta calculados en DuckDB."""
+
+    con = conectar(hilos)
+    crear_df(con, carpeta, **parametros)
+    return calcular_kpis_sql(con)
+
+
+def kpis_pandas(carpeta, **parametros):
+    """Los mismos KPIs por el camino de pandas (limpieza.py, motor de variables y kpis.py)."""
+
+    from kpis import calcular_kpis
+    from ingesta import leer_listings_det
+    from limpieza import (construir_df, leer_listings, leer_precio_m2, limpiar_listings, limpiar_listings_det,
+                          preparar_precio_m2)
+    from motor_variables import MOTOR
+
+    p = {**PARAMETROS, **parametros}
+    motor = {clave: valor for clave, valor in p.items() if clave in PARAMETROS_MOTOR}
+
+    listings = leer_listings(os.path.join(carpeta, FICHEROS['listings']))
+    listings_det = leer_listings_det(os.path.join(carpeta, FICHEROS['listings_det']))
+    precio_m2 = preparar_precio_m2(leer_precio_m2(os.path.join(carpeta, FICHEROS['precio_m2'])), p['mapa_distritos'])
+
+    df = construir_df(limpiar_listings(listings, p['tipos_excluidos'], p['precio_minimo']),
+                      limpiar_listings_det(listings_det, **motor), precio_m2)
+    df = df.join(MOTOR.calcular(df, METRICAS, **motor))
+
+    return calcular_kpis(df, metricas = METRICAS)
+
+
+def comparar_con_pandas(carpeta, hilos = None, **parametros):
+    """KPIs de los dos caminos cruzados por nivel y grupo, con la diferencia relativa máxima de cada fila (infinita si
+    el grupo falta en uno de los dos o un KPI es nulo solo en uno)."""
+
+    duck = kpis_duckdb(carpeta, hilos, **parametros)
+    pandas = kpis_pandas(carpeta, **parametros)
+
+    clave = ['nivel', 'grupo']
+    pandas = pandas.assign(padre = pandas.get('padre'))
+    comparacion = pandas.merge(duck, on = clave, how = 'outer', suffixes = ('_pandas', '_duckdb'), indicator = True)
+
+    columnas = ['inmuebles'] + [f'{m}_{a}' for m in METRICAS for a in ('mediana', 'media')]
+    diferencias = []
+    for c in columnas:
+        duck, pandas = comparacion[c + '_duckdb'].astype('float64'), comparacion[c + '_pandas'].astype('float64')
+        diferencia = (duck - pandas).abs() / pandas.abs().clip(lower = 1e-9)
+        diferencias.append(diferencia.mask(duck.isna() != pandas.isna(), np.inf).fillna(0))
+
+    comparacion['diferencia'] = np.column_stack(diferencias).max(axis = 1)
+    comparacion.loc[comparacion._merge != 'both', 'diferencia'] = np.inf
+
+    return comparacion
+
+
+if __name__ == '__main__':
+    argumentos = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    argumentos.add_argument('carpeta', nargs = '?', default = 'DatosCaso1')
+    argumentos.add_argument('--hilos', type = int, default = None)
+    argumentos.add_argument('--parquet', action = 'store_true', help = 'convierte antes los ficheros a Parquet')
+    argumentos = argumentos.parse_args()
+
+    if argumentos.parquet:
+        inicio = time.perf_counter()
+        convertir_a_parquet(argumentos.carpeta)
+        print(f'Parquet: {time.perf_counter() - inicio:.2f} s')
+
+    inicio = time.perf_counter()
+    kpis = kpis_duckdb(argumentos.carpeta, argumentos.hilos)
+    print(f'DuckDB: {time.perf_counter() - inicio:.2f} s')
+    print(kpis.loc[kpis.nivel.isin([TOTAL, 'distrito'])].round(1).to_string(index = False))
+
+    inicio = time.perf_counter()
+    comparacion = comparar_con_pandas(argumentos.carpeta, argumentos.hilos)
+    print(f'\nComparación con pandas ({time.perf_counter() - inicio:.2f} s): {len(comparacion)} grupos, '
+          f'diferencia relativa máxima {comparacion.diferencia.max():.2e}')
+
+    distintos = comparacion.loc[comparacion.diferencia > TOLERANCIA]
+    if not distintos.empty:
+        print(distintos[['nivel', 'grupo', '_merge', 'diferencia']].to_string(index = False))
+        sys.exit(f'{len(distintos)} grupos con diferencias por encima de {TOLERANCIA:g} o que faltan en uno de los caminos')
@@ -0,0 +1,347 @@
+"""ESCRITURA MASIVA EN SQLITE
+
+Cada etapa guardaba sus tablas con DataFrame.to_sql(..., if_exists = 'replace'). Por defecto eso inserta fila a fila,
+guarda el índice de pandas como una columna más ('index') y no crea ningún índice sobre id, distrito o neighbourhood,
+que son justo las claves por las que luego cruzamos y agrupamos.
+
+Aquí tenemos una alternativa que escribe directamente con sqlite3:
+
+- tipos de columna explícitos (INTEGER, REAL, TEXT) a partir de los dtypes de pandas
+- inserción por lotes con executemany dentro de una única transacción
+- pragmas ajustados para carga masiva (WAL, synchronous = NORMAL, page_size, caché)
+- índices secundarios sobre las claves de agrupación que existan en la tabla (único sobre id si no hay repetidos), y
+  unos pocos índices compuestos fijos (agrupación, filtro, métrica) en df_preparado para las consultas de KPIs
+- upsert por clave (reemplazar_filas) y UPDATE de algunas columnas por clave (actualizar_columnas) para la
+  reconstrucción incremental
+- una versión por tabla en _versiones, que usan las cachés para saber si están al día
+
+Uso:
+
+    from persistencia import guardar_tabla
+    guardar_tabla(df, 'df', con)     # con puede ser un engine de SQLAlchemy, una conexión sqlite3 o la ruta del fichero
+
+Para comparar tiempo y tamaño con to_sql: python persistencia.py DatosCaso1/listings.csv.gz
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import closing, contextmanager
+
+import numpy as np
+import pandas as pd
+
+# Claves por las que cruzamos y agrupamos en los scripts. Se indexan las que estén en la tabla.
+
+CLAVES_INDICE = ['id', 'distrito', 'neighbourhood_group', 'neighbourhood', 'room_type']
+
+# Índices compuestos (agrupación, filtro, métrica) para las consultas de KPIs en SQLite (consultas.py): cubren la
+# consulta sin leer las filas y, con el filtro por igualdad, SQLite recorre la métrica ya ordenada dentro de cada grupo.
+# Son fijos y se crean al escribir la tabla: cada índice más encarece guardar_tabla y reemplazar_filas.
+
+INDICES_COMPUESTOS = {
+    'df_preparado': [(agrupacion, 'room_type', metrica)
+                     for agrupacion in ['distrito', 'neighbourhood']
+                     for metrica in ['precio_total', 'ocupacion', 'precio_compra']],
+}
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -64_000,  # en KB cuando es negativo, 64 MB
+}
+
+TAM_PAGINA = 8192
+
+TAM_LOTE = 10_000
+
+
+def ruta_db(con):
+    """Ruta del fichero SQLite a partir de un engine de SQLAlchemy, una conexión sqlite3 o la propia ruta."""
+
+    if isinstance(con, (str, os.PathLike)):
+        return os.fspath(con)
+    if isinstance(con, sqlite3.Connection):
+        return con.execute('PRAGMA database_list').fetchone()[2]
+    return con.url.database
+
+
+def conectar(con):
+    """Conexión sqlite3 con los pragmas de carga masiva aplicados."""
+
+    if isinstance(con, sqlite3.Connection):
+        conexion = con
+    else:
+        # Sin transacciones implícitas: las abrimos y cerramos nosotros
+
+        conexion = sqlite3.connect(ruta_db(con), isolation_level = None)
+
+    # page_size solo tiene efecto en una base de datos nueva (antes de pasar a WAL), en una existente se ignora
+
+    conexion.execute(f'PRAGMA page_size = {TAM_PAGINA}')
+    for pragma, valor in PRAGMAS.items():
+        conexion.execute(f'PRAGMA {pragma} = {valor}')
+
+    return conexion
+
+
+@contextmanager
+def abrir(con):
+    """Conexión sqlite3 para un with: confirma (o deshace) la transacción al salir y, a diferencia de
+    with sqlite3.connect(...), también la cierra."""
+
+    with closing(sqlite3.connect(ruta_db(con))) as conexion, conexion:
+        yield conexion
+
+
+def tipo_sqlite(serie):
+    if pd.api.types.is_bool_dtype(serie) or pd.api.types.is_integer_dtype(serie):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(serie):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _entre_comillas(columna):
+    return f'"{columna}"'
+
+
+def _decimal_corto(valores):
+    """float32 -> float64 con el decimal más corto que vuelve al mismo float32: 4.87 y no 4.869999885559082.
+
+    Es lo que daría pasar por str, pero sin crear un texto por valor: para 1, 2, ... 9 cifras significativas se redondea
+    cada valor al decimal más cercano con esas cifras y se queda el primero que al pasarlo a float32 da el original.
+    """
+
+    resultado = valores.astype('float64')
+    pendientes = np.flatnonzero(np.isfinite(resultado) & (resultado != 0))
+    exponentes = np.floor(np.log10(np.abs(resultado[pendientes])))
+
+    for cifras in range(1, 10):
+        if not len(pendientes):
+            break
+
+        x = resultado[pendientes]
+        decimales = cifras - 1 - exponentes
+        escala = 10.0 ** np.abs(decimales)
+        redondeado = np.where(decimales >= 0, np.round(x * escala) / escala, np.round(x / escala) * escala)
+
+        vale = redondeado.astype('float32') == valores[pendientes]
+        resultado[pendientes[vale]] = redondeado[vale]
+        pendientes, exponentes = pendientes[~vale], exponentes[~vale]
+
+    return resultado
+
+
+def _valores(serie):
+    # Array de objetos Python nativos con None en los nulos, que es lo que entiende sqlite3
+
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype(object)
+    elif pd.api.types.is_datetime64_any_dtype(serie):
+        serie = serie.dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    tipo = tipo_sqlite(serie)
+    nulos = serie.isna().to_numpy()
+
+    if tipo == 'INTEGER' and not nulos.any():
+        valores = serie.to_numpy(dtype = 'int64').astype(object)
+    elif tipo == 'REAL' and serie.dtype == 'float32':
+        # float32 (valoraciones, bathrooms...) a float64 por su representación decimal más corta: 4.87 y no
+        # 4.869999885559082, que es lo que hay en el CSV de origen
+
+        valores = _decimal_corto(serie.to_numpy()).astype(object)
+    elif tipo in ('INTEGER', 'REAL'):
+        # Los enteros con nulos pasan por float, y la afinidad INTEGER de la columna los vuelve a guardar como enteros
+
+        valores = serie.to_numpy(dtype = 'float64', na_value = np.nan).astype(object)
+    else:
+        valores = np.array(serie.to_numpy(dtype = object), dtype = object)
+
+    valores[nulos] = None
+    return valores
+
+
+def guardar_tabla(df, tabla, con, indices = None, compuestos = None, tam_lote = TAM_LOTE):
+    """Reemplaza la tabla con el contenido de df (sin el índice de pandas) e indexa las claves de agrupación.
+
+    indices: columnas a indexar. Por defecto las de CLAVES_INDICE que existan en df.
+    compuestos: tuplas de columnas para índices compuestos. Por defecto los de INDICES_COMPUESTOS de la tabla cuyas
+    columnas existan en df.
+    """
+
+    conexion = conectar(con)
+
+    columnas = list(df.columns)
+    definicion = ', '.join(f'"{columna}" {tipo_sqlite(df[columna])}' for columna in columnas)
+    marcadores = ', '.join('?' * len(columnas))
+
+    if indices is None:
+        indices = [columna for columna in CLAVES_INDICE if columna in df.columns]
+    if compuestos is None:
+        compuestos = [compuesto for compuesto in INDICES_COMPUESTOS.get(tabla, [])
+                      if all(columna in df.columns for columna in compuesto)]
+
+    valores = [_valores(df[columna]) for columna in columnas]
+
+    try:
+        conexion.execute('BEGIN')
+        conexion.execute(f'DROP TABLE IF EXISTS "{tabla}"')
+        conexion.execute(f'CREATE TABLE "{tabla}" ({definicion})')
+
+        for inicio in range(0, len(df), tam_lote):
+            fin = inicio + tam_lote
+            conexion.executemany(f'INSERT INTO "{tabla}" VALUES ({marcadores})',
+                                 zip(*(columna[inicio:fin] for columna in valores)))
+
+        # Los índices al final: crearlos sobre la tabla ya llena es más rápido que mantenerlos en cada inserción
+
+        for columna in indices:
+            unico = 'UNIQUE ' if columna == 'id' and df[columna].is_unique else ''
+            conexion.execute(f'CREATE {unico}INDEX "ix_{tabla}_{columna}" ON "{tabla}" ("{columna}")')
+        for compuesto in compuestos:
+            nombre = '_'.join(['ix', tabla, *compuesto])
+            conexion.execute(f'CREATE INDEX "{nombre}" ON "{tabla}" ({", ".join(map(_entre_comillas, compuesto))})')
+
+        # Sin estadísticas SQLite prefiere el índice de room_type para un filtro por igualdad. Con ellas sabe que hay
+        # pocos distritos y usa el compuesto saltando por la agrupación (skip-scan) y buscando por el filtro.
+
+        if compuestos:
+            conexion.execute(f'ANALYZE "{tabla}"')
+
+        # Apuntamos una versión nueva de la tabla, para que las cachés (cache_columnar.py) sepan si están al día
+
+        conexion.execute('CREATE TABLE IF NOT EXISTS _versiones (tabla TEXT PRIMARY KEY, version TEXT)')
+        conexion.execute('INSERT OR REPLACE INTO _versiones VALUES (?, ?)', (tabla, str(time.time_ns())))
+
+        conexion.execute('COMMIT')
+    except BaseException:
+        conexion.execute('ROLLBACK')
+        raise
+    finally:
+        if conexion is not con:
+            conexion.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conexion.close()
+
+
+def reemplazar_filas(df, tabla, con, borrar = (), clave = 'id', tam_lote = TAM_LOTE):
+    """Upsert por clave: borra las filas de la tabla cuya clave esté en borrar o en df, e inserta las de df.
+
+    Todo en una transacción, y apunta una versión nueva de la tabla para invalidar las cachés.
+    """
+
+    conexion = conectar(con)
+
+    columnas = list(df.columns)
+    nombres = ', '.join(f'"{columna}"' for columna in columnas)
+    marcadores = ', '.join('?' * len(columnas))
+
+    claves = pd.unique(np.concatenate([np.asarray(list(borrar), dtype = 'int64'), df[clave].to_numpy(dtype = 'int64')]))
+    valores = [_valores(df[columna]) for columna in columnas]
+
+    try:
+        conexion.execute('BEGIN')
+
+        # Las claves a borrar van a una tabla temporal, así el DELETE usa el índice de la clave sin un IN gigante
+
+        conexion.execute('CREATE TEMP TABLE IF NOT EXISTS _claves (clave INTEGER PRIMARY KEY)')
+        conexion.execute('DELETE FROM _claves')
+        conexion.executemany('INSERT OR IGNORE INTO _claves VALUES (?)', ((int(c),) for c in claves))
+        conexion.execute(f'DELETE FROM "{tabla}" WHERE "{clave}" IN (SELECT clave FROM _claves)')
+
+        for inicio in range(0, len(df), tam_lote):
+            fin = inicio + tam_lote
+            conexion.executemany(f'INSERT INTO "{tabla}" ({nombres}) VALUES ({marcadores})',
+                                 zip(*(columna[inicio:fin] for columna in valores)))
+
+        conexion.execute('CREATE TABLE IF NOT EXISTS _versiones (tabla TEXT PRIMARY KEY, version TEXT)')
+        conexion.execute('INSERT OR REPLACE INTO _versiones VALUES (?, ?)', (tabla, str(time.time_ns())))
+
+        conexion.execute('COMMIT')
+    except BaseException:
+        conexion.execute('ROLLBACK')
+        raise
+    finally:
+        if conexion is not con:
+            conexion.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conexion.close()
+
+
+def actualizar_columnas(df, tabla, con, clave = 'id', tam_lote = TAM_LOTE):
+    """UPDATE por clave de las columnas de df (salvo la clave) en filas que ya están en la tabla, sin tocar el resto.
+
+    Todo en una transacción, y apunta una versión nueva de la tabla para invalidar las cachés.
+    """
+
+    conexion = conectar(con)
+
+    columnas = [columna for columna in df.columns if columna != clave]
+    asignaciones = ', '.join(f'"{columna}" = ?' for columna in columnas)
+
+    valores = [_valores(df[columna]) for columna in columnas + [clave]]
+
+    try:
+        conexion.execute('BEGIN')
+
+        for inicio in range(0, len(df), tam_lote):
+            fin = inicio + tam_lote
+            conexion.executemany(f'UPDATE "{tabla}" SET {asignaciones} WHERE "{clave}" = ?',
+                                 zip(*(columna[inicio:fin] for columna in valores)))
+
+        conexion.execute('CREATE TABLE IF NOT EXISTS _versiones (tabla TEXT PRIMARY KEY, version TEXT)')
+        conexion.execute('INSERT OR REPLACE INTO _versiones VALUES (?, ?)', (tabla, str(time.time_ns())))
+
+        conexion.execute('COMMIT')
+    except BaseException:
+        conexion.execute('ROLLBACK')
+        raise
+    finally:
+        if conexion is not con:
+            conexion.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conexion.close()
+
+
+def version_tabla(con, tabla):
+    """Versión de la tabla apuntada por guardar_tabla, o None si la tabla no se ha guardado con ella."""
+
+    with abrir(con) as conexion:
+        try:
+            fila = conexion.execute('SELECT version FROM _versiones WHERE tabla = ?', (tabla,)).fetchone()
+        except sqlite3.OperationalError:
+            return None
+
+    return fila[0] if fila else None
+
+
+# COMPARACIÓN CON TO_SQL
+
+def _tamano_mb(ruta):
+    return sum(os.path.getsize(fichero) for fichero in [ruta, ruta + '-wal'] if os.path.exists(fichero)) / 1024 ** 2
+
+
+def comparar(df, tabla = 'listings_det'):
+    """Tiempo de escritura y tamaño del fichero con to_sql por defecto y con guardar_tabla."""
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        # Como en los scripts: to_sql sobre un engine de SQLAlchemy
+
+        import sqlalchemy as sa
+
+        ruta = os.path.join(carpeta, 'to_sql.db')
+        inicio = time.perf_counter()
+        df.to_sql(tabla, con = sa.create_engine(f'sqlite:///{ruta}'), if_exists = 'replace')
+        print(f'to_sql: {time.perf_counter() - inicio:.2f} s, {_tamano_mb(ruta):.1f} MB (sin índices)')
+
+        ruta = os.path.join(carpeta, 'masiva.db')
+        inicio = time.perf_counter()
+        guardar_tabla(df, tabla, ruta)
+        print(f'guardar_tabla: {time.perf_counter() - inicio:.2f} s, {_tamano_mb(ruta):.1f} MB (con índices)')
+
+
+if __name__ == '__main__':
+    listings_det = pd.read_csv(sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/listings.csv.gz')
+    print(f'listings_det: {listings_det.shape[0]} filas, {listings_det.shape[1]} columnas')
+    comparar(listings_det)
@@ -0,0 +1,186 @@
+"""PIPELINE POR CIUDAD Y DESCARGA EN PARALELO
+
+Los scripts de datos, variables e insights trabajan con las rutas de Madrid (DatosCaso1/...) y una sola descarga, en un
+único proceso. Seguimos varias ciudades y una descarga de Inside Airbnb al mes.
+
+Cada (ciudad, descarga) es una partición independiente con su carpeta de datos:
+
+    datos/<ciudad>/<descarga>/listings.csv, listings.csv.gz, precios_idealista.csv
+                              [calendar.csv.gz, reviews.csv.gz]
+
+y para cada partición, en un proceso del pool:
+
+1. datamart: df y df_preparado en <carpeta>/airbnb.db (incremental.py: incremental si ya existía, si no completo)
+2. calendario y reseñas si están los ficheros (calendario.py, resenas.py)
+3. las tablas que se calculan sobre df_preparado entero (incremental.actualizar_derivadas): sketches de cuantiles de la
+   descarga (sketches.py), tabla de KPIs por distrito, barrio y tipo de alquiler (kpis.py), rejilla hexagonal
+   (rejilla.py), histogramas de ocupación (histogramas.py) y densidad por barrio si está neighbourhoods.geojson
+
+Las particiones no comparten nada, así que con N núcleos se procesan ~N a la vez. Por eso dentro de cada proceso las
+consultas al KD-tree de competencia (competencia.py) van con un solo hilo (workers = 1): con los hilos por defecto
+serían N procesos x N hilos compitiendo por los mismos núcleos.
+
+Al final se juntan en <raiz>/kpis.db los KPIs de todas (tabla kpis, con ciudad y descarga) y los sketches, para
+consultar cuantiles de cualquier ciudad y rango de fechas.
+
+Los criterios de limpieza, el mapa de distritos de idealista y los puntos de interés son los de Madrid. Para otra
+ciudad los precios del m2 tienen que venir con el mismo formato.
+
+Uso:
+
+    python pipeline.py                            # todas las particiones de datos/
+    python pipeline.py datos --procesos 4 --ciudades madrid barcelona --desde 2024-01
+    python pipeline.py --particion madrid 2024-03 DatosCaso1
+"""
+
+import argparse
+import glob
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from calendario import procesar_calendario
+from incremental import actualizar_derivadas, leer_fuentes, reconstruir_completo, reconstruir_incremental
+from persistencia import conectar, guardar_tabla
+from resenas import procesar_resenas
+from sketches import TABLA as TABLA_SKETCHES, crear_tabla
+
+RAIZ = 'datos'
+
+Particion = namedtuple('Particion', ['ciudad', 'descarga', 'carpeta'])
+
+
+def descubrir_particiones(raiz = RAIZ, ciudades = None, desde = None, hasta = None):
+    """Particiones de raiz/<ciudad>/<descarga>/ que tienen listings.csv, filtradas por ciudad y rango de descargas."""
+
+    particiones = []
+    for ruta in sorted(glob.glob(os.path.join(raiz, '*', '*', 'listings.csv'))):
+        carpeta = os.path.dirname(ruta)
+        ciudad, descarga = os.path.basename(os.path.dirname(carpeta)), os.path.basename(carpeta)
+
+        if ciudades is not None and ciudad not in ciudades:
+            continue
+        if (desde is not None and descarga < desde) or (hasta is not None and descarga > hasta):
+            continue
+
+        particiones.append(Particion(ciudad, descarga, carpeta))
+
+    return particiones
+
+
+def procesar_particion(particion, completo = False, workers = 1):
+    """Construye el datamart de una partición y devuelve su tabla de KPIs. Se ejecuta en un proceso del pool, por eso
+    workers (hilos del KD-tree de competencia) es 1."""
+
+    inicio = time.perf_counter()
+    con = os.path.join(particion.carpeta, 'airbnb.db')
+
+    fuentes = leer_fuentes(particion.carpeta)
+    if completo:
+        reconstruir_completo(con, fuentes, workers)
+    else:
+        reconstruir_incremental(con, fuentes, workers)
+
+    calendario = os.path.join(particion.carpeta, 'calendar.csv.gz')
+    if os.path.exists(calendario):
+        procesar_calendario(calendario, con)
+
+    resenas = os.path.join(particion.carpeta, 'reviews.csv.gz')
+    if os.path.exists(resenas):
+        procesar_resenas(resenas, os.path.join(particion.carpeta, 'listings.csv'), con)
+
+    kpis = actualizar_derivadas(con, particion.carpeta, particion.descarga, particion.ciudad)
+
+    return kpis, time.perf_counter() - inicio
+
+
+def combinar(resultados, particiones, con):
+    """Junta en con los KPIs (tabla kpis) y los sketches de las particiones procesadas, reemplazando los que hubiera
+    de esas mismas particiones."""
+
+    kpis = pd.concat(resultados, ignore_index = True)
+
+    conexion = conectar(con)
+    try:
+        # Los KPIs de particiones de ejecuciones anteriores que no se han vuelto a procesar se mantienen
+
+        if conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'kpis'").fetchone():
+            anteriores = pd.read_sql('SELECT * FROM kpis', conexion)
+            procesadas = pd.MultiIndex.from_tuples([(p.ciudad, p.descarga) for p in particiones])
+            anteriores = anteriores.loc[~pd.MultiIndex.from_frame(anteriores[['ciudad', 'descarga']]).isin(procesadas)]
+            kpis = pd.concat([anteriores, kpis], ignore_index = True)
+
+        guardar_tabla(kpis, 'kpis', conexion, indices = ['ciudad', 'descarga', 'nivel'])
+
+        crear_tabla(conexion)
+
+        for particion in particiones:
+            conexion.execute('ATTACH DATABASE ? AS particion', (os.path.join(particion.carpeta, 'airbnb.db'),))
+            conexion.execute(f'INSERT OR REPLACE INTO {TABLA_SKETCHES} SELECT * FROM particion.{TABLA_SKETCHES} '
+                             'WHERE descarga = ? AND ciudad = ?', (particion.descarga, particion.ciudad))
+            conexion.execute('DETACH DATABASE particion')
+    finally:
+        conexion.close()
+
+    return kpis
+
+
+def ejecutar(particiones, procesos = None, completo = False, con = None):
+    """Procesa las particiones en un pool de procesos y combina los resultados en con (por defecto <raiz>/kpis.db).
+
+    Devuelve (kpis combinados, {particion: error}) con las particiones que hayan fallado.
+    """
+
+    if not particiones:
+        raise ValueError('No hay particiones que procesar')
+
+    con = con or os.path.join(os.path.dirname(os.path.dirname(particiones[0].carpeta)) or '.', 'kpis.db')
+
+    resultados, correctas, errores = [], [], {}
+    inicio = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers = procesos) as ejecutor:
+        futuros = {ejecutor.submit(procesar_particion, particion, completo): particion for particion in particiones}
+
+        for futuro in as_completed(futuros):
+            particion = futuros[futuro]
+            try:
+                kpis, segundos = futuro.result()
+            except Exception as error:
+                errores[particion] = error
+                print(f'{particion.ciudad} {particion.descarga}: ERROR {error!r}')
+                continue
+
+            resultados.append(kpis)
+            correctas.append(particion)
+            print(f'{particion.ciudad} {particion.descarga}: {segundos:.1f} s')
+
+    kpis = combinar(resultados, correctas, con) if resultados else pd.DataFrame()
+
+    print(f'{len(correctas)} particiones en {time.perf_counter() - inicio:.1f} s, {len(errores)} con error. KPIs en {con}')
+
+    return kpis, errores
+
+
+if __name__ == '__main__':
+    argumentos = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    argumentos.add_argument('raiz', nargs = '?', default = RAIZ)
+    argumentos.add_argument('--procesos', type = int, default = None)
+    argumentos.add_argument('--ciudades', nargs = '+', default = None)
+    argumentos.add_argument('--desde', default = None)
+    argumentos.add_argument('--hasta', default = None)
+    argumentos.add_argument('--completo', action = 'store_true', help = 'fuerza la reconstrucción completa')
+    argumentos.add_argument('--particion', nargs = 3, action = 'append', metavar = ('CIUDAD', 'DESCARGA', 'CARPETA'),
+                            help = 'partición explícita (se puede repetir), p.e. madrid 2024-03 DatosCaso1')
+    argumentos = argumentos.parse_args()
+
+    if argumentos.particion:
+        particiones = [Particion(*particion) for particion in argumentos.particion]
+    else:
+        particiones = descubrir_particiones(argumentos.raiz, argumentos.ciudades, argumentos.desde, argumentos.hasta)
+
+    ejecutar(particiones, argumentos.procesos, argumentos.completo,
+             con = os.path.join(argumentos.raiz, 'kpis.db') if not argumentos.particion else None)
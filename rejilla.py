@@ -0,0 +1,147 @@
+"""REJILLA HEXAGONAL MULTIRRESOLUCIÓN (TESELAS AGREGADAS)
+
+El análisis geográfico de insights es un mapa de puntos de un solo distrito. Para mapas de calor de toda la ciudad
+(mediana de precio_total, ocupacion, precio_compra y rentabilidad bruta) no hace falta pintar cada inmueble: basta con
+agregar por celdas.
+
+Aquí asignamos cada inmueble a una celda hexagonal en varios niveles de zoom a la vez:
+
+1. proyectamos latitud y longitud a metros con un origen fijo (la Puerta del Sol), para que las celdas sean las mismas
+   en todas las descargas
+2. para cada tamaño de celda calculamos sus coordenadas axiales de hexágono (q, r) con numpy, redondeando en
+   coordenadas cúbicas
+3. agregamos todas las métricas de todos los niveles de una pasada con el cubo (cubo.py)
+
+El resultado es una pirámide de teselas (tabla rejilla) con el nivel, el tamaño, las coordenadas (q, r), el centro
+de la celda en latitud y longitud, el número de inmuebles y las medianas. Los mapas y los informes leen las teselas del
+nivel que necesiten en vez de los inmuebles.
+
+Uso:
+
+    from rejilla import construir_rejilla, guardar_rejilla, leer_rejilla
+    teselas = construir_rejilla(df)
+    guardar_rejilla(teselas, con)
+    leer_rejilla(con, lado = 500)
+"""
+
+import numpy as np
+import pandas as pd
+
+from cache_columnar import guardar_cache, leer_tabla
+from cubo import construir_cubo
+from distancias import PUNTOS_INTERES, R, proyectar_metros
+from motor_variables import MOTOR
+from persistencia import guardar_tabla
+
+# Lado (= radio) del hexágono en metros de cada nivel, de menos a más detalle
+
+LADOS = (2000, 1000, 500, 250, 125)
+
+ORIGEN = PUNTOS_INTERES['sol']
+
+METRICAS_REJILLA = ['precio_total', 'ocupacion', 'precio_compra', 'rentabilidad_bruta']
+
+# Celdas con menos inmuebles que esto no se guardan (una mediana de 1 o 2 inmuebles no dice nada y además los identifica)
+
+MINIMO_INMUEBLES = 3
+
+TABLA = 'rejilla'
+
+
+def hexagono(xy, lado):
+    """Coordenadas axiales (q, r) del hexágono (con vértice arriba) de lado 'lado' que contiene cada punto (x, y)."""
+
+    x, y = xy[:, 0] / lado, xy[:, 1] / lado
+
+    q = np.sqrt(3) / 3 * x - y / 3
+    r = 2 / 3 * y
+
+    # Redondeo en coordenadas cúbicas (q + r + s = 0): se corrige la coordenada con más error de redondeo
+
+    s = -q - r
+    qr, rr, sr = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(qr - q), np.abs(rr - r), np.abs(sr - s)
+
+    corregir_q = (dq > dr) & (dq > ds)
+    corregir_r = ~corregir_q & (dr > ds)
+
+    qr = np.where(corregir_q, -rr - sr, qr)
+    rr = np.where(corregir_r, -qr - sr, rr)
+
+    return qr.astype('int64'), rr.astype('int64')
+
+
+def centro_hexagono(q, r, lado, origen = ORIGEN):
+    """Latitud y longitud del centro de las celdas (q, r)."""
+
+    x = lado * np.sqrt(3) * (q + r / 2)
+    y = lado * 1.5 * r
+
+    lat0, lon0 = np.radians(origen[0]), np.radians(origen[1])
+
+    latitud = np.degrees(lat0 + y / (R * 1000))
+    longitud = np.degrees(lon0 + x / (R * 1000 * np.cos(lat0)))
+
+    return latitud, longitud
+
+
+def _clave(q, r):
+    # Una sola clave entera por celda: q y r caben de sobra en 32 bits cada uno
+
+    return (q << 32) + (r & 0xFFFFFFFF)
+
+
+def construir_rejilla(df, lados = LADOS, metricas = METRICAS_REJILLA, minimo = MINIMO_INMUEBLES, origen = ORIGEN):
+    """Teselas de todos los niveles: nivel, lado, q, r, latitud y longitud del centro, inmuebles y medianas."""
+
+    # rentabilidad_bruta (y cualquier otra variable registrada que falte) la calcula el motor de variables
+
+    faltan = [metrica for metrica in metricas if metrica not in df.columns]
+    if faltan:
+        df = df.join(MOTOR.calcular(df, faltan))
+
+    validos = df.latitude.notna() & df.longitude.notna()
+    df = df.loc[validos]
+
+    xy = proyectar_metros(df.latitude.to_numpy(), df.longitude.to_numpy(), origen = origen)
+
+    celdas = pd.DataFrame({metrica: df[metrica].to_numpy(dtype = 'float64', na_value = np.nan) for metrica in metricas})
+    for nivel, lado in enumerate(lados):
+        celdas[f'celda_{nivel}'] = _clave(*hexagono(xy, lado))
+
+    cubo = construir_cubo(celdas, metricas = metricas, agregaciones = ['count', 'median'],
+                          agrupamientos = [(f'celda_{nivel}',) for nivel in range(len(lados))])
+
+    teselas = []
+    for nivel, lado in enumerate(lados):
+        tabla = cubo[f'celda_{nivel}']
+        clave = tabla.index.to_numpy(dtype = 'int64')
+        q, r = clave >> 32, (clave & 0xFFFFFFFF).astype('int32').astype('int64')
+        latitud, longitud = centro_hexagono(q, r, lado, origen)
+
+        tesela = pd.DataFrame({'nivel': nivel, 'lado': lado, 'q': q, 'r': r, 'latitud': latitud, 'longitud': longitud,
+                               'inmuebles': tabla[metricas[0] + '_count'].to_numpy()})
+        for metrica in metricas:
+            tesela[metrica] = tabla[metrica + '_median'].to_numpy()
+
+        teselas.append(tesela.loc[tesela.inmuebles >= minimo])
+
+    return pd.concat(teselas, ignore_index = True).astype({'nivel': 'int8', 'lado': 'int32', 'inmuebles': 'int32'})
+
+
+def guardar_rejilla(teselas, con):
+    guardar_tabla(teselas, TABLA, con, indices = ['nivel'])
+    guardar_cache(teselas, TABLA, con)
+
+
+def leer_rejilla(con, nivel = None, lado = None):
+    """Teselas guardadas de un nivel (por índice o por lado en metros), o todas."""
+
+    teselas = leer_tabla(TABLA, con)
+
+    if nivel is not None:
+        teselas = teselas.loc[teselas.nivel == nivel]
+    if lado is not None:
+        teselas = teselas.loc[teselas.lado == lado]
+
+    return teselas.reset_index(drop = True)
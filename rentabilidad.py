@@ -0,0 +1,235 @@
+"""RENTABILIDAD BRUTA POR ESCENARIOS DE NEGOCIO
+
+El entregable es una lista corta de barrios y tipologías donde invertir, pero en insights la relación entre lo que se
+cobra y lo que cuesta el inmueble se mira a ojo en los scatter de precio_compra frente a precio_total. Y esa lista
+depende de supuestos de negocio que no están cerrados: el descuento de compra (0.7 frente al 25% del enunciado), los
+metros cuadrados por número de habitaciones o el precio mínimo por noche a partir del que nos interesa un inmueble.
+
+Aquí juntamos las tres palancas en la rentabilidad bruta de cada inmueble (la misma fórmula que rentabilidad_bruta del
+motor de variables: precio por noche x noches ocupadas al año / precio de compra, en %) y la calculamos para todas las
+combinaciones de supuestos a la vez:
+
+- escenarios() es el producto de los valores de cada parámetro (factor_compra, tabla de m2 y precio_minimo)
+- la rentabilidad por inmueble y escenario es una matriz (escenarios x inmuebles) que sale por broadcasting: la parte
+  que depende de la tabla de m2 se calcula una vez por tabla, el factor de compra divide por filas y el precio mínimo
+  deja a nulo los inmuebles que no lo pasan
+- la mediana por grupo (barrio o tipología) se calcula con los inmuebles ordenados por grupo, un tramo de columnas por
+  grupo y todos los escenarios a la vez
+- los N mejores grupos de cada escenario salen con np.argpartition (selección parcial), y solo esos N se ordenan
+
+Cientos de escenarios sobre el datamart completo tardan unos segundos. Los escenarios se procesan por bloques para
+no pasar de BLOQUE valores en memoria.
+
+Uso:
+
+    from rentabilidad import barrido, escenarios
+    rankings = barrido(df, escenarios(factores_compra = [0.7, 0.75], precios_minimos = [19, 30]), top = 10)
+    rankings['barrios']                     # escenario, sus parámetros, posicion, grupo, rentabilidad e inmuebles
+
+    python rentabilidad.py DatosCaso1/airbnb.db
+"""
+
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from cubo import SEPARADOR
+from motor_variables import MOTOR, PARAMETROS
+
+# Valores de cada palanca. El enunciado compra con un 25% de descuento (0.75), nosotros usamos 0.7.
+
+FACTORES_COMPRA = tuple(np.round(np.arange(0.60, 0.801, 0.01), 2))
+
+TABLAS_M2 = {
+    'base': PARAMETROS['m2_por_habitaciones'],
+    'reducida': {1: 40, 2: 60, 3: 80, 4: 100, 5: 130},
+    'amplia': {1: 60, 2: 80, 3: 100, 4: 130, 5: 170},
+}
+
+# Por debajo de 19 no hay nada: limpieza.py ya los descarta al construir el datamart
+
+PRECIOS_MINIMOS = (19, 25, 30, 40, 50)
+
+AGRUPAMIENTOS = {'barrios': ['neighbourhood'], 'tipologias': ['room_type', 'bedrooms_disc']}
+
+COLUMNAS = ['price', 'precio_total', 'ocupacion', 'precio_m2', 'bedrooms', 'neighbourhood', 'room_type',
+            'bedrooms_disc']
+
+TOP = 10
+
+MINIMO_INMUEBLES = 10
+
+BLOQUE = 5_000_000
+
+
+def escenarios(factores_compra = FACTORES_COMPRA, tablas_m2 = TABLAS_M2, precios_minimos = PRECIOS_MINIMOS):
+    """Todas las combinaciones de los valores de los parámetros, una fila por escenario."""
+
+    tablas_m2 = tablas_m2 if isinstance(tablas_m2, dict) else {str(tabla): tabla for tabla in tablas_m2}
+
+    indice = pd.MultiIndex.from_product([list(factores_compra), list(tablas_m2), list(precios_minimos)],
+                                        names = ['factor_compra', 'tabla_m2', 'precio_minimo'])
+
+    resultado = indice.to_frame(index = False)
+    resultado.index.name = 'escenario'
+    resultado.attrs['tablas_m2'] = tablas_m2
+
+    return resultado
+
+
+def _base_por_tabla(df, tablas_m2):
+    # Ingresos anuales / (m2 x precio del m2) de cada inmueble con cada tabla de m2: la rentabilidad con factor_compra 1.
+    # m2 sale del motor de variables (-999 si no hay habitaciones), y sin m2 no hay rentabilidad.
+
+    ingresos = df.precio_total.to_numpy('float64') * df.ocupacion.to_numpy('float64') / 100 * 365
+    precio_m2 = df.precio_m2.to_numpy('float64')
+
+    base = np.empty((len(tablas_m2), len(df)))
+    for fila, tabla in enumerate(tablas_m2.values()):
+        m2 = np.asarray(MOTOR.calcular(df[['bedrooms']], 'm2', m2_por_habitaciones = tabla), dtype = 'float64')
+        valor = m2 * precio_m2
+        base[fila] = ingresos / np.where(valor > 0, valor, np.nan) * 100
+
+    return base
+
+
+def rentabilidades(df, escenarios_, base = None):
+    """Matriz (escenarios x inmuebles) de rentabilidad bruta en %, nula si el inmueble no pasa el precio mínimo."""
+
+    tablas_m2 = escenarios_.attrs.get('tablas_m2', TABLAS_M2)
+    base = _base_por_tabla(df, tablas_m2) if base is None else base
+
+    fila_tabla = pd.Index(list(tablas_m2)).get_indexer(escenarios_.tabla_m2)
+    factor = escenarios_.factor_compra.to_numpy('float64')[:, None]
+    minimo = escenarios_.precio_minimo.to_numpy('float64')[:, None]
+    precio = df.price.to_numpy('float64')[None, :]
+
+    return np.where(precio > minimo, base[fila_tabla] / factor, np.nan)
+
+
+def _grupos(df, dimensiones):
+    # Código de grupo por inmueble (-1 si alguna dimensión es nula) y nombre de cada grupo
+
+    claves = df[dimensiones].astype(object)
+    nulos = claves.isna().any(axis = 1).to_numpy()
+    nombres = claves.astype(str).agg(SEPARADOR.join, axis = 1).where(~nulos)
+
+    codigos, grupos = pd.factorize(nombres, sort = True)
+    return codigos, np.asarray(grupos, dtype = object)
+
+
+def medianas_por_grupo(valores, codigos, n_grupos):
+    """Mediana y número de valores no nulos de cada grupo en cada fila de valores (filas x inmuebles)."""
+
+    validos = codigos >= 0
+    orden = np.argsort(codigos[validos], kind = 'stable')
+    ordenados = valores[:, validos][:, orden]
+
+    limites = np.concatenate([[0], np.cumsum(np.bincount(codigos[validos], minlength = n_grupos))])
+
+    medianas = np.full((len(valores), n_grupos), np.nan)
+    cuentas = np.zeros((len(valores), n_grupos), dtype = 'int64')
+
+    with warnings.catch_warnings():
+        # Grupos en los que ningún inmueble pasa el precio mínimo: la mediana se queda nula
+        warnings.simplefilter('ignore', RuntimeWarning)
+
+        for grupo in range(n_grupos):
+            tramo = ordenados[:, limites[grupo]:limites[grupo + 1]]
+            medianas[:, grupo] = np.nanmedian(tramo, axis = 1)
+            cuentas[:, grupo] = np.count_nonzero(~np.isnan(tramo), axis = 1)
+
+    return medianas, cuentas
+
+
+def mejores(puntos, top):
+    """Índices de las top columnas con más puntos de cada fila, ordenados (selección parcial, sin ordenar la fila)."""
+
+    top = min(top, puntos.shape[1])
+    puntos = np.where(np.isnan(puntos), -np.inf, puntos)
+
+    candidatos = np.argpartition(-puntos, top - 1, axis = 1)[:, :top]
+    orden = np.argsort(-np.take_along_axis(puntos, candidatos, axis = 1), axis = 1, kind = 'stable')
+
+    return np.take_along_axis(candidatos, orden, axis = 1)
+
+
+def ranking(df, escenarios_, dimensiones, top = TOP, minimo_inmuebles = MINIMO_INMUEBLES, base = None):
+    """Los top grupos por mediana de rentabilidad de cada escenario (solo grupos con al menos minimo_inmuebles)."""
+
+    dimensiones = [dimensiones] if isinstance(dimensiones, str) else list(dimensiones)
+    codigos, grupos = _grupos(df, dimensiones)
+    base = _base_por_tabla(df, escenarios_.attrs.get('tablas_m2', TABLAS_M2)) if base is None else base
+
+    tam = max(1, BLOQUE // max(len(df), 1))
+    partes = []
+    for inicio in range(0, len(escenarios_), tam):
+        bloque = escenarios_.iloc[inicio:inicio + tam]
+        medianas, cuentas = medianas_por_grupo(rentabilidades(df, bloque, base), codigos, len(grupos))
+
+        puntos = np.where(cuentas >= minimo_inmuebles, medianas, np.nan)
+        seleccion = mejores(puntos, top)
+        rentabilidad = np.take_along_axis(puntos, seleccion, axis = 1)
+
+        partes.append(pd.DataFrame({
+            'escenario': np.repeat(bloque.index.to_numpy(), seleccion.shape[1]),
+            'posicion': np.tile(np.arange(1, seleccion.shape[1] + 1), len(bloque)),
+            'grupo': grupos[seleccion.ravel()],
+            'rentabilidad_mediana': rentabilidad.ravel(),
+            'inmuebles': np.take_along_axis(cuentas, seleccion, axis = 1).ravel(),
+        }))
+
+    resultado = pd.concat(partes, ignore_index = True)
+    resultado = resultado.loc[resultado.rentabilidad_mediana.notna()]
+
+    return escenarios_.join(resultado.set_index('escenario'), how = 'inner').reset_index()
+
+
+def barrido(df, escenarios_ = None, agrupamientos = AGRUPAMIENTOS, top = TOP, minimo_inmuebles = MINIMO_INMUEBLES):
+    """ranking() de cada agrupamiento (por defecto barrios y tipologías) con todos los escenarios."""
+
+    escenarios_ = escenarios() if escenarios_ is None else escenarios_
+    base = _base_por_tabla(df, escenarios_.attrs.get('tablas_m2', TABLAS_M2))
+
+    return {nombre: ranking(df, escenarios_, dimensiones, top, minimo_inmuebles, base)
+            for nombre, dimensiones in agrupamientos.items()}
+
+
+def estabilidad(ranking_):
+    """En cuántos escenarios aparece cada grupo entre los mejores y su posición mediana."""
+
+    return ranking_.groupby('grupo').agg(escenarios = ('escenario', 'nunique'), posicion_mediana = ('posicion', 'median'),
+                                         rentabilidad_mediana = ('rentabilidad_mediana', 'median')) \
+        .sort_values(['escenarios', 'posicion_mediana'], ascending = [False, True])
+
+
+if __name__ == '__main__':
+    from cache_columnar import leer_tabla
+
+    df = leer_tabla('df_preparado', sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/airbnb.db', columnas = COLUMNAS)
+    casos = escenarios()
+
+    inicio = time.perf_counter()
+    rankings = barrido(df, casos)
+    print(f'{len(casos)} escenarios x {len(df)} inmuebles: {time.perf_counter() - inicio:.2f} s')
+
+    # El escenario de los scripts (0.7, tabla base, 19) tiene que dar lo mismo que rentabilidad_bruta del motor
+
+    actual = casos.loc[(casos.factor_compra == PARAMETROS['factor_compra']) & (casos.tabla_m2 == 'base')
+                       & (casos.precio_minimo == PRECIOS_MINIMOS[0])].index[0]
+    motor = df.assign(rentabilidad_bruta = MOTOR.calcular(df, 'rentabilidad_bruta')) \
+        .groupby('neighbourhood', observed = True).rentabilidad_bruta.agg(['median', 'count'])
+    barrios = rankings['barrios'].loc[rankings['barrios'].escenario == actual].set_index('grupo')
+    print(f'Diferencia con el motor en el escenario actual: '
+          f'{(barrios.rentabilidad_mediana - motor.loc[barrios.index, "median"]).abs().max():.2e}\n')
+
+    for nombre, ranking_ in rankings.items():
+        print(f'{nombre.upper()} (escenario actual)\n')
+        print(ranking_.loc[ranking_.escenario == actual, ['posicion', 'grupo', 'rentabilidad_mediana', 'inmuebles']]
+              .round(2).to_string(index = False))
+        print(f'\n{nombre.upper()} en más escenarios entre los {TOP} mejores\n')
+        print(estabilidad(ranking_).head(TOP).round(2).to_string())
+        print()
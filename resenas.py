@@ -0,0 +1,175 @@
+"""OCUPACIÓN ESTIMADA A PARTIR DE LAS RESEÑAS (REVIEWS.CSV.GZ) POR BLOQUES
+
+La ocupación del script de variables sale de availability_365, que mide sobre todo los días que el propietario bloquea y
+no la demanda real. Inside Airbnb propone otra estimación (modelo "San Francisco") a partir de las reseñas:
+
+    noches reservadas = reseñas / tasa de reseña x max(estancia media, noches mínimas)
+
+- tasa de reseña: qué parte de las estancias deja reseña (50%)
+- estancia media: noches por estancia (3 en Madrid según Inside Airbnb)
+- noches mínimas: si el anuncio exige más noches que la estancia media se usan esas
+- y como máximo un 70% de las noches de cada mes, para no sobreestimar los anuncios con muchas reseñas
+
+reviews.csv.gz tiene una fila por reseña (millones de filas con el texto de los comentarios). Lo leemos por bloques,
+solo listing_id y date, y contamos reseñas por inmueble y mes en un acumulador que se compacta cuando crece. La
+memoria depende del número de inmuebles y meses con reseñas, no del tamaño del fichero.
+
+Resultados (en el datamart):
+
+- resenas_mensual: reseñas por inmueble y mes (AAAAMM)
+- resenas: por inmueble, reseñas y noches estimadas de los últimos 12 meses y ocupacion_resenas (% del año), que se
+  cruza por id con df_preparado
+
+Uso: python resenas.py [DatosCaso1/reviews.csv.gz] [DatosCaso1/listings.csv] [DatosCaso1/airbnb.db]
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache_columnar import leer_tabla
+from ingesta import pico_rss_mb
+from persistencia import abrir, guardar_tabla
+
+TAM_BLOQUE_RESENAS = 1_000_000
+
+MAX_FILAS_ACUMULADOR = 2_000_000
+
+# Parámetros del modelo de ocupación de Inside Airbnb
+
+TASA_RESENA = 0.5
+ESTANCIA_MEDIA = 3
+OCUPACION_MAXIMA = 0.7
+MESES = 12
+
+
+def _reducir(ids, meses, resenas):
+    # Suma las reseñas de las filas con el mismo (id, mes): ordenamos por las dos claves y sumamos por tramos
+
+    orden = np.lexsort((meses, ids))
+    ids, meses, resenas = ids[orden], meses[orden], resenas[orden]
+
+    inicio = np.flatnonzero(np.concatenate([[True], (ids[1:] != ids[:-1]) | (meses[1:] != meses[:-1])])) \
+        if len(ids) else np.empty(0, dtype = 'int64')
+
+    return ids[inicio], meses[inicio], np.add.reduceat(resenas, inicio) if len(ids) else resenas
+
+
+def contar_bloque(bloque):
+    """Reseñas por inmueble y mes (AAAAMM) de un bloque, como tres arrays (ids, meses, reseñas)."""
+
+    fechas = pd.to_datetime(bloque.date.cat.categories, format = '%Y-%m-%d')
+    meses = (fechas.year * 100 + fechas.month).to_numpy().astype('int32')[bloque.date.cat.codes.to_numpy()]
+
+    return _reducir(bloque.listing_id.to_numpy(), meses, np.ones(len(bloque), dtype = 'int32'))
+
+
+def contar_resenas(ruta = 'DatosCaso1/reviews.csv.gz', tam_bloque = TAM_BLOQUE_RESENAS):
+    """Lee las reseñas por bloques y devuelve el número de reseñas por inmueble y mes (resenas_mensual)."""
+
+    lector = pd.read_csv(ruta,
+                         usecols = ['listing_id', 'date'],
+                         dtype = {'listing_id': 'int64', 'date': 'category'},
+                         chunksize = tam_bloque)
+
+    # Acumulador: arrays de (id, mes, reseñas) de los bloques, que se vuelven a reducir cuando pasan de
+    # MAX_FILAS_ACUMULADOR y del doble de lo que quedó en la última reducción (si no, una vez que el resultado pasa del
+    # umbral se reduciría todo el acumulador en cada bloque)
+
+    parciales, filas, reducido = [], 0, 0
+
+    with lector:
+        for bloque in lector:
+            parcial = contar_bloque(bloque)
+            parciales.append(parcial)
+            filas += len(parcial[0])
+
+            if filas > max(MAX_FILAS_ACUMULADOR, 2 * reducido):
+                parciales = [_reducir(*map(np.concatenate, zip(*parciales)))]
+                filas = reducido = len(parciales[0][0])
+
+    ids, meses, resenas = _reducir(*map(np.concatenate, zip(*parciales))) if parciales \
+        else (np.empty(0, dtype = 'int64'), np.empty(0, dtype = 'int32'), np.empty(0, dtype = 'int32'))
+
+    return pd.DataFrame({'id': ids, 'mes': meses.astype('int32'), 'resenas': resenas.astype('int32')})
+
+
+def _meses_atras(mes, meses):
+    # AAAAMM de hace 'meses' meses
+
+    indice = (mes // 100) * 12 + (mes % 100 - 1) - meses
+    return (indice // 12) * 100 + indice % 12 + 1
+
+
+def estimar_noches(mensual, noches_minimas = None, mes_final = None, tasa_resena = TASA_RESENA,
+                   estancia_media = ESTANCIA_MEDIA, ocupacion_maxima = OCUPACION_MAXIMA, meses = MESES):
+    """Reseñas y noches estimadas por inmueble en los últimos meses (hasta mes_final, por defecto el último con reseñas).
+
+    noches_minimas: Series con las noches mínimas de cada inmueble (índice id), p.e. listings.set_index('id').minimum_nights
+    """
+
+    if mes_final is None:
+        mes_final = int(mensual.mes.max()) if len(mensual) else 0
+
+    ventana = mensual.loc[(mensual.mes > _meses_atras(mes_final, meses)) & (mensual.mes <= mes_final)]
+
+    estancia = np.full(len(ventana), float(estancia_media))
+    if noches_minimas is not None:
+        minimas = noches_minimas.reindex(ventana.id).to_numpy(dtype = 'float64', na_value = np.nan)
+        estancia = np.fmax(estancia, minimas)
+
+    dias_mes = pd.to_datetime(ventana.mes.astype(str), format = '%Y%m').dt.days_in_month.to_numpy()
+    noches = np.minimum(ventana.resenas.to_numpy() / tasa_resena * estancia, ocupacion_maxima * dias_mes)
+
+    por_inmueble = pd.DataFrame({'id': ventana.id.to_numpy(), 'resenas_12m': ventana.resenas.to_numpy(),
+                                 'noches_estimadas': noches}) \
+        .groupby('id').sum()
+
+    ultima = mensual.groupby('id').mes.max().rename('ultimo_mes_resena')
+
+    resumen = por_inmueble.join(ultima, how = 'outer').fillna({'resenas_12m': 0, 'noches_estimadas': 0})
+
+    dias_ventana = int(np.sum(pd.period_range(end = pd.Period(str(mes_final), 'M'), periods = meses).days_in_month)) \
+        if mes_final else meses * 365 / 12
+    resumen['ocupacion_resenas'] = resumen.noches_estimadas / dias_ventana * 100
+
+    return resumen.astype({'resenas_12m': 'int32', 'noches_estimadas': 'float32', 'ocupacion_resenas': 'float32',
+                           'ultimo_mes_resena': 'int32'}).reset_index()
+
+
+def procesar_resenas(ruta = 'DatosCaso1/reviews.csv.gz', ruta_listings = 'DatosCaso1/listings.csv',
+                     con = 'DatosCaso1/airbnb.db', tam_bloque = TAM_BLOQUE_RESENAS, **parametros):
+    """Cuenta las reseñas, estima las noches y guarda resenas_mensual y resenas en el datamart."""
+
+    mensual = contar_resenas(ruta, tam_bloque)
+
+    minimas = pd.read_csv(ruta_listings, usecols = ['id', 'minimum_nights']).set_index('id').minimum_nights
+    resumen = estimar_noches(mensual, minimas, **parametros)
+
+    guardar_tabla(mensual, 'resenas_mensual', con, indices = ['id', 'mes'])
+    guardar_tabla(resumen, 'resenas', con)
+
+    return resumen
+
+
+def leer_resumen(con, columnas = None):
+    """Resumen por inmueble de las reseñas si ya se ha procesado (python resenas.py), y si no None."""
+
+    with abrir(con) as conexion:
+        existe = conexion.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'resenas'").fetchone()
+
+    return leer_tabla('resenas', con, columnas) if existe else None
+
+
+if __name__ == '__main__':
+    ruta = sys.argv[1] if len(sys.argv) > 1 else 'DatosCaso1/reviews.csv.gz'
+    ruta_listings = sys.argv[2] if len(sys.argv) > 2 else 'DatosCaso1/listings.csv'
+    con = sys.argv[3] if len(sys.argv) > 3 else 'DatosCaso1/airbnb.db'
+
+    inicio = time.perf_counter()
+    resumen = procesar_resenas(ruta, ruta_listings, con)
+
+    print(resumen.describe())
+    print(f'{len(resumen)} inmuebles, {time.perf_counter() - inicio:.1f} s, pico RSS {pico_rss_mb():.1f} MB')
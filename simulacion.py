@@ -0,0 +1,189 @@
+"""SIMULACIÓN DE MONTECARLO DE LA RENTABILIDAD DE UN INMUEBLE
+
+En insights calculamos la probabilidad de cada nivel de ocupación en cada distrito, pero solo se imprime: para decidir
+una compra nos interesa qué rentabilidad podemos esperar y con qué dispersión, no solo la mediana.
+
+Aquí simulamos la rentabilidad bruta anual (precio por noche x noches ocupadas / precio de compra, en %) de un
+inmueble candidato:
+
+- la ocupación se saca de la distribución empírica de los inmuebles de su grupo (la probabilidad de cada nivel que
+  calcula insights) y el precio por noche de los precios de ese mismo grupo, por separado. Sortear la ocupación de un
+  inmueble del grupo al azar es sortear de esa distribución, y es mucho más rápido que np.random.choice con las
+  probabilidades. Con conjunta = True se sacan parejas (precio, ocupación) de un mismo inmueble, que mantiene la
+  relación entre las dos
+- el grupo es el barrio y la tipología (room_type, bedrooms_disc) del candidato si tiene al menos MINIMO_INMUEBLES; si
+  no, el barrio, y si tampoco, el distrito
+- el precio de compra es el del candidato o, si no se da, la mediana de precio_compra del grupo
+- cada candidato devuelve P10, P50 y P90 (y la media) de las n simulaciones
+
+Los sorteos son vectorizados (un array de n valores por candidato con un np.random.Generator). Cada candidato tiene su
+propia semilla hija de SeedSequence(semilla).spawn(), así que el resultado es el mismo con uno o con varios procesos.
+Con muchos candidatos se reparten en un pool de procesos, como las particiones en pipeline.py.
+
+Uso:
+
+    from simulacion import Candidato, simular, simular_barrios
+    simular(df, [Candidato('Centro', 'Sol', 'Entire home/apt', '02_Dos', precio_compra = 250_000)])
+    simular_barrios(df, n = 1_000_000, procesos = 4)          # un candidato por barrio
+
+    python simulacion.py DatosCaso1/airbnb.db --n 1000000 --procesos 4
+"""
+
+import argparse
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+Candidato = namedtuple('Candidato', ['distrito', 'neighbourhood', 'room_type', 'bedrooms_disc', 'precio_compra'],
+                       defaults = [None, None, None, None])
+
+COLUMNAS = ['distrito', 'neighbourhood', 'room_type', 'bedrooms_disc', 'precio_total', 'ocupacion', 'precio_compra']
+
+N = 100_000
+
+SEMILLA = 2024
+
+MINIMO_INMUEBLES = 20
+
+PERCENTILES = (10, 50, 90)
+
+# Del grupo más concreto al más general
+
+NIVELES = [['neighbourhood', 'room_type', 'bedrooms_disc'], ['neighbourhood'], []]
+
+
+def _grupo(df, candidato, minimo_inmuebles):
+    # Inmuebles del barrio y la tipología del candidato; si son pocos, del barrio, y si no, del distrito
+
+    distrito = df.loc[df.distrito == candidato.distrito]
+
+    for columnas in NIVELES:
+        filtros = {columna: getattr(candidato, columna) for columna in columnas if getattr(candidato, columna) is not None}
+
+        grupo = distrito
+        for columna, valor in filtros.items():
+            grupo = grupo.loc[grupo[columna] == valor]
+
+        if len(grupo) >= minimo_inmuebles:
+            break
+    else:
+        grupo, filtros = distrito, {}
+
+    if set(filtros) - {'neighbourhood'}:
+        return grupo, 'barrio_tipologia'
+    return grupo, 'barrio' if filtros else 'distrito'
+
+
+def preparar(df, candidato, minimo_inmuebles = MINIMO_INMUEBLES):
+    """Lo que necesita simular_candidato: precios y ocupaciones del grupo y el precio de compra."""
+
+    grupo, nivel = _grupo(df, candidato, minimo_inmuebles)
+    grupo = grupo.loc[grupo.precio_total.notna() & grupo.ocupacion.notna()]
+    if grupo.empty:
+        raise ValueError(f'No hay inmuebles para {candidato}')
+
+    precio_compra = candidato.precio_compra
+    if precio_compra is None:
+        precio_compra = float(grupo.precio_compra.where(grupo.precio_compra > 0).median())
+
+    return {
+        'precios': grupo.precio_total.to_numpy('float64'),
+        'ocupaciones': grupo.ocupacion.to_numpy('float64'),
+        'precio_compra': precio_compra,
+        'nivel': nivel,
+    }
+
+
+def simular_candidato(datos, n = N, semilla = SEMILLA, conjunta = False, percentiles = PERCENTILES):
+    """n rentabilidades simuladas de un candidato (datos de preparar) resumidas en sus percentiles y la media."""
+
+    generador = np.random.default_rng(semilla)
+
+    if conjunta:
+        fila = generador.integers(0, len(datos['precios']), size = n)
+        precio, ocupacion = datos['precios'][fila], datos['ocupaciones'][fila]
+    else:
+        precio = datos['precios'][generador.integers(0, len(datos['precios']), size = n)]
+        ocupacion = datos['ocupaciones'][generador.integers(0, len(datos['ocupaciones']), size = n)]
+
+    rentabilidad = precio * ocupacion / 100 * 365 / datos['precio_compra'] * 100
+
+    resumen = dict(zip([f'p{percentil}' for percentil in percentiles], np.percentile(rentabilidad, percentiles)))
+    resumen['media'] = rentabilidad.mean()
+    return resumen
+
+
+def _simular(argumentos):
+    # En los procesos del pool: un candidato ya preparado y su semilla
+    return simular_candidato(*argumentos)
+
+
+def simular(df, candidatos, n = N, semilla = SEMILLA, conjunta = False, procesos = 1,
+            minimo_inmuebles = MINIMO_INMUEBLES):
+    """Percentiles de la rentabilidad bruta simulada de cada candidato, una fila por candidato.
+
+    procesos: con más de uno los candidatos se reparten en un ProcessPoolExecutor (None para todos los núcleos).
+    """
+
+    candidatos = list(candidatos)
+    datos = [preparar(df, candidato, minimo_inmuebles) for candidato in candidatos]
+    semillas = np.random.SeedSequence(semilla).spawn(len(candidatos))
+    tareas = [(dato, n, hija, conjunta) for dato, hija in zip(datos, semillas)]
+
+    if procesos == 1 or len(tareas) < 2:
+        resultados = [_simular(tarea) for tarea in tareas]
+    else:
+        with ProcessPoolExecutor(max_workers = procesos) as ejecutor:
+            resultados = list(ejecutor.map(_simular, tareas, chunksize = max(1, len(tareas) // 32)))
+
+    resumen = pd.DataFrame(resultados)
+    resumen.insert(0, 'precio_compra', [dato['precio_compra'] for dato in datos])
+    resumen.insert(0, 'inmuebles', [len(dato['precios']) for dato in datos])
+    resumen.insert(0, 'nivel', [dato['nivel'] for dato in datos])
+
+    return pd.concat([pd.DataFrame(candidatos, columns = Candidato._fields).drop(columns = 'precio_compra'), resumen],
+                     axis = 1)
+
+
+def simular_barrios(df, n = N, semilla = SEMILLA, conjunta = False, procesos = None, room_type = None,
+                    bedrooms_disc = None):
+    """Un candidato por barrio (con la tipología si se da) y el precio de compra mediano de su grupo."""
+
+    barrios = df[['distrito', 'neighbourhood']].dropna().drop_duplicates().astype(str).sort_values(['distrito', 'neighbourhood'])
+    candidatos = [Candidato(distrito, barrio, room_type, bedrooms_disc) for distrito, barrio in barrios.itertuples(index = False)]
+
+    return simular(df, candidatos, n, semilla, conjunta, procesos)
+
+
+def simular_distritos(df, n = N, semilla = SEMILLA, conjunta = False, procesos = 1):
+    """Un candidato por distrito con el precio de compra mediano del distrito."""
+
+    candidatos = [Candidato(distrito) for distrito in sorted(df.distrito.dropna().astype(str).unique())]
+
+    return simular(df, candidatos, n, semilla, conjunta, procesos)
+
+
+if __name__ == '__main__':
+    from cache_columnar import leer_tabla
+
+    argumentos = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    argumentos.add_argument('con', nargs = '?', default = 'DatosCaso1/airbnb.db')
+    argumentos.add_argument('--n', type = int, default = N)
+    argumentos.add_argument('--procesos', type = int, default = None)
+    argumentos.add_argument('--semilla', type = int, default = SEMILLA)
+    argumentos.add_argument('--conjunta', action = 'store_true', help = 'parejas (precio, ocupación) de un mismo inmueble')
+    argumentos = argumentos.parse_args()
+
+    df = leer_tabla('df_preparado', argumentos.con, columnas = COLUMNAS)
+
+    print(simular_distritos(df, argumentos.n, argumentos.semilla, argumentos.conjunta)
+          .drop(columns = ['neighbourhood', 'room_type', 'bedrooms_disc']).round(2).to_string(index = False))
+
+    inicio = time.perf_counter()
+    barrios = simular_barrios(df, argumentos.n, argumentos.semilla, argumentos.conjunta, argumentos.procesos)
+    print(f'\n{len(barrios)} barrios x {argumentos.n} simulaciones: {time.perf_counter() - inicio:.2f} s\n')
+    print(barrios.sort_values('p50', ascending = False).head(10)
+          .drop(columns = ['room_type', 'bedrooms_disc']).round(2).to_string(index = False))
@@ -0,0 +1,523 @@
+"""GENERADOR DE DATOS SINTÉTICOS DE INSIDE AIRBNB
+
+Los datos reales no están en el repositorio y solo tenemos una descarga de Madrid, así que no hay forma de medir cómo
+se comporta el pipeline con más datos ni de probarlo sin descargarlos.
+
+Aquí generamos una descarga completa con el mismo esquema que Inside Airbnb y precios de idealista:
+
+- listings.csv (resumen, 18 columnas) y listings.csv.gz (detalle, 75 columnas, con texto libre)
+- calendar.csv.gz (365 días por inmueble) y reviews.csv.gz (una fila por reseña)
+- precios_idealista.csv (precio del m2 por distrito con el formato de la web, primera fila el total de Madrid)
+- neighbourhoods.csv y neighbourhoods.geojson (polígonos de Voronoi de los centros de los barrios)
+
+a escala 1 (unos 25.000 inmuebles, como Madrid), 10 o 100, con distribuciones parecidas a las reales: reparto por
+distritos y barrios (la mitad larga en Centro), tipos de alquiler, precios log-normales por distrito y tipo, ocupación
+con inmuebles bloqueados todo el año y reservas en rachas (más en fin de semana), reseñas coherentes con la antigüedad
+y la ocupación, anfitriones con varios inmuebles, ids de 18 cifras en los anuncios nuevos y los nulos de Madrid
+(bathrooms entero a nulos, bedrooms y beds con huecos, valoraciones nulas sin reseñas).
+
+Todo es coherente entre ficheros (mismos id, availability_365 sale del calendario, number_of_reviews de las reseñas,
+el barrio de cada inmueble es el polígono en el que cae) y se escribe por bloques, así que la memoria no crece con la
+escala. Con la misma semilla se generan los mismos datos.
+
+Uso:
+
+    python sintetico.py --escala 10                      # datos_sinteticos/madrid_x10/2024-03-22/
+    python sintetico.py --escala 1 --carpeta DatosCaso1 --sin-calendario
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import Voronoi, cKDTree
+
+INMUEBLES_MADRID = 25_000
+
+DESCARGA = '2024-03-22'
+
+TAM_BLOQUE = 5_000
+
+# Distrito: (latitud y longitud aproximadas del centro, radio en km, peso en la oferta, precio del m2 en idealista,
+# barrios). Los nombres de distrito son los de Inside Airbnb; los de idealista cambian según MAPA_DISTRITOS de limpieza.py
+
+DISTRITOS = {
+    'Centro': (40.4155, -3.7074, 1.0, 35, 6200, ['Palacio', 'Embajadores', 'Cortes', 'Justicia', 'Universidad', 'Sol']),
+    'Arganzuela': (40.3980, -3.6980, 1.3, 5.5, 4800, ['Imperial', 'Acacias', 'Chopera', 'Legazpi', 'Delicias',
+                                                     'Palos de Moguer', 'Atocha']),
+    'Retiro': (40.4110, -3.6760, 1.3, 3.5, 5900, ['Pacífico', 'Adelfas', 'Estrella', 'Ibiza', 'Jerónimos', 'Niño Jesús']),
+    'Salamanca': (40.4290, -3.6770, 1.2, 7, 7500, ['Recoletos', 'Goya', 'Fuente del Berro', 'Guindalera', 'Lista',
+                                                  'Castellana']),
+    'Chamartín': (40.4580, -3.6770, 1.6, 3.5, 6100, ['El Viso', 'Prosperidad', 'Ciudad Jardín', 'Hispanoamérica',
+                                                    'Nueva España', 'Castilla']),
+    'Tetuán': (40.4600, -3.7000, 1.2, 4, 4700, ['Bellas Vistas', 'Cuatro Caminos', 'Castillejos', 'Almenara',
+                                               'Valdeacederas', 'Berruguete']),
+    'Chamberí': (40.4360, -3.7040, 1.0, 6, 6800, ['Gaztambide', 'Arapiles', 'Trafalgar', 'Almagro', 'Rios Rosas',
+                                                 'Vallehermoso']),
+    'Fuencarral - El Pardo': (40.5000, -3.7200, 3.5, 2, 4200, ['El Pardo', 'Fuentelareina', 'Peñagrande', 'Pilar',
+                                                              'La Paz', 'Valverde', 'Mirasierra', 'El Goloso']),
+    'Moncloa - Aravaca': (40.4400, -3.7600, 2.8, 3.5, 5000, ['Casa de Campo', 'Argüelles', 'Ciudad Universitaria',
+                                                            'Valdezarza', 'Valdemarín', 'El Plantío', 'Aravaca']),
+    'Latina': (40.3950, -3.7500, 2.0, 3, 2900, ['Los Cármenes', 'Puerta del Angel', 'Lucero', 'Aluche', 'Campamento',
+                                               'Cuatro Vientos', 'Las Águilas']),
+    'Carabanchel': (40.3800, -3.7300, 2.0, 3.5, 2700, ['Comillas', 'Opañel', 'San Isidro', 'Vista Alegre',
+                                                      'Puerta Bonita', 'Buenavista', 'Abrantes']),
+    'Usera': (40.3800, -3.7050, 1.3, 2.5, 2600, ['Orcasitas', 'Orcasur', 'San Fermín', 'Almendrales', 'Moscardó',
+                                                'Zofío', 'Pradolongo']),
+    'Puente de Vallecas': (40.3900, -3.6600, 1.6, 3, 2500, ['Entrevías', 'San Diego', 'Palomeras Bajas',
+                                                           'Palomeras Sureste', 'Portazgo', 'Numancia']),
+    'Moratalaz': (40.4050, -3.6450, 1.2, 0.8, 3000, ['Pavones', 'Horcajo', 'Marroquina', 'Media Legua', 'Fontarrón',
+                                                    'Vinateros']),
+    'Ciudad Lineal': (40.4400, -3.6500, 1.8, 3.5, 3900, ['Ventas', 'Pueblo Nuevo', 'Quintana', 'Concepción',
+                                                        'San Pascual', 'San Juan Bautista', 'Colina', 'Atalaya',
+                                                        'Costillares']),
+    'Hortaleza': (40.4750, -3.6400, 2.4, 2, 4300, ['Palomas', 'Piovera', 'Canillas', 'Pinar del Rey',
+                                                  'Apostol Santiago', 'Valdefuentes']),
+    'Villaverde': (40.3450, -3.7000, 2.0, 1, 2100, ['San Andrés', 'San Cristobal', 'Butarque', 'Los Rosales',
+                                                   'Los Angeles']),
+    'Villa de Vallecas': (40.3700, -3.6200, 2.4, 0.8, 2800, ['Casco Histórico de Vallecas', 'Santa Eugenia',
+                                                            'Ensanche de Vallecas']),
+    'Vicálvaro': (40.4000, -3.6000, 2.0, 0.5, 2900, ['Casco Histórico de Vicálvaro', 'Valdebernardo', 'Valderrivas',
+                                                    'El Cañaveral']),
+    'San Blas - Canillejas': (40.4300, -3.6100, 2.0, 2.5, 3100, ['Simancas', 'Hellín', 'Amposta', 'Arcos', 'Rosas',
+                                                                'Rejas', 'Canillejas', 'Salvador']),
+    'Barajas': (40.4700, -3.5800, 2.0, 1, 3700, ['Alameda de Osuna', 'Aeropuerto', 'Casco Histórico de Barajas',
+                                                'Timón', 'Corralejos']),
+}
+
+PRECIO_M2_MADRID = 4600
+
+NOMBRES_IDEALISTA = {'Fuencarral - El Pardo': 'Fuencarral', 'Moncloa - Aravaca': 'Moncloa',
+                     'San Blas - Canillejas': 'San Blas'}
+
+TIPOS_ALQUILER = {'Entire home/apt': 0.62, 'Private room': 0.35, 'Shared room': 0.02, 'Hotel room': 0.01}
+
+COLUMNAS_LISTINGS = ['id', 'name', 'host_id', 'host_name', 'neighbourhood_group', 'neighbourhood', 'latitude',
+                     'longitude', 'room_type', 'price', 'minimum_nights', 'number_of_reviews', 'last_review',
+                     'reviews_per_month', 'calculated_host_listings_count', 'availability_365', 'number_of_reviews_ltm',
+                     'license']
+
+COLUMNAS_LISTINGS_DET = [
+    'id', 'listing_url', 'scrape_id', 'last_scraped', 'source', 'name', 'description', 'neighborhood_overview',
+    'picture_url', 'host_id', 'host_url', 'host_name', 'host_since', 'host_location', 'host_about',
+    'host_response_time', 'host_response_rate', 'host_acceptance_rate', 'host_is_superhost', 'host_thumbnail_url',
+    'host_picture_url', 'host_neighbourhood', 'host_listings_count', 'host_total_listings_count', 'host_verifications',
+    'host_has_profile_pic', 'host_identity_verified', 'neighbourhood', 'neighbourhood_cleansed',
+    'neighbourhood_group_cleansed', 'latitude', 'longitude', 'property_type', 'room_type', 'accommodates', 'bathrooms',
+    'bathrooms_text', 'bedrooms', 'beds', 'amenities', 'price', 'minimum_nights', 'maximum_nights',
+    'minimum_minimum_nights', 'maximum_minimum_nights', 'minimum_maximum_nights', 'maximum_maximum_nights',
+    'minimum_nights_avg_ntm', 'maximum_nights_avg_ntm', 'calendar_updated', 'has_availability', 'availability_30',
+    'availability_60', 'availability_90', 'availability_365', 'calendar_last_scraped', 'number_of_reviews',
+    'number_of_reviews_ltm', 'number_of_reviews_l30d', 'first_review', 'last_review', 'review_scores_rating',
+    'review_scores_accuracy', 'review_scores_cleanliness', 'review_scores_checkin', 'review_scores_communication',
+    'review_scores_location', 'review_scores_value', 'license', 'instant_bookable', 'calculated_host_listings_count',
+    'calculated_host_listings_count_entire_homes', 'calculated_host_listings_count_private_rooms',
+    'calculated_host_listings_count_shared_rooms', 'reviews_per_month']
+
+COLUMNAS_CALENDARIO = ['listing_id', 'date', 'available', 'price', 'adjusted_price', 'minimum_nights', 'maximum_nights']
+
+COLUMNAS_RESENAS = ['listing_id', 'id', 'date', 'reviewer_id', 'reviewer_name', 'comments']
+
+FRASES = ['Piso luminoso y recién reformado en pleno corazón de Madrid.', 'A 5 minutos andando del metro.',
+          'Cocina totalmente equipada con lavavajillas y microondas.', 'Aire acondicionado y calefacción en todas las habitaciones.',
+          'Ideal para parejas y familias con niños.', 'Wifi de fibra óptica, perfecto para teletrabajo.',
+          'Edificio clásico con ascensor y portero.', 'Zona tranquila con muchos bares y restaurantes alrededor.',
+          'Bright apartment close to the main sights.', 'Ropa de cama y toallas incluidas.',
+          'Check-in autónomo con cerradura electrónica.', 'Terraza privada con vistas a los tejados de la ciudad.',
+          'Número de registro de vivienda turística disponible.', 'Supermercado y farmacia en la misma calle.']
+
+COMENTARIOS = ['Todo perfecto, el piso es tal cual las fotos.', 'Great location and very responsive host!',
+               'Muy limpio y bien comunicado, repetiríamos sin duda.', 'El anfitrión nos dio muy buenas recomendaciones.',
+               'Un poco ruidoso por la noche pero muy céntrico.', 'Perfect stay, would definitely come back.',
+               'Cama muy cómoda y cocina bien equipada.', 'Check-in fácil y apartamento precioso.']
+
+AMENIDADES = ['Wifi', 'Kitchen', 'Washer', 'Air conditioning', 'Heating', 'Elevator', 'Hair dryer', 'Iron',
+              'Dishwasher', 'Microwave', 'Hot water', 'TV', 'Essentials', 'Coffee maker', 'Balcony', 'Self check-in']
+
+NOMBRES = ['Ana', 'Javier', 'María', 'Carlos', 'Lucía', 'David', 'Elena', 'Pablo', 'Laura', 'Sergio', 'Marta',
+           'Alejandro', 'Sofía', 'Daniel', 'Paula', 'Home Select', 'Madrid Rentals', 'Friendly Rentals']
+
+
+# CATÁLOGO DE BARRIOS Y POLÍGONOS
+
+def catalogo_barrios(semilla = 0):
+    """Tabla de barrios (neighbourhood, neighbourhood_group, centro y peso en la oferta). No depende de la escala."""
+
+    rng = np.random.default_rng(semilla)
+
+    filas = []
+    for distrito, (latitud, longitud, radio, peso, _, barrios) in DISTRITOS.items():
+        # Los barrios se reparten alrededor del centro del distrito; dentro del distrito los pesos son desiguales
+
+        angulos = 2 * np.pi * (np.arange(len(barrios)) / len(barrios) + rng.uniform(0, 1))
+        distancias = radio * np.sqrt(rng.uniform(0.1, 1, len(barrios)))
+        pesos = rng.dirichlet(np.full(len(barrios), 2.0)) * peso
+
+        for barrio, angulo, distancia, peso_barrio in zip(barrios, angulos, distancias, pesos):
+            filas.append({'neighbourhood': barrio, 'neighbourhood_group': distrito,
+                          'latitud': latitud + distancia / 111.2 * np.sin(angulo),
+                          'longitud': longitud + distancia / (111.2 * np.cos(np.radians(latitud))) * np.cos(angulo),
+                          'peso': peso_barrio})
+
+    barrios = pd.DataFrame(filas)
+    barrios['peso'] /= barrios.peso.sum()
+
+    return barrios
+
+
+def poligonos_barrios(barrios, margen = 0.03):
+    """Polígonos de Voronoi de los centros de los barrios recortados a la caja que los contiene.
+
+    Para que todas las regiones sean finitas se añaden las reflexiones de los centros en los cuatro lados de la caja:
+    las regiones de los centros originales quedan cerradas justo en la caja.
+    """
+
+    centros = barrios[['longitud', 'latitud']].to_numpy()
+    x_min, y_min = centros.min(axis = 0) - margen
+    x_max, y_max = centros.max(axis = 0) + margen
+
+    reflejados = [centros,
+                  np.column_stack([2 * x_min - centros[:, 0], centros[:, 1]]),
+                  np.column_stack([2 * x_max - centros[:, 0], centros[:, 1]]),
+                  np.column_stack([centros[:, 0], 2 * y_min - centros[:, 1]]),
+                  np.column_stack([centros[:, 0], 2 * y_max - centros[:, 1]])]
+    voronoi = Voronoi(np.vstack(reflejados))
+
+    poligonos = []
+    for punto in range(len(centros)):
+        vertices = voronoi.vertices[voronoi.regions[voronoi.point_region[punto]]]
+
+        # Ordenamos los vértices por ángulo alrededor del centro y cerramos el anillo
+
+        angulos = np.arctan2(vertices[:, 1] - centros[punto, 1], vertices[:, 0] - centros[punto, 0])
+        anillo = vertices[np.argsort(angulos)]
+        poligonos.append(np.vstack([anillo, anillo[:1]]).round(6))
+
+    return poligonos
+
+
+def escribir_barrios(barrios, carpeta):
+    barrios[['neighbourhood_group', 'neighbourhood']].to_csv(os.path.join(carpeta, 'neighbourhoods.csv'), index = False)
+
+    elementos = [{'type': 'Feature',
+                  'geometry': {'type': 'MultiPolygon', 'coordinates': [[poligono.tolist()]]},
+                  'properties': {'neighbourhood': barrio.neighbourhood, 'neighbourhood_group': barrio.neighbourhood_group}}
+                 for barrio, poligono in zip(barrios.itertuples(), poligonos_barrios(barrios))]
+
+    with open(os.path.join(carpeta, 'neighbourhoods.geojson'), 'w', encoding = 'utf-8') as fichero:
+        json.dump({'type': 'FeatureCollection', 'features': elementos}, fichero, ensure_ascii = False)
+
+
+def escribir_precios_idealista(carpeta):
+    distritos = ['Madrid'] + [NOMBRES_IDEALISTA.get(distrito, distrito) for distrito in DISTRITOS]
+    precios = [PRECIO_M2_MADRID] + [valores[4] for valores in DISTRITOS.values()]
+
+    pd.DataFrame({'table__cell': [f'{precio:,} €/m2'.replace(',', '.') for precio in precios],
+                  'icon-elbow': distritos}) \
+        .to_csv(os.path.join(carpeta, 'precios_idealista.csv'), index = False)
+
+
+# INMUEBLES
+
+def _ids(n, rng):
+    # Los anuncios antiguos tienen ids cortos y crecientes; desde 2022 Airbnb usa ids de 18 cifras
+
+    antiguos = int(n * 0.7)
+    cortos = 6369 + np.cumsum(rng.integers(1, 2 * 50_000_000 // max(antiguos, 1) + 2, antiguos))
+
+    # Sumando la posición a los valores ordenados quedan estrictamente crecientes (sin ids repetidos)
+
+    largos = np.sort(rng.integers(570_000_000_000_000_000, 1_110_000_000_000_000_000, n - antiguos))
+    largos += np.arange(len(largos))
+
+    return np.concatenate([cortos, largos])
+
+
+def _anfitriones(n, rng):
+    # La mayoría de anfitriones tiene un inmueble, unos pocos gestores tienen cientos (ley de potencias)
+
+    tamanos = np.minimum(rng.zipf(1.9, n), max(n // 50, 1))
+    tamanos = tamanos[:np.searchsorted(np.cumsum(tamanos), n) + 1]
+    host_id = np.repeat(rng.choice(np.arange(1_000_000, 600_000_000), len(tamanos), replace = False), tamanos)[:n]
+
+    return rng.permutation(host_id)
+
+
+def _posiciones(barrios, indice_barrios, n, rng):
+    # Se elige barrio por su peso y se reparte alrededor de su centro; el barrio final es el del polígono en el que cae
+    # (el centro más cercano), igual que neighbourhood_cleansed en Inside Airbnb
+
+    elegido = rng.choice(len(barrios), n, p = barrios.peso.to_numpy())
+    dispersion = np.where(barrios.neighbourhood_group.to_numpy()[elegido] == 'Centro', 0.0035, 0.007)
+
+    latitud = barrios.latitud.to_numpy()[elegido] + rng.normal(0, 1, n) * dispersion
+    longitud = barrios.longitud.to_numpy()[elegido] + rng.normal(0, 1, n) * dispersion * 1.3
+
+    _, barrio = indice_barrios.query(np.column_stack([longitud, latitud]))
+
+    return latitud.round(6), longitud.round(6), barrio
+
+
+def _calendario(n, fechas, rng):
+    """Matriz (inmuebles x días) de ocupado: cadena de Markov por inmueble con rachas de reservas de ~4 días."""
+
+    # Un 20% de inmuebles bloqueados todo el año (availability_365 = 0), un 8% sin ninguna reserva
+
+    tipo = rng.random(n)
+    ocupacion = np.where(tipo < 0.2, 1.0, np.where(tipo < 0.28, 0.0, rng.beta(2.2, 2.0, n)))
+
+    salida = 1 / 4                                                         # P(ocupado -> libre)
+    entrada = np.minimum(salida * ocupacion / np.maximum(1 - ocupacion, 1e-9), 1.0)   # P(libre -> ocupado)
+    finde = np.isin(fechas.dayofweek, [4, 5])
+
+    ocupado = np.empty((n, len(fechas)), dtype = bool)
+    ocupado[:, 0] = rng.random(n) < ocupacion
+    for dia in range(1, len(fechas)):
+        azar = rng.random(n)
+        entra = np.minimum(entrada * (1.3 if finde[dia] else 1.0), 1.0)
+        ocupado[:, dia] = np.where(ocupado[:, dia - 1], azar >= salida, azar < entra)
+
+    ocupado[ocupacion == 1.0] = True
+    ocupado[ocupacion == 0.0] = False
+
+    return ocupado
+
+
+def _resenas(n_resenas, inicio_anuncio, descarga, rng):
+    """Fechas (días antes de la descarga) de las reseñas de cada inmueble, ordenadas y como arrays planos."""
+
+    inmueble = np.repeat(np.arange(len(n_resenas)), n_resenas)
+    dias = rng.integers(0, np.repeat(inicio_anuncio, n_resenas) + 1)
+
+    # Más reseñas recientes que antiguas (el mercado ha crecido)
+
+    dias = (dias * rng.random(len(dias)) ** 0.5).astype('int64')
+    orden = np.lexsort((-dias, inmueble))
+
+    return inmueble[orden], descarga - pd.to_timedelta(dias[orden], unit = 'D')
+
+
+def _precio_texto(precio):
+    return pd.Series(precio).map('${:,.2f}'.format).to_numpy()
+
+
+def generar_bloque(ids, host_id, calculated, barrios, indice_barrios, descarga, rng, id_resena):
+    """Las filas de un bloque de inmuebles para cada fichero: (listings, listings_det, calendario, reseñas)."""
+
+    n = len(ids)
+    fechas = pd.date_range(descarga, periods = 365)
+
+    latitud, longitud, barrio = _posiciones(barrios, indice_barrios, n, rng)
+    distrito = barrios.neighbourhood_group.to_numpy()[barrio]
+    precio_m2 = np.array([DISTRITOS[d][4] for d in distrito])
+
+    room_type = rng.choice(list(TIPOS_ALQUILER), n, p = list(TIPOS_ALQUILER.values()))
+    entero = room_type == 'Entire home/apt'
+
+    accommodates = np.where(entero, np.clip(rng.poisson(2.6, n) + 1, 1, 16), rng.choice([1, 2, 2, 3], n))
+    bedrooms = np.where(entero, np.clip(np.ceil(accommodates / 2.2 + rng.normal(0, 0.4, n)), 1, 8), 1).astype(float)
+    beds = np.clip(np.round(accommodates / 1.6 + rng.normal(0, 0.5, n)), 1, 12).astype(float)
+    bedrooms[rng.random(n) < 0.10] = np.nan
+    beds[rng.random(n) < 0.02] = np.nan
+
+    # Precio por noche log-normal: sube con el precio del m2 del distrito y con la capacidad
+
+    factor_tipo = np.select([entero, room_type == 'Hotel room', room_type == 'Shared room'], [1.0, 1.1, 0.3], 0.42)
+    mediana = 22 * (precio_m2 / 1000) ** 0.8 * factor_tipo * (1 + 0.18 * (accommodates - 2).clip(0))
+    price = np.maximum(np.round(mediana * rng.lognormal(0, 0.45, n)), 8)
+
+    # Algunos precios absurdos, como en los datos reales
+
+    atipicos = rng.random(n) < 0.005
+    price[atipicos] = rng.choice([999, 1500, 9999], atipicos.sum())
+
+    minimum_nights = rng.choice([1, 1, 2, 2, 2, 3, 3, 4, 5, 7, 30, 31, 90], n)
+
+    ocupado = _calendario(n, fechas, rng)
+    disponible = ~ocupado
+    availability_365 = disponible.sum(axis = 1)
+
+    # Reseñas: más cuanto más tiempo lleva el anuncio y más se ocupa; un 20% sin ninguna
+
+    antiguedad = np.where(ids > 10**15, rng.integers(1, 730, n), rng.integers(365, 4000, n))
+    intensidad = (365 - availability_365) / 365 * antiguedad / 365 * 20 * np.where(room_type == 'Private room', 0.7, 1.0)
+    n_resenas = np.where(rng.random(n) < 0.2, 0, rng.poisson(intensidad * rng.gamma(1.5, 1 / 1.5, n)))
+
+    inmueble, fechas_resenas = _resenas(n_resenas, antiguedad, pd.Timestamp(descarga) - pd.Timedelta(days = 2), rng)
+    fechas_resenas = pd.Series(fechas_resenas)
+    por_inmueble = pd.DataFrame({'inmueble': inmueble, 'fecha': fechas_resenas}).groupby('inmueble').fecha
+    primera = por_inmueble.min().reindex(range(n))
+    ultima = por_inmueble.max().reindex(range(n))
+
+    recientes = fechas_resenas >= pd.Timestamp(descarga) - pd.Timedelta(days = 365)
+    ltm = np.bincount(inmueble[recientes.to_numpy()], minlength = n)
+    l30d = np.bincount(inmueble[(fechas_resenas >= pd.Timestamp(descarga) - pd.Timedelta(days = 30)).to_numpy()], minlength = n)
+    meses = ((pd.Timestamp(descarga) - primera).dt.days / 30.44).clip(lower = 1)
+    reviews_per_month = (n_resenas / meses).round(2).where(n_resenas > 0)
+
+    ultima_texto = ultima.dt.strftime('%Y-%m-%d')
+    host_name = rng.choice(NOMBRES, n)
+    nombre = np.char.add(rng.choice(['Piso', 'Apartamento', 'Estudio', 'Ático', 'Habitación', 'Loft'], n),
+                         np.char.add(' en ', barrios.neighbourhood.to_numpy()[barrio].astype(str)))
+
+    licencia = np.where(rng.random(n) < 0.15, np.char.add('VT-', rng.integers(1000, 99999, n).astype(str)), None)
+
+    listings = pd.DataFrame({
+        'id': ids, 'name': nombre, 'host_id': host_id, 'host_name': host_name, 'neighbourhood_group': distrito,
+        'neighbourhood': barrios.neighbourhood.to_numpy()[barrio], 'latitude': latitud, 'longitude': longitud,
+        'room_type': room_type, 'price': price.astype('int64'), 'minimum_nights': minimum_nights,
+        'number_of_reviews': n_resenas, 'last_review': ultima_texto.to_numpy(), 'reviews_per_month': reviews_per_month.to_numpy(),
+        'calculated_host_listings_count': calculated, 'availability_365': availability_365, 'number_of_reviews_ltm': ltm,
+        'license': licencia})
+
+    # Detalle: valoraciones sesgadas hacia arriba (casi todas entre 4.5 y 5) y nulas si no hay reseñas
+
+    sin_resenas = n_resenas == 0
+    valoraciones = {columna: np.where(sin_resenas, np.nan, np.round(5 - rng.gamma(1.2, 0.12 + 0.03 * desplazamiento, n), 2).clip(1, 5))
+                    for desplazamiento, columna in enumerate(['review_scores_rating', 'review_scores_accuracy',
+                                                              'review_scores_cleanliness', 'review_scores_checkin',
+                                                              'review_scores_communication', 'review_scores_location',
+                                                              'review_scores_value'])}
+
+    descripciones = np.array([' '.join(rng.choice(FRASES, rng.integers(3, 9), replace = False)) for _ in range(64)])
+    amenidades = np.array([json.dumps(list(rng.choice(AMENIDADES, rng.integers(5, 16), replace = False))) for _ in range(32)])
+    banos = np.where(entero, np.clip(np.round(np.nan_to_num(bedrooms, nan = 1) / 2 + 0.3), 1, 4), 1)
+
+    host_since = (pd.Timestamp(descarga) - pd.to_timedelta(antiguedad + rng.integers(0, 400, n), unit = 'D')).strftime('%Y-%m-%d')
+
+    listings_det = pd.DataFrame({
+        'id': ids,
+        'listing_url': np.char.add('https://www.airbnb.com/rooms/', ids.astype(str)),
+        'scrape_id': int(pd.Timestamp(descarga).strftime('%Y%m%d')) * 10**6 + 21_345,
+        'last_scraped': descarga, 'source': rng.choice(['city scrape', 'previous scrape'], n, p = [0.85, 0.15]),
+        'name': nombre, 'description': descripciones[rng.integers(0, 64, n)],
+        'neighborhood_overview': np.where(rng.random(n) < 0.5, None, descripciones[rng.integers(0, 64, n)]),
+        'picture_url': np.char.add('https://a0.muscache.com/pictures/', np.char.add(ids.astype(str), '.jpg')),
+        'host_id': host_id, 'host_url': np.char.add('https://www.airbnb.com/users/show/', host_id.astype(str)),
+        'host_name': host_name, 'host_since': host_since, 'host_location': 'Madrid, Spain',
+        'host_about': np.where(rng.random(n) < 0.4, None, 'Me encanta viajar y recibir huéspedes.'),
+        'host_response_time': rng.choice(['within an hour', 'within a few hours', 'within a day', None], n, p = [.6, .15, .1, .15]),
+        'host_response_rate': np.where(rng.random(n) < 0.15, None, np.char.add(rng.integers(70, 101, n).astype(str), '%')),
+        'host_acceptance_rate': np.where(rng.random(n) < 0.15, None, np.char.add(rng.integers(40, 101, n).astype(str), '%')),
+        'host_is_superhost': np.where(rng.random(n) < 0.03, None, np.where(rng.random(n) < 0.3, 't', 'f')),
+        'host_thumbnail_url': 'https://a0.muscache.com/im/pictures/user/small.jpg',
+        'host_picture_url': 'https://a0.muscache.com/im/pictures/user/large.jpg',
+        'host_neighbourhood': barrios.neighbourhood.to_numpy()[barrio], 'host_listings_count': calculated,
+        'host_total_listings_count': calculated + rng.integers(0, 3, n), 'host_verifications': "['email', 'phone']",
+        'host_has_profile_pic': 't', 'host_identity_verified': rng.choice(['t', 'f'], n, p = [0.9, 0.1]),
+        'neighbourhood': np.where(rng.random(n) < 0.5, None, 'Madrid, Comunidad de Madrid, Spain'),
+        'neighbourhood_cleansed': barrios.neighbourhood.to_numpy()[barrio], 'neighbourhood_group_cleansed': distrito,
+        'latitude': latitud, 'longitude': longitud,
+        'property_type': np.where(entero, 'Entire rental unit', np.char.add(room_type.astype(str), ' in rental unit')),
+        'room_type': room_type, 'accommodates': accommodates, 'bathrooms': np.nan,
+        'bathrooms_text': np.char.add(banos.astype(int).astype(str), np.where(entero, ' baths', ' shared bath')),
+        'bedrooms': bedrooms, 'beds': beds, 'amenities': amenidades[rng.integers(0, 32, n)],
+        'price': _precio_texto(price), 'minimum_nights': minimum_nights,
+        'maximum_nights': rng.choice([30, 90, 365, 1125], n), 'minimum_minimum_nights': minimum_nights,
+        'maximum_minimum_nights': minimum_nights, 'minimum_maximum_nights': 1125, 'maximum_maximum_nights': 1125,
+        'minimum_nights_avg_ntm': minimum_nights.astype(float), 'maximum_nights_avg_ntm': 1125.0,
+        'calendar_updated': None, 'has_availability': np.where(availability_365 > 0, 't', None),
+        'availability_30': disponible[:, :30].sum(axis = 1), 'availability_60': disponible[:, :60].sum(axis = 1),
+        'availability_90': disponible[:, :90].sum(axis = 1), 'availability_365': availability_365,
+        'calendar_last_scraped': descarga, 'number_of_reviews': n_resenas, 'number_of_reviews_ltm': ltm,
+        'number_of_reviews_l30d': l30d, 'first_review': primera.dt.strftime('%Y-%m-%d').to_numpy(),
+        'last_review': ultima_texto.to_numpy(), **valoraciones, 'license': licencia,
+        'instant_bookable': rng.choice(['t', 'f'], n, p = [0.35, 0.65]), 'calculated_host_listings_count': calculated,
+        'calculated_host_listings_count_entire_homes': np.where(entero, calculated, 0),
+        'calculated_host_listings_count_private_rooms': np.where(entero, 0, calculated),
+        'calculated_host_listings_count_shared_rooms': 0, 'reviews_per_month': reviews_per_month.to_numpy()},
+        columns = COLUMNAS_LISTINGS_DET)
+
+    # Calendario: precio del anuncio con un 15% más los viernes y sábados y algún hueco sin precio
+
+    dias = len(fechas)
+    precio_dia = price[:, None] * np.where(np.isin(fechas.dayofweek, [4, 5]), 1.15, 1.0)
+    precios_texto, codigos = np.unique(np.round(precio_dia.ravel()), return_inverse = True)
+    precio_calendario = _precio_texto(precios_texto)[codigos]
+    precio_calendario[rng.random(n * dias) < 0.01] = ''
+
+    calendario = pd.DataFrame({'listing_id': np.repeat(ids, dias), 'date': np.tile(fechas.strftime('%Y-%m-%d'), n),
+                               'available': np.where(disponible.ravel(), 't', 'f'), 'price': precio_calendario,
+                               'adjusted_price': '', 'minimum_nights': np.repeat(minimum_nights, dias),
+                               'maximum_nights': np.repeat(listings_det.maximum_nights.to_numpy(), dias)})
+
+    resenas = pd.DataFrame({'listing_id': ids[inmueble], 'id': id_resena + np.arange(len(inmueble)),
+                            'date': fechas_resenas.dt.strftime('%Y-%m-%d').to_numpy(),
+                            'reviewer_id': rng.integers(1_000_000, 500_000_000, len(inmueble)),
+                            'reviewer_name': rng.choice(NOMBRES[:15], len(inmueble)),
+                            'comments': rng.choice(COMENTARIOS, len(inmueble))})
+
+    return listings, listings_det, calendario, resenas
+
+
+def generar(carpeta, escala = 1, descarga = DESCARGA, semilla = 0, calendario = True, resenas = True,
+            tam_bloque = TAM_BLOQUE, compresion = 1):
+    """Escribe en carpeta una descarga sintética de INMUEBLES_MADRID x escala inmuebles. Devuelve el número de filas
+    de cada fichero."""
+
+    os.makedirs(carpeta, exist_ok = True)
+    rng = np.random.default_rng(semilla)
+
+    barrios = catalogo_barrios()
+    indice_barrios = cKDTree(barrios[['longitud', 'latitud']].to_numpy())
+    escribir_barrios(barrios, carpeta)
+    escribir_precios_idealista(carpeta)
+
+    n = int(INMUEBLES_MADRID * escala)
+    ids = _ids(n, rng)
+    host_id = _anfitriones(n, rng)
+    _, codigos_host, conteos = np.unique(host_id, return_inverse = True, return_counts = True)
+    calculated = conteos[codigos_host]
+
+    filas = dict.fromkeys(['listings', 'listings_det', 'calendario', 'resenas'], 0)
+    rutas = {'listings': os.path.join(carpeta, 'listings.csv'),
+             'listings_det': os.path.join(carpeta, 'listings.csv.gz'),
+             'calendario': os.path.join(carpeta, 'calendar.csv.gz'),
+             'resenas': os.path.join(carpeta, 'reviews.csv.gz')}
+
+    ficheros = {'listings': open(rutas['listings'], 'w', encoding = 'utf-8', newline = ''),
+                'listings_det': gzip.open(rutas['listings_det'], 'wt', compresslevel = compresion, encoding = 'utf-8', newline = '')}
+    if calendario:
+        ficheros['calendario'] = gzip.open(rutas['calendario'], 'wt', compresslevel = compresion, newline = '')
+    if resenas:
+        ficheros['resenas'] = gzip.open(rutas['resenas'], 'wt', compresslevel = compresion, encoding = 'utf-8', newline = '')
+
+    try:
+        for inicio in range(0, n, tam_bloque):
+            bloque = slice(inicio, inicio + tam_bloque)
+            tablas = generar_bloque(ids[bloque], host_id[bloque], calculated[bloque], barrios, indice_barrios, descarga, rng,
+                                    id_resena = filas['resenas'] + 1)
+
+            for nombre, tabla in zip(['listings', 'listings_det', 'calendario', 'resenas'], tablas):
+                if nombre in ficheros:
+                    tabla.to_csv(ficheros[nombre], index = False, header = inicio == 0)
+                    filas[nombre] += len(tabla)
+    finally:
+        for fichero in ficheros.values():
+            fichero.close()
+
+    return filas
+
+
+if __name__ == '__main__':
+    argumentos = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    argumentos.add_argument('--escala', type = float, default = 1, help = 'múltiplo del tamaño de Madrid (1, 10, 100...)')
+    argumentos.add_argument('--carpeta', default = None)
+    argumentos.add_argument('--descarga', default = DESCARGA)
+    argumentos.add_argument('--semilla', type = int, default = 0)
+    argumentos.add_argument('--sin-calendario', action = 'store_true')
+    argumentos.add_argument('--sin-resenas', action = 'store_true')
+    argumentos = argumentos.parse_args()
+
+    carpeta = argumentos.carpeta or os.path.join('datos_sinteticos', f'madrid_x{argumentos.escala:g}', argumentos.descarga)
+
+    inicio = time.perf_counter()
+    filas = generar(carpeta, argumentos.escala, argumentos.descarga, argumentos.semilla,
+                    calendario = not argumentos.sin_calendario, resenas = not argumentos.sin_resenas)
+
+    print(f'{carpeta}: ' + ', '.join(f'{nombre} {total:,}' for nombre, total in filas.items() if total) +
+          f' filas en {time.perf_counter() - inicio:.1f} s')
@@ -0,0 +1,288 @@
+"""SKETCHES DE CUANTILES COMBINABLES (KLL)
+
+Los KPIs de insights son medianas exactas sobre un groupby en memoria (groupby('distrito').precio_total.median(),
+los datos del scatter por barrio...). Una mediana exacta no se puede combinar: la mediana de enero a marzo no sale de
+las medianas de cada mes, así que para tener histórico habría que volver a cargar todos los inmuebles de cada descarga.
+
+Un sketch KLL es un resumen de tamaño fijo (unos pocos cientos de valores) de una distribución que:
+
+- se construye de una pasada sobre los valores
+- se puede fusionar con otro sketch (otra descarga, otra ciudad) y el resultado es el sketch de la unión
+- responde cualquier cuantil con un error de rango acotado: con k = 200 el cuantil devuelto está, con un 99% de
+  confianza, entre los cuantiles q - 1.3% y q + 1.3% reales (error_rango: 2.296 / k^0.9723), independientemente del
+  número de valores y de cuántas fusiones se hayan hecho
+
+Guardamos un sketch por descarga, ciudad, métrica (precio_total, precio_compra, ocupacion), nivel (total, distrito,
+neighbourhood) y grupo en la tabla sketches. Para sacar la mediana o el p90 por distrito de un rango de fechas se
+fusionan los sketches de esas descargas sin tocar los inmuebles.
+
+Uso:
+
+    from sketches import guardar_sketches, consultar_cuantiles
+    guardar_sketches(df, fecha_descarga('DatosCaso1/listings.csv.gz'), con)
+    ...
+    consultar_cuantiles(con, 'precio_total', 'distrito', cuantiles = (0.5, 0.9), desde = '2023-01-01')
+"""
+
+import struct
+
+import numpy as np
+import pandas as pd
+
+from persistencia import abrir, conectar
+
+K = 200
+
+METRICAS = ['precio_total', 'precio_compra', 'ocupacion']
+
+NIVELES = ['total', 'distrito', 'neighbourhood']
+
+TABLA = 'sketches'
+
+
+def error_rango(k = K):
+    """Error de rango normalizado de un cuantil (99% de confianza) de un sketch KLL con parámetro k."""
+
+    return 2.296 / k ** 0.9723
+
+
+class SketchKLL:
+    """Sketch KLL de cuantiles. Cada nivel h guarda valores que representan 2^h valores originales.
+
+    Las compactaciones se hacen con numpy sobre el nivel entero: se ordena y se sube al nivel siguiente uno de cada
+    dos valores (empezando por el primero o el segundo al azar).
+    """
+
+    C = 2 / 3
+
+    def __init__(self, k = K, semilla = None):
+        self.k = k
+        self.n = 0
+        self.niveles = [np.empty(0)]
+        self.rng = np.random.default_rng(semilla)
+
+    def capacidad(self, nivel):
+        # Los niveles altos (los que más pesan) tienen capacidad k y cada nivel hacia abajo 2/3 de la del siguiente
+
+        return max(2, int(np.ceil(self.k * self.C ** (len(self.niveles) - 1 - nivel))))
+
+    def actualizar(self, valores):
+        """Añade un lote de valores (los nulos se ignoran)."""
+
+        valores = np.asarray(valores, dtype = 'float64')
+        valores = valores[~np.isnan(valores)]
+
+        self.n += len(valores)
+        self.niveles[0] = np.concatenate([self.niveles[0], valores])
+        self._comprimir()
+
+        return self
+
+    def fusionar(self, otro):
+        """Añade a este sketch los valores de otro (el k del resultado es el menor de los dos)."""
+
+        self.k = min(self.k, otro.k)
+        self.n += otro.n
+
+        while len(self.niveles) < len(otro.niveles):
+            self.niveles.append(np.empty(0))
+        for nivel, valores in enumerate(otro.niveles):
+            self.niveles[nivel] = np.concatenate([self.niveles[nivel], valores])
+
+        self._comprimir()
+
+        return self
+
+    def _comprimir(self):
+        nivel = 0
+        while nivel < len(self.niveles):
+            valores = self.niveles[nivel]
+
+            if len(valores) > self.capacidad(nivel):
+                if nivel + 1 == len(self.niveles):
+                    self.niveles.append(np.empty(0))
+
+                valores = np.sort(valores)
+
+                # Si es impar se queda uno en el nivel para que los pesos cuadren
+
+                sobrante = valores[-1:] if len(valores) % 2 else valores[:0]
+                pares = valores[:len(valores) - len(sobrante)]
+
+                self.niveles[nivel] = sobrante
+                self.niveles[nivel + 1] = np.concatenate([self.niveles[nivel + 1], pares[self.rng.integers(2)::2]])
+
+                # Al crecer el número de niveles bajan las capacidades: volvemos a revisar desde abajo
+
+                nivel = 0
+                continue
+
+            nivel += 1
+
+    def _ponderados(self):
+        valores = np.concatenate(self.niveles)
+        pesos = np.concatenate([np.full(len(v), 2 ** nivel, dtype = 'int64') for nivel, v in enumerate(self.niveles)])
+        orden = np.argsort(valores, kind = 'stable')
+
+        return valores[orden], np.cumsum(pesos[orden])
+
+    def cuantil(self, q):
+        """Cuantil (o array de cuantiles) aproximado. NaN si el sketch está vacío."""
+
+        q = np.asarray(q, dtype = 'float64')
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+
+        valores, acumulado = self._ponderados()
+        posiciones = np.searchsorted(acumulado, q * acumulado[-1], side = 'left')
+
+        return valores[np.minimum(posiciones, len(valores) - 1)]
+
+    def rango(self, valor):
+        """Fracción aproximada de valores menores o iguales que valor."""
+
+        if self.n == 0:
+            return np.nan
+
+        valores, acumulado = self._ponderados()
+        posicion = np.searchsorted(valores, valor, side = 'right')
+
+        return acumulado[posicion - 1] / acumulado[-1] if posicion else 0.0
+
+    @property
+    def tamano(self):
+        return sum(len(valores) for valores in self.niveles)
+
+    def a_bytes(self):
+        """Serialización compacta: cabecera (k, n, número de niveles, tamaño de cada nivel) y los valores en float64."""
+
+        tamanos = [len(valores) for valores in self.niveles]
+        cabecera = struct.pack(f'<qqq{len(tamanos)}q', self.k, self.n, len(tamanos), *tamanos)
+
+        return cabecera + np.concatenate(self.niveles).astype('<f8').tobytes()
+
+    @classmethod
+    def desde_bytes(cls, datos, semilla = None):
+        k, n, n_niveles = struct.unpack_from('<qqq', datos)
+        tamanos = struct.unpack_from(f'<{n_niveles}q', datos, 24)
+        valores = np.frombuffer(datos, dtype = '<f8', offset = 24 + 8 * n_niveles).astype('float64')
+
+        sketch = cls(k, semilla)
+        sketch.n = n
+        sketch.niveles = np.split(valores, np.cumsum(tamanos)[:-1])
+
+        return sketch
+
+    def __repr__(self):
+        return f'SketchKLL(k = {self.k}, n = {self.n}, guardados = {self.tamano}, niveles = {len(self.niveles)})'
+
+
+def sketches_por_grupo(df, metrica, nivel, k = K, semilla = 0):
+    """Diccionario grupo -> SketchKLL de la métrica. Se ordena una vez por grupo y cada sketch se llena de un lote."""
+
+    if nivel == 'total':
+        return {'total': SketchKLL(k, semilla).actualizar(df[metrica].to_numpy(dtype = 'float64', na_value = np.nan))}
+
+    codigos, grupos = pd.factorize(df[nivel], sort = True)
+    valores = df[metrica].to_numpy(dtype = 'float64', na_value = np.nan)
+
+    # Las filas sin grupo (código -1) no entran en ningún sketch del nivel
+
+    con_grupo = codigos >= 0
+    codigos, valores = codigos[con_grupo], valores[con_grupo]
+
+    orden = np.argsort(codigos, kind = 'stable')
+    cortes = np.searchsorted(codigos[orden], np.arange(1, len(grupos)))
+
+    return {str(grupo): SketchKLL(k, semilla).actualizar(parte)
+            for grupo, parte in zip(grupos, np.split(valores[orden], cortes))}
+
+
+def crear_tabla(conexion):
+    conexion.execute(f'''CREATE TABLE IF NOT EXISTS {TABLA} (
+                             descarga TEXT NOT NULL,
+                             ciudad TEXT NOT NULL,
+                             metrica TEXT NOT NULL,
+                             nivel TEXT NOT NULL,
+                             grupo TEXT NOT NULL,
+                             n INTEGER NOT NULL,
+                             sketch BLOB NOT NULL,
+                             PRIMARY KEY (descarga, ciudad, metrica, nivel, grupo))''')
+    conexion.execute(f'CREATE INDEX IF NOT EXISTS ix_{TABLA}_consulta ON {TABLA} (metrica, nivel, descarga)')
+
+
+def fecha_descarga(ruta = 'DatosCaso1/listings.csv.gz'):
+    """Fecha (AAAA-MM-DD) de una descarga según sus propios datos: el last_scraped más reciente del listings detallado."""
+
+    return pd.to_datetime(pd.read_csv(ruta, usecols = ['last_scraped']).last_scraped).max().strftime('%Y-%m-%d')
+
+
+def guardar_sketches(df, descarga, con, ciudad = 'madrid', metricas = METRICAS, niveles = NIVELES, k = K):
+    """Calcula y guarda (reemplazando los de esa descarga y ciudad) los sketches de cada métrica, nivel y grupo.
+
+    descarga es la fecha de la descarga de Inside Airbnb en formato AAAA-MM-DD, para poder filtrar por rango.
+    """
+
+    filas = [(descarga, ciudad, metrica, nivel, grupo, sketch.n, sketch.a_bytes())
+             for metrica in metricas if metrica in df.columns
+             for nivel in niveles if nivel == 'total' or nivel in df.columns
+             for grupo, sketch in sketches_por_grupo(df, metrica, nivel, k).items()]
+
+    conexion = conectar(con)
+    try:
+        crear_tabla(conexion)
+        conexion.execute('BEGIN')
+        conexion.execute(f'DELETE FROM {TABLA} WHERE descarga = ? AND ciudad = ?', (descarga, ciudad))
+        conexion.executemany(f'INSERT INTO {TABLA} VALUES (?, ?, ?, ?, ?, ?, ?)', filas)
+        conexion.execute('COMMIT')
+    finally:
+        if conexion is not con:
+            conexion.close()
+
+    return len(filas)
+
+
+def leer_sketches(con, metrica, nivel, desde = None, hasta = None, ciudades = None):
+    """Sketches guardados de una métrica y nivel, fusionados por grupo para las descargas entre desde y hasta (incluidas)."""
+
+    consulta = f'SELECT grupo, sketch FROM {TABLA} WHERE metrica = ? AND nivel = ?'
+    parametros = [metrica, nivel]
+
+    if desde is not None:
+        consulta += ' AND descarga >= ?'
+        parametros.append(desde)
+    if hasta is not None:
+        consulta += ' AND descarga <= ?'
+        parametros.append(hasta)
+    if ciudades is not None:
+        ciudades = [ciudades] if isinstance(ciudades, str) else list(ciudades)
+        consulta += f' AND ciudad IN ({", ".join("?" * len(ciudades))})'
+        parametros += ciudades
+
+    with abrir(con) as conexion:
+        filas = conexion.execute(consulta, parametros).fetchall()
+
+    fusionados = {}
+    for grupo, datos in filas:
+        sketch = SketchKLL.desde_bytes(datos, semilla = 0)
+        if grupo in fusionados:
+            fusionados[grupo].fusionar(sketch)
+        else:
+            fusionados[grupo] = sketch
+
+    return fusionados
+
+
+def consultar_cuantiles(con, metrica, nivel = 'distrito', cuantiles = (0.5, 0.9), desde = None, hasta = None,
+                        ciudades = None):
+    """Cuantiles aproximados por grupo (columnas p50, p90...), con el número de valores y el error de rango."""
+
+    fusionados = leer_sketches(con, metrica, nivel, desde, hasta, ciudades)
+
+    resultado = pd.DataFrame({f'p{round(q * 100):g}': [sketch.cuantil(q) for sketch in fusionados.values()]
+                              for q in cuantiles},
+                             index = pd.Index(list(fusionados), name = nivel))
+    resultado['n'] = [sketch.n for sketch in fusionados.values()]
+    resultado['error_rango'] = [error_rango(sketch.k) for sketch in fusionados.values()]
+
+    return resultado.sort_index()
@@ -0,0 +1,45 @@
+"""El camino de DuckDB (motor_duckdb.py) da los mismos KPIs que el de pandas sobre una descarga sintética (sintetico.py).
+
+    python -m pytest tests
+"""
+
+import shutil
+
+import pytest
+
+pytest.importorskip('duckdb')
+
+from motor_duckdb import TOLERANCIA, comparar_con_pandas, convertir_a_parquet
+from sintetico import generar
+
+
+@pytest.fixture(scope = 'module')
+def carpeta(tmp_path_factory):
+    carpeta = tmp_path_factory.mktemp('sintetico')
+    generar(str(carpeta), escala = 0.1, calendario = False, resenas = False)
+    return carpeta
+
+
+def comprobar(comparacion):
+    faltan = comparacion.loc[comparacion._merge != 'both', ['nivel', 'grupo', '_merge']]
+    assert faltan.empty, f'Grupos que solo están en uno de los caminos:\n{faltan}'
+
+    distintos = comparacion.loc[comparacion.diferencia > TOLERANCIA, ['nivel', 'grupo', 'diferencia']]
+    assert distintos.empty, f'Grupos con diferencias por encima de {TOLERANCIA:g}:\n{distintos}'
+
+
+def test_iguales_con_los_parametros_por_defecto(carpeta):
+    comprobar(comparar_con_pandas(str(carpeta), hilos = 2))
+
+
+def test_iguales_con_otros_parametros(carpeta):
+    comprobar(comparar_con_pandas(str(carpeta), hilos = 2, precio_minimo = 40, tipos_excluidos = ['Hotel room',
+                                                                                                   'Shared room']))
+
+
+def test_iguales_desde_parquet(carpeta, tmp_path):
+    for fichero in carpeta.iterdir():
+        shutil.copy(fichero, tmp_path)
+    convertir_a_parquet(str(tmp_path))
+
+    comprobar(comparar_con_pandas(str(tmp_path), hilos = 2))
@@ -0,0 +1,28 @@
+"""VARIABLES DERIVADAS DEL DATAMART (df_preparado)
+
+Los mismos KPIs y transformaciones del script de variables (precio_total, ocupacion, discretizaciones, m2,
+precio_compra y distancias a puntos de interés), calculados con el motor de variables (motor_variables.py) sobre
+cualquier subconjunto de inmuebles.
+
+Las discretizaciones de accommodates, beds y number_of_reviews se hacen con los percentiles de los datos. Si solo
+recalculamos unos pocos inmuebles (modo incremental) no podemos sacar los percentiles de ese subconjunto, así que
+crear_variables devuelve también los cortes usados y acepta unos cortes ya calculados.
+"""
+
+from motor_variables import MOTOR, SALIDAS_PDI, cortes_discretizacion
+
+VARIABLES = ['precio_total', 'ocupacion', 'bedrooms_disc', 'accommodates_disc', 'beds_disc', 'number_of_reviews_disc',
+             'm2', 'precio_compra'] + SALIDAS_PDI
+
+
+def crear_variables(df, cortes = None, **parametros):
+    """Devuelve (df con las variables derivadas, cortes de las discretizaciones).
+
+    Los parámetros de negocio (factor_compra, m2_por_habitaciones...) se pueden cambiar como en MOTOR.calcular.
+    """
+
+    cortes = dict(cortes or cortes_discretizacion(df, parametros))
+
+    variables = MOTOR.calcular(df, VARIABLES, cortes_disc = cortes, **parametros)
+
+    return df.drop(columns = VARIABLES, errors = 'ignore').join(variables), cortes